@@ -0,0 +1,98 @@
+from typing import List, Optional, Union
+from datetime import datetime, timedelta
+
+from pandas import DataFrame, MultiIndex, Series, Timestamp, to_timedelta
+from numpy import ndarray, full, nan
+
+from comopt.model.utils import initialize_index, initialize_series
+
+
+class ColumnarLog:
+    """
+    A log of float values per datetime, and optionally per device (or any other second index), stored as one
+    preallocated float64 array per column. Rows are addressed by integer offsets from the start of the log, so
+    values for a whole horizon can be read and written as array slices instead of label-based lookups.
+    The log can be used with the same column names as the DataFrame it replaces, and to_frame() gives a
+    DataFrame (with a MultiIndex for a second index) for printing and plotting.
+        columns:
+            Column names. Columns that are not declared are created (filled with nan) on first assignment.
+        second_index:
+            Optional labels of the second dimension of each column (e.g. the device types of an EMS).
+        index_names:
+            Names of the index levels of the DataFrame returned by to_frame().
+    """
+
+    def __init__(
+        self,
+        columns: List[str],
+        start: datetime,
+        end: datetime,
+        resolution: timedelta,
+        second_index: Optional[List] = None,
+        index_names: Optional[List[str]] = None,
+    ):
+        self.index = initialize_index(start, end, resolution)
+        self.start = Timestamp(start)
+        self.resolution = to_timedelta(resolution)
+        self.second_index = list(second_index) if second_index is not None else None
+        self.index_names = index_names
+
+        if self.second_index is None:
+            self.shape = (len(self.index),)
+        else:
+            self.shape = (len(self.index), len(self.second_index))
+        self.columns = dict()
+        for column in columns:
+            self.add_column(column)
+
+    def add_column(self, column: str):
+        if column not in self.columns:
+            self.columns[column] = full(self.shape, nan, dtype="float64")
+        return self.columns[column]
+
+    def offset(self, dt: datetime) -> int:
+        """Integer row of a datetime."""
+        return int((Timestamp(dt) - self.start) // self.resolution)
+
+    def window(self, start: datetime, end: datetime) -> slice:
+        """Rows of the datetimes from start up to (but excluding) end."""
+        return slice(self.offset(start), self.offset(end))
+
+    def __getitem__(self, column: str) -> ndarray:
+        return self.columns[column]
+
+    def __setitem__(self, column: str, values: Union[float, ndarray]):
+        self.add_column(column)[...] = values
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def get_series(
+        self, column: str, start: datetime, end: datetime, device: Optional[int] = None
+    ) -> Series:
+        """Values of a column from start up to (but excluding) end, as a Series."""
+        values = self.columns[column][self.window(start, end)]
+        if device is not None:
+            values = values[:, device]
+        return initialize_series(
+            values.copy(), start=start, end=end, resolution=self.resolution
+        )
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> DataFrame:
+        """DataFrame view of the log (a copy), indexed by datetime (and the second index, if any)."""
+        if columns is None:
+            columns = list(self.columns.keys())
+        if self.second_index is None:
+            df = DataFrame(
+                {column: self.columns[column] for column in columns}, index=self.index
+            )
+            if self.index_names is not None:
+                df.index.name = self.index_names[0]
+        else:
+            df = DataFrame(
+                {column: self.columns[column].ravel() for column in columns},
+                index=MultiIndex.from_product(
+                    iterables=[self.index, self.second_index], names=self.index_names
+                ),
+            )
+        return df[columns]
@@ -0,0 +1,207 @@
+from typing import Iterator, List, Optional, Tuple
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+from pandas import DataFrame, Timestamp, to_timedelta
+
+from comopt.data_structures.commitments import (
+    PiecewiseConstantProfileCommitment as Commitment
+)
+
+
+def as_nanoseconds(dt) -> int:
+    return Timestamp(dt).value
+
+
+class CommitmentStore:
+    """
+    A list of commitments with an interval index, for selecting the commitments that apply to a time window.
+    Commitments are grouped by duration, and within each group their starts are kept sorted. A commitment of
+    duration d overlaps the window [a, b) if its start lies in (a - d, b), so each group answers a window query
+    with two bisections, i.e. in O(log n + k) for k applicable commitments per group (there are only a few
+    durations in practice, e.g. the simulation period and the flex trade horizon).
+    Commitments keep their insertion order, so that e.g. the energy contract of an EMS stays the first commitment.
+    With sparse=True, commitments with nan values (i.e. committed over part of their window only) are stored as
+    sparse runs (see Commitment.to_sparse), while fully committed ones (e.g. the energy contract) are kept dense.
+    """
+
+    def __init__(
+        self, commitments: Optional[List[Commitment]] = None, sparse: bool = False
+    ):
+        self.sparse = sparse
+        self.commitments = []
+        self.groups = dict()  # Per duration (in ns): a sorted list of starts (in ns) and the matching positions
+        for commitment in commitments if commitments is not None else []:
+            self.append(commitment)
+
+    def append(self, commitment: Commitment):
+        position = len(self.commitments)
+        if self.sparse is True and np.isnan(commitment.values).any():
+            commitment = commitment.to_sparse()
+        self.commitments.append(commitment)
+        self.index(commitment, position)
+
+    def index(self, commitment: Commitment, position: int):
+        start = as_nanoseconds(commitment.start)
+        duration = as_nanoseconds(commitment.end) - start
+        starts, positions = self.groups.setdefault(duration, ([], []))
+        i = bisect_right(starts, start)
+        starts.insert(i, start)
+        positions.insert(i, position)
+
+    def extend(self, commitments: List[Commitment]):
+        for commitment in commitments:
+            self.append(commitment)
+
+    def __iter__(self) -> Iterator[Commitment]:
+        return iter(self.commitments)
+
+    def __len__(self) -> int:
+        return len(self.commitments)
+
+    def __getitem__(self, item):
+        return self.commitments[item]
+
+    def copy(self) -> List[Commitment]:
+        """A plain list of the commitments (in insertion order)."""
+        return list(self.commitments)
+
+    def overlapping(self, time_window: Tuple[datetime, datetime]) -> List[int]:
+        """Positions of the commitments that overlap the time window, in insertion order."""
+        window_start = as_nanoseconds(time_window[0])
+        window_end = as_nanoseconds(time_window[1])
+        positions = []
+        for duration, (starts, group_positions) in self.groups.items():
+            lo = bisect_right(starts, window_start - duration)
+            hi = bisect_left(starts, window_end)
+            positions.extend(group_positions[lo:hi])
+        return sorted(positions)
+
+    def settle(self, now: datetime) -> List[Commitment]:
+        """Remove the commitments whose window lies entirely before now, and return them (in insertion order)."""
+        now = as_nanoseconds(now)
+        settled = [c for c in self.commitments if as_nanoseconds(c.end) <= now]
+        if settled:
+            self.commitments = [
+                c for c in self.commitments if as_nanoseconds(c.end) > now
+            ]
+            self.groups = dict()
+            for position, commitment in enumerate(self.commitments):
+                self.index(commitment, position)
+        return settled
+
+    def select(
+        self, time_window: Tuple[datetime, datetime], slice: bool = False
+    ) -> List[Commitment]:
+        """Select commitments that apply to the given time window (see select_applicable).
+        Sliced commitments hold a view on the values of the stored commitment where it covers the whole window."""
+        applicable_commitments = [
+            self.commitments[position] for position in self.overlapping(time_window)
+        ]
+        if slice is True:
+            return [
+                slice_commitment(commitment, time_window)
+                for commitment in applicable_commitments
+            ]
+        return applicable_commitments
+
+
+def slice_commitment(
+    commitment: Commitment, time_window: Tuple[datetime, datetime]
+) -> Commitment:
+    """Cut off the commitment outside of the time window, and fill missing data with nan values."""
+    resolution = to_timedelta(commitment.resolution).value
+    commitment_start = as_nanoseconds(commitment.start)
+    window_start = as_nanoseconds(time_window[0])
+    offset = (window_start - commitment_start) // resolution
+    number_of_values = (as_nanoseconds(time_window[1]) - window_start) // resolution
+
+    values = commitment.window(offset, number_of_values)
+
+    return Commitment(
+        label=commitment.label,
+        constants=values,
+        deviation_cost_curve=commitment.deviation_cost_curve,
+        start=time_window[0],
+        end=time_window[1],
+        resolution=commitment.resolution,
+    )
+
+
+def trim_commitment(commitment: Commitment) -> Commitment:
+    """Cut off the nan values (i.e. no commitment) at both ends of the commitment, keeping a view on its values.
+    Commitments without any committed value are returned as they are."""
+    if commitment.sparse:
+        if len(commitment.runs) == 0:
+            return commitment
+        first = commitment.run_offsets[0]
+        last = commitment.run_offsets[-1] + len(commitment.runs[-1]) - 1
+    else:
+        committed = np.flatnonzero(~np.isnan(commitment.values))
+        if len(committed) == 0:
+            return commitment
+        first, last = committed[0], committed[-1]
+    if first == 0 and last == commitment.length - 1:
+        return commitment
+    resolution = to_timedelta(commitment.resolution)
+    start = Timestamp(commitment.start) + first * resolution
+    end = Timestamp(commitment.start) + (last + 1) * resolution
+    return Commitment(
+        label=commitment.label,
+        constants=commitment.window(first, last + 1 - first),
+        deviation_cost_curve=commitment.deviation_cost_curve,
+        costs=commitment.costs,
+        start=start.to_pydatetime(),
+        end=end.to_pydatetime(),
+        resolution=resolution.to_pytimedelta(),
+        sparse=commitment.sparse,
+    )
+
+
+class SettledCommitmentLedger:
+    """
+    Compact record of settled commitments: only their label, window, costs and committed energy (the sum of the
+    committed flow times the flow unit multiplier) are kept, rather than the commitments themselves.
+    """
+
+    def __init__(self, flow_unit_multiplier: float = 1):
+        self.flow_unit_multiplier = flow_unit_multiplier
+        self.labels = []
+        self.starts = []
+        self.ends = []
+        self.costs = []
+        self.energy = []
+
+    def extend(self, commitments: List[Commitment]):
+        for commitment in commitments:
+            self.labels.append(commitment.label)
+            self.starts.append(Timestamp(commitment.start))
+            self.ends.append(Timestamp(commitment.end))
+            self.costs.append(
+                commitment.costs if commitment.costs is not None else np.nan
+            )
+            committed_values = (
+                commitment.runs if commitment.sparse else [commitment.values]
+            )
+            self.energy.append(
+                sum(float(np.nansum(values)) for values in committed_values)
+                * self.flow_unit_multiplier
+            )
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def total_costs(self) -> float:
+        return float(np.nansum(np.array(self.costs, dtype="float64")))
+
+    def to_frame(self) -> DataFrame:
+        return DataFrame(
+            {
+                "Label": self.labels,
+                "Start": self.starts,
+                "End": self.ends,
+                "Costs": np.array(self.costs, dtype="float64"),
+                "Energy": self.energy,
+            }
+        )
@@ -1,12 +1,13 @@
 from typing import List, Optional, Tuple, Union
 from datetime import datetime, timedelta
+from bisect import bisect_right
 
 from pandas import Series, to_timedelta
 import numpy as np
 from numpy import ndarray
 import matplotlib.pyplot as plt
 
-from comopt.model.utils import initialize_series
+from comopt.model.utils import initialize_index, initialize_series
 
 
 class DeviationCostCurve:
@@ -67,51 +68,70 @@ class DeviationCostCurve:
             self.gradient_down = gradient * flow_unit_multiplier
             self.gradient_up = gradient * flow_unit_multiplier
         self.power = power
-        self.func = None
         self.callback = callback
+
+        # The cost function is compiled once, and evaluates scalars as well as NumPy arrays of quantities
+        self.func = self.compile_cost_function()
         return
 
-    def cost_decorator(func):
-        def wrapper(self, quantity):
-            if self.function_type == "Block":
-                assert self.epsilon is not None, "No EPSILON VALUE - Please pass one!"
-                assert (
-                    self.cost_step is not None
-                ), "No COST_STEP VALUE - Please pass one!"
-                self.func = (
-                    lambda x: 0
-                    if self.origin - self.epsilon
-                    < quantity
-                    < self.origin + self.epsilon
-                    else self.cost_step
-                )
-
-            if self.function_type == "Linear":
-                assert self.gradient is not None, "No GRADIENT VALUE - Please pass one!"
-                self.func = (
-                    lambda quantity: quantity * self.gradient_up
-                    if quantity >= 0
-                    else -quantity * self.gradient_down
-                )
-
-            if self.function_type == "Power":
-                assert self.power is not None, "No POWER VALUE - Please pass one!"
-                self.func = lambda quantity: np.abs(quantity ** self.power)
-
-            if self.function_type == "Callback":
-                assert self.callback is not None
-                self.func = self.callback
-            return func(self, quantity)
-
-        return wrapper
-
-    @cost_decorator
-    def get_costs(self, quantity):
-        return self.func(quantity)
+    def compile_cost_function(self):
+        """Return a vectorized cost function for the function type, or None if no function type is set.
+        Callbacks should accept (and return) NumPy arrays."""
+        if self.function_type == "Block":
+            assert self.epsilon is not None, "No EPSILON VALUE - Please pass one!"
+            assert self.cost_step is not None, "No COST_STEP VALUE - Please pass one!"
+            lower = self.origin - self.epsilon
+            upper = self.origin + self.epsilon
+            cost_step = self.cost_step
+            return lambda quantity: np.where(
+                (lower < quantity) & (quantity < upper), 0, cost_step
+            )
+
+        if self.function_type == "Linear":
+            assert (
+                self.gradient_up is not None and self.gradient_down is not None
+            ), "No GRADIENT VALUE - Please pass one!"
+            gradient_up = self.gradient_up
+            gradient_down = self.gradient_down
+            return lambda quantity: np.where(
+                quantity >= 0, quantity * gradient_up, -quantity * gradient_down
+            )
+
+        if self.function_type == "Power":
+            assert self.power is not None, "No POWER VALUE - Please pass one!"
+            power = self.power
+            return lambda quantity: np.abs(quantity ** power)
+
+        if self.function_type == "Callback":
+            assert self.callback is not None
+            return self.callback
+        return None
+
+    def __getstate__(self):
+        # The compiled cost function is not picklable, so it is compiled again after unpickling
+        state = self.__dict__.copy()
+        state["func"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.func = self.compile_cost_function()
+
+    def get_costs(self, quantity: Union[float, ndarray]) -> Union[float, ndarray]:
+        """Costs of deviating by the given quantity, or by each of an array of quantities."""
+        if self.func is None:
+            raise Exception(
+                "No cost function for function type %s." % self.function_type
+            )
+        quantity = np.asarray(quantity, dtype="float64")
+        costs = np.asarray(self.func(quantity), dtype="float64")
+        if quantity.ndim == 0:
+            return costs.item()
+        return costs
 
     def plot(self, quantity=None):
         x1 = np.linspace(-30, 30, 1000)
-        y1 = [self.get_costs(x) for x in x1]
+        y1 = self.get_costs(x1)
         plt.plot(x1, y1, drawstyle="steps", label="committed profile")
         return plt.show()
 
@@ -126,6 +146,9 @@ class PiecewiseConstantProfileCommitment:
             or energy drawn from the grid (=positive net_demand), for each timeperiod .
     deviation_cost_curve:
             Indicates deviation cost curve that gets assigned for each timeperiod.
+    sparse:
+            Store only the runs of committed (non-nan) values, as (offset, values) pairs, instead of a dense array.
+            Dense values are then only materialised on request (see values and window).
     """
 
     def __init__(
@@ -139,7 +162,7 @@ class PiecewiseConstantProfileCommitment:
         resolution: timedelta = None,
         costs: float = None,
         flow_unit_multiplier: float = None, 
-
+        sparse: bool = False,
     ):
         self.label = label
         self.deviation_cost_curve = deviation_cost_curve
@@ -147,20 +170,130 @@ class PiecewiseConstantProfileCommitment:
         if isinstance(constants, (list, ndarray)) or constants is None:
             if start is None or end is None or resolution is None:
                 raise Exception("Missing time information at initialization.")
-            self.constants = initialize_series(constants, start, end, resolution)
             self.start = start
             self.end = end
-            self.duration = end - start
             self.resolution = resolution
+            number_of_values = int((end - start) / resolution)
+            if (
+                isinstance(constants, ndarray)
+                and constants.dtype == np.float64
+                and constants.shape == (number_of_values,)
+            ):
+                # Keep float arrays as they are, e.g. views on the values of another commitment
+                values = constants
+            else:
+                values = np.full(number_of_values, np.nan, dtype="float64")
+                if constants is not None:
+                    values[:] = constants
         else:
-            self.constants = constants
             self.start = constants.index.values[0]
             self.resolution = to_timedelta(constants.index.freq)
             self.end = constants.index.values[-1] + self.resolution
-            self.duration = self.end - self.start
+            values = np.ascontiguousarray(constants.values, dtype="float64")
+        self.duration = self.end - self.start
+        self.length = len(values)
+        self._constants = None
+
+        if sparse is True:
+            self._values = None
+            self.run_offsets, self.runs = find_runs(values)
+        else:
+            self._values = values
+            self.run_offsets, self.runs = None, None
+
+    @property
+    def sparse(self) -> bool:
+        return self._values is None
+
+    @property
+    def values(self) -> ndarray:
+        """The constants as a dense array (materialised from the runs for sparse commitments)."""
+        if self._values is not None:
+            return self._values
+        return self.window(0, self.length)
+
+    def window(self, offset: int, number_of_values: int) -> ndarray:
+        """Dense values from an offset (in number of resolution steps from the start of the commitment), padded with
+        nan values outside of the commitment. Where possible, this is a view rather than a copy."""
+        if self._values is not None:
+            if 0 <= offset and offset + number_of_values <= self.length:
+                return self._values[offset : offset + number_of_values]
+            runs = [(0, self._values)]
+            first_run = 0
+        else:
+            runs = list(zip(self.run_offsets, self.runs))
+            # The last run starting at or before the offset is the first one that can overlap the window
+            first_run = max(bisect_right(self.run_offsets, offset) - 1, 0)
+            if runs and first_run < len(runs):
+                run_offset, run = runs[first_run]
+                if run_offset <= offset and offset + number_of_values <= run_offset + len(run):
+                    return run[offset - run_offset : offset - run_offset + number_of_values]
+
+        values = np.full(number_of_values, np.nan, dtype="float64")
+        for run_offset, run in runs[first_run:]:
+            if run_offset >= offset + number_of_values:
+                break
+            first = max(run_offset, offset)
+            last = min(run_offset + len(run), offset + number_of_values)
+            if first < last:
+                values[first - offset : last - offset] = run[first - run_offset : last - run_offset]
+        return values
+
+    def to_sparse(self) -> "PiecewiseConstantProfileCommitment":
+        """A sparse copy of the commitment (or the commitment itself, if it is sparse already)."""
+        if self.sparse:
+            return self
+        return PiecewiseConstantProfileCommitment(
+            label=self.label,
+            constants=self._values,
+            deviation_cost_curve=self.deviation_cost_curve,
+            start=self.start,
+            end=self.end,
+            resolution=self.resolution,
+            costs=self.costs,
+            sparse=True,
+        )
+
+    @property
+    def constants(self) -> Series:
+        """The constants as a Series, sharing its data with the values array (for dense commitments).
+        Sparse commitments materialise a new Series on each call, so writing to it would be lost: its values are
+        read-only, and writing to them raises a ValueError."""
+        if self._constants is not None:
+            return self._constants
+        values = self.values
+        if self.sparse:
+            values = values.view()
+            values.setflags(write=False)
+        constants = Series(
+            values,
+            index=initialize_index(self.start, self.end, self.resolution),
+            copy=False,
+        )
+        if not self.sparse:
+            self._constants = constants
+        return constants
+
+    def cost_vector(self, quantities: Union[List[float], ndarray]) -> ndarray:
+        return self.deviation_cost_curve.get_costs(np.asarray(quantities, dtype="float64"))
+
+    def get_total_costs(self, quantities: Union[List[float], ndarray]) -> float:
+        return float(np.sum(self.cost_vector(quantities)))
+
+    def deviation_costs(self, quantities: Union[List[float], ndarray]) -> ndarray:
+        """Costs of deviating from the constants with the given quantities (e.g. the power of an EMS over the
+        duration of the commitment), per datetime. Datetimes without commitment (nan constants) cost nothing."""
+        values = self.values
+        deviations = np.asarray(quantities, dtype="float64") - values
+        committed = ~np.isnan(values)
+        costs = self.deviation_cost_curve.get_costs(np.where(committed, deviations, 0))
+        return np.where(committed, costs, 0)
 
-    def cost_vector(self, quantities: List[float]):
-        return [self.deviation_cost_curve.get_costs(q) for q in quantities]
 
-    def get_total_costs(self, quantities: List[float]):
-        return sum(self.cost_vector(quantities))
+def find_runs(values: ndarray) -> Tuple[List[int], List[ndarray]]:
+    """Offsets and (copied) values of the runs of non-nan values."""
+    committed = np.concatenate(([0], (~np.isnan(values)).astype("int8"), [0]))
+    edges = np.diff(committed)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts.tolist(), [values[s:e].copy() for s, e in zip(starts, ends)]
@@ -0,0 +1,83 @@
+from typing import List, Optional
+from datetime import datetime, timedelta
+
+from pandas import DataFrame, MultiIndex, Timestamp, date_range, to_timedelta
+from numpy import empty, nan, void
+
+NEGOTIATION_LOG_COLUMNS = [
+    "Clearing price",
+    "Cleared",
+    "MA reservation price",
+    "TA reservation price",
+    "TA Counter reservation price",
+    "MA markup",
+    "TA markup",
+    "TA Counter markup",
+    "MA bid",
+    "TA bid",
+    "TA Counter offer",
+    "MA profit",
+    "TA profit",
+]
+
+
+class NegotiationLog:
+    """
+    A log of the values of each negotiation round, stored as a preallocated structured array with a float field
+    per column, indexed by (step, round). Steps are integer offsets from the start of the log, so a round is written
+    in place through its record (see record) instead of with label-based lookups.
+    to_frame() gives the DataFrame (indexed by datetime and round) for printing and plotting.
+        rounds_total:
+            Number of rounds per negotiation. Rounds are counted from 1.
+    """
+
+    def __init__(
+        self,
+        start: datetime,
+        end: datetime,
+        resolution: timedelta,
+        rounds_total: int,
+        columns: Optional[List[str]] = None,
+    ):
+        self.start = Timestamp(start)
+        self.resolution = to_timedelta(resolution)
+        self.index = date_range(start, end, freq=resolution)
+        self.rounds_total = rounds_total
+        self.columns = list(columns if columns is not None else NEGOTIATION_LOG_COLUMNS)
+        self.data = empty(
+            (len(self.index), rounds_total),
+            dtype=[(column, "float64") for column in self.columns],
+        )
+        for column in self.columns:
+            self.data[column] = nan
+
+    def offset(self, dt: datetime) -> int:
+        """Integer step of a datetime. Datetimes outside of the log raise an IndexError, rather than wrapping around."""
+        step = int((Timestamp(dt) - self.start) // self.resolution)
+        if not 0 <= step < len(self.index):
+            raise IndexError(
+                "Datetime {} is outside of the negotiation log ({} to {}).".format(dt, self.index[0], self.index[-1])
+            )
+        return step
+
+    def record(self, dt: datetime, round: int) -> void:
+        """The record of a negotiation round, which writes through to the log, e.g. record["MA bid"] = 10."""
+        if not 1 <= round <= self.rounds_total:
+            raise IndexError("Round {} is outside of the negotiation log (1 to {}).".format(round, self.rounds_total))
+        return self.data[self.offset(dt), round - 1]
+
+    def __getitem__(self, column: str):
+        """Values of a column, per step and round."""
+        return self.data[column]
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> DataFrame:
+        """DataFrame view of the log (a copy), indexed by datetime and round."""
+        if columns is None:
+            columns = self.columns
+        return DataFrame(
+            {column: self.data[column].ravel() for column in columns},
+            index=MultiIndex.from_product(
+                iterables=[self.index, range(1, self.rounds_total + 1)],
+                names=["Datetime", "Round"],
+            ),
+        )
@@ -0,0 +1,148 @@
+from typing import Dict, List, Tuple
+from datetime import datetime
+from random import getrandbits
+
+from pandas import DataFrame, Index, MultiIndex
+from numpy import ndarray, asarray, empty, full, linspace, nan, searchsorted, unique, zeros
+from numpy.random import default_rng
+
+
+class QTable:
+    """
+    Q-values and action counts of a Q-learning policy, stored as 2-D float arrays indexed by (round, action).
+    Actions are addressed by integer indices, resolved once from the labels of the action function, so that
+    choosing and updating an action during a negotiation round needs no label-based lookups.
+    Exploration functions work on a row of Q-values with a row of uniform noise, which is drawn in blocks ahead of
+    time (see draw_noise), and on a scratch row (buffer), so choosing an action allocates no arrays.
+    to_frame() gives the labelled DataFrames (indexed by round, with a column per action) for plotting.
+        actions:
+            Action labels and their values, as returned by an action function with show_actions=True.
+        rounds_total:
+            Number of rounds per negotiation, i.e. the number of states. Rounds are counted from 1.
+        noise_rows:
+            Number of noise rows drawn at once. The generator is seeded from the random module, so that runs
+            with a seed are reproducible.
+    """
+
+    def __init__(
+        self, actions: Dict[str, float], rounds_total: int, noise_rows: int = 1024
+    ):
+        self.actions = list(actions.keys())
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.rounds_total = rounds_total
+        self.q_values = zeros((rounds_total, len(self.actions)), dtype="float64")
+        self.action_counts = zeros((rounds_total, len(self.actions)), dtype="float64")
+        self.buffer = empty(len(self.actions), dtype="float64")
+        self.random = default_rng(getrandbits(64))
+        self.noise = empty((noise_rows, len(self.actions)), dtype="float64")
+        self.noise_row = noise_rows
+
+    def __len__(self) -> int:
+        """Number of actions."""
+        return len(self.actions)
+
+    def row(self, round: int) -> ndarray:
+        """Q-values of a round (a view)."""
+        return self.q_values[round - 1]
+
+    def counts(self, round: int) -> ndarray:
+        """Action counts of a round (a view)."""
+        return self.action_counts[round - 1]
+
+    def draw_noise(self) -> ndarray:
+        """Next row of uniform noise in [0, 1), with a value per action. A new block of rows is drawn (in place)
+        when all rows have been used."""
+        if self.noise_row == len(self.noise):
+            self.random.random(out=self.noise)
+            self.noise_row = 0
+        noise = self.noise[self.noise_row]
+        self.noise_row += 1
+        return noise
+
+    def update(
+        self, round: int, action: int, reward: float, alpha: float, gamma: float
+    ):
+        """Q[s, a] = Q[s, a] + alpha*(reward + gamma*max(Q[s+1, :]) - Q[s, a]), and count the action.
+        After the last round there is no next state to learn from (its Q-values count as 0)."""
+        state = round - 1
+        next_max = (
+            self.q_values[state + 1].max() if round < self.rounds_total else 0
+        )
+        self.q_values[state, action] += alpha * (
+            reward + gamma * next_max - self.q_values[state, action]
+        )
+        self.action_counts[state, action] += 1
+
+    def to_frame(self, counts: bool = False) -> DataFrame:
+        """DataFrame of the Q-values (or the action counts), with a row per round and a column per action."""
+        return DataFrame(
+            data=(self.action_counts if counts else self.q_values).copy(),
+            index=Index(range(1, self.rounds_total + 1), name="Rounds"),
+            columns=self.actions,
+        )
+
+
+class QTableSnapshots:
+    """
+    Snapshots of a Q-table, taken at a fixed set of simulation steps and stored in two preallocated
+    (snapshot x round x action) float arrays, for the Q-values and the action counts. Taking a snapshot copies
+    the tables into their slot, so memory is bounded by the number of snapshots, which is set up front.
+        q_table:
+            The Q-table to take snapshots of (for its shape and action labels).
+        steps:
+            Steps at which snapshots are taken, e.g. see snapshot_steps.
+    """
+
+    def __init__(self, q_table: QTable, steps: ndarray):
+        self.actions = list(q_table.actions)
+        self.rounds_total = q_table.rounds_total
+        self.steps = unique(asarray(steps, dtype="int"))
+        shape = (len(self.steps), self.rounds_total, len(self.actions))
+        self.q_values = full(shape, nan, dtype="float64")
+        self.action_counts = full(shape, nan, dtype="float64")
+        self.timeperiods = [None] * len(self.steps)
+        self.taken = zeros(len(self.steps), dtype="bool")
+
+    def __len__(self) -> int:
+        """Number of snapshots taken."""
+        return int(self.taken.sum())
+
+    def take(self, q_table: QTable, step: int, timeperiod: datetime = None) -> bool:
+        """Copy the Q-table into the slot of the step, if a snapshot is due at that step."""
+        i = searchsorted(self.steps, step)
+        if i == len(self.steps) or self.steps[i] != step:
+            return False
+        self.q_values[i] = q_table.q_values
+        self.action_counts[i] = q_table.action_counts
+        self.timeperiods[i] = timeperiod
+        self.taken[i] = True
+        return True
+
+    def select(
+        self, number: int = None, counts: bool = False
+    ) -> List[Tuple[int, ndarray]]:
+        """Steps and tables (views of shape round x action) of the snapshots taken,
+        or of a number of them that are evenly spread over the snapshots taken (e.g. to plot learning curves)."""
+        taken = self.taken.nonzero()[0]
+        if number is not None and number < len(taken):
+            taken = taken[linspace(0, len(taken) - 1, num=number, dtype="int")]
+        tables = self.action_counts if counts else self.q_values
+        return [(int(self.steps[i]), tables[i]) for i in taken]
+
+    def to_frame(self, counts: bool = False) -> DataFrame:
+        """DataFrame of all snapshots taken, indexed by step and round, with a column per action."""
+        taken = self.taken.nonzero()[0]
+        tables = self.action_counts if counts else self.q_values
+        return DataFrame(
+            data=tables[taken].reshape(-1, len(self.actions)),
+            index=MultiIndex.from_product(
+                iterables=[self.steps[taken], range(1, self.rounds_total + 1)],
+                names=["Step", "Rounds"],
+            ),
+            columns=self.actions,
+        )
+
+
+def snapshot_steps(total_steps: int, number: int) -> ndarray:
+    """Evenly spaced steps (from the first to the last step) at which to take a number of snapshots."""
+    return unique(linspace(1, total_steps, num=number, dtype="int", endpoint=True))
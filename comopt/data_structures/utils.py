@@ -1,20 +1,25 @@
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from datetime import datetime
 
 from comopt.data_structures.commitments import (
     PiecewiseConstantProfileCommitment as Commitment
 )
+from comopt.data_structures.commitment_store import CommitmentStore
 from comopt.model.utils import initialize_index
 
 
 def select_applicable(
-    commitments: List[Commitment],
+    commitments: Union[List[Commitment], CommitmentStore],
     time_window: Tuple[datetime, datetime],
     slice: bool = False,
 ) -> List[Commitment]:
     """Select commitments that apply to the given time window.
     If slice = True, then we cut off any commitments outside of the given time window
-    and fill missing data with nan values."""
+    and fill missing data with nan values.
+    A CommitmentStore answers the query with its interval index."""
+
+    if isinstance(commitments, CommitmentStore):
+        return commitments.select(time_window, slice=slice)
 
     if commitments and slice is True:
         ix = initialize_index(
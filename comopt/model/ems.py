@@ -1,7 +1,10 @@
 from typing import List, Optional, Tuple, Union
+from datetime import datetime
 
-from pandas import DataFrame, Series, isnull, IndexSlice, set_option
-from numpy import array, nan, isnan, around
+from pandas import DataFrame, Series, Timestamp, isnull, IndexSlice, set_option
+from numpy import array, nan, isnan, around, full, zeros, flatnonzero
+from numpy import all as all_of
+from time import perf_counter
 
 from warnings import simplefilter
 simplefilter(action='ignore', category=FutureWarning)
@@ -11,14 +14,27 @@ from comopt.data_structures.commitments import (
     PiecewiseConstantProfileCommitment as Commitment,
 )
 from comopt.data_structures.usef_message_types import DeviceMessage, UdiEvent
+from comopt.data_structures.columnar_log import ColumnarLog
+from comopt.data_structures.commitment_store import (
+    CommitmentStore,
+    SettledCommitmentLedger,
+    trim_commitment,
+)
 from comopt.data_structures.utils import select_applicable
 from comopt.model.utils import initialize_df, initialize_series, initialize_index, create_multi_index_log
 
-from comopt.solver.ems_solver import device_scheduler
+from comopt.solver.ems_solver import (
+    device_scheduler,
+    PersistentDeviceScheduler,
+    schedule_from_given_power,
+    record_scheduler_path,
+)
+from comopt.solver.instrumentation import record_solver_call
 from comopt.utils import Agent
 from comopt.model.utils import (
     select_prognosis_or_planned_prefix,
     store_prices_per_device,
+    store_power_per_device,
     store_contract_costs_per_device,
     store_flexibility_per_device,
 
@@ -60,7 +76,16 @@ class EMS(Agent):
         self.ems_constraints = ems_constraints
         self.device_messages_cnt = 1
         self.flex_price = flex_price
-        self.commitments = [
+
+        # Keep the scheduling models alive between steps, unless configured otherwise
+        if self.environment.solver_parameter["Persistent"]:
+            self.device_scheduler = PersistentDeviceScheduler(
+                self.environment.solver_parameter
+            )
+        else:
+            self.device_scheduler = device_scheduler
+
+        self.commitments = CommitmentStore([
             Commitment(
                 label="Energy contract",
                 constants=initialize_series(
@@ -75,7 +100,12 @@ class EMS(Agent):
                     flow_unit_multiplier=self.environment.flow_unit_multiplier,
                 ),
             )
-        ]  # The initial commitment simply states prices for consuming and producing (i.e. for deviating from 0)
+        ], sparse=True)  # The initial commitment simply states prices for consuming and producing (i.e. for deviating from 0)
+
+        # Commitments whose window has elapsed (see step)
+        self.settled_commitments = SettledCommitmentLedger(
+            flow_unit_multiplier=self.environment.flow_unit_multiplier
+        )
 
         # TODO: Loop and refactor
         # TODO: use planboard messages instead of instance variable
@@ -95,11 +125,13 @@ class EMS(Agent):
                       ]
 
         # Stores data per device and datetime [first_index: datetime, second_index: devices]
-        self.device_data = create_multi_index_log(
-            first_index=self.commitments[0].constants.index,
+        self.device_data = ColumnarLog(
+            columns=columns_device_data,
+            start=self.environment.start,
+            end=self.environment.end,
+            resolution=self.environment.resolution,
             second_index=self.device_types,
             index_names=["Datetime", "Device"],
-            column_names=columns_device_data
             )
         # Abbreviations: "Prog" = Prognosis, "Plan" = Planned, "Real" = Realised, "Dev"= Deviation
         columns_ems_data=[
@@ -110,14 +142,33 @@ class EMS(Agent):
                   "Prog dev costs", "Plan dev costs", "Real dev costs", \
                   "Prog total costs", "Plan total costs", "Real total costs", \
                   "Prog commitment costs", "Plan commitment costs", "Real commitment costs", \
+                  "Prog flex costs", "Plan flex costs", "Real flex costs", \
                   "Purchase price", "Feedin price", "Dev price up", "Dev price down", \
+                  "Deviation price up", "Deviation price down", "Requested flexibility", \
                   ]
 
         # Stores aggregated device data per datetime
-        self.ems_data = initialize_df(
-            columns_ems_data, environment.start, environment.end, environment.resolution
+        self.ems_data = ColumnarLog(
+            columns=columns_ems_data,
+            start=environment.start,
+            end=environment.end,
+            resolution=environment.resolution,
+            index_names=["Datetime"],
         )
 
+        # Baseline schedule of the devices against the commitments of the EMS only (see serve_baseline): kept per
+        # datetime for the whole simulation where no device has stock bounds, and per window otherwise
+        self.baseline_power = full((len(self.device_constraints), len(self.ems_data.index)), nan)
+        self.baseline_valid = zeros(len(self.ems_data.index), dtype=bool)
+        self.baseline_window = None  # (start, end, power per device)
+        self.stock_bounded = zeros(len(self.ems_data.index), dtype=bool)
+        for constraints in self.device_constraints:
+            self.stock_bounded |= (
+                (constraints["max"].notnull() | constraints["min"].notnull())
+                .reindex(self.ems_data.index, fill_value=False)
+                .values
+            )
+
         second_index_horizon_data = [x for x in self.device_types]
         second_index_horizon_data.extend(["Total Costs", "Flexibility"])
         self.horizon_data = create_multi_index_log(
@@ -130,6 +181,55 @@ class EMS(Agent):
 
         # self.horizon_data.set_index('Costs',append=True, inplace=True)
 
+    def schedule_devices(
+        self,
+        device_constraints: List[DataFrame],
+        ems_constraints: DataFrame,
+        commitments: List[Commitment],
+        caller: str = None,
+    ) -> Tuple[List[Series], List[float]]:
+        """Schedule the devices of the EMS against the given commitments, using the scheduler of the EMS."""
+        return self.run_scheduler(
+            self.scheduler_input(
+                device_constraints, ems_constraints, commitments, caller=caller
+            )
+        )
+
+    def run_scheduler(self, scheduler_input: dict) -> Tuple[List[Series], List[float]]:
+        """Run the scheduler of the EMS. Identical scheduling problems are looked up in the scheduler cache of the
+        environment, if any."""
+        if self.environment.scheduler_cache is not None:
+            return self.environment.scheduler_cache.schedule(
+                self.device_scheduler, **scheduler_input
+            )
+        return self.device_scheduler(**scheduler_input)
+
+    def scheduler_input(
+        self,
+        device_constraints: List[DataFrame],
+        ems_constraints: DataFrame,
+        commitments: List[Commitment],
+        caller: str = None,
+    ) -> dict:
+        """Keyword arguments of the device scheduler for the given commitments. The caller (e.g. "Prognosis")
+        describes the call in the solver call log."""
+        return dict(
+            device_constraints=device_constraints,
+            ems_constraints=ems_constraints,
+            commitment_quantities=[commitment.constants for commitment in commitments],
+            commitment_downwards_deviation_price=[
+                commitment.deviation_cost_curve.gradient_down
+                for commitment in commitments
+            ],
+            commitment_upwards_deviation_price=[
+                commitment.deviation_cost_curve.gradient_up
+                for commitment in commitments
+            ],
+            formulation=self.environment.solver_parameter["Formulation"],
+            solver_parameter=self.environment.solver_parameter,
+            call_info={"Caller": caller, "EMS": self.name},
+        )
+
     def get_initial_device_schedule(self):
 
         device_constraints = [
@@ -149,73 +249,161 @@ class EMS(Agent):
         #     commitments, (self.environment.datetime_index[0],self.environment.datetime_index[-1]), slice=True
         # )
 
-        scheduled_power_per_device, costs_per_commitment = device_scheduler(
+        scheduled_power_per_device, costs_per_commitment = self.schedule_devices(
             device_constraints=device_constraints,
             ems_constraints=ems_constraints,
-            commitment_quantities=[
-                commitment.constants for commitment in commitments
-            ],
-            commitment_downwards_deviation_price=[
-                commitment.deviation_cost_curve.gradient_down
-                for commitment in commitments
-            ],
-            commitment_upwards_deviation_price=[
-                commitment.deviation_cost_curve.gradient_up
-                for commitment in commitments
-            ],
+            commitments=commitments,
+            caller="Initial schedule",
         )
-
-
-        print(scheduled_power_per_device)
-
-        # print(düster)
         return
 
 
     def post_udi_event(self, device_message: DeviceMessage) -> UdiEvent:
         """Callback function to have the EMS create and post a UdiEvent."""
 
+        scheduler_input, applicable_commitments = self.prepare_udi_event(device_message)
+
+        solution = self.serve_baseline(device_message, scheduler_input)
+        if solution is None:
+            solution = self.run_scheduler(scheduler_input)
+            self.keep_baseline(device_message, solution)
+        scheduled_power_per_device, costs_per_commitment = solution
+
+        return self.complete_udi_event(
+            device_message,
+            applicable_commitments,
+            scheduled_power_per_device,
+            costs_per_commitment,
+        )
+
+    def serve_baseline(
+        self, device_message: DeviceMessage, scheduler_input: dict
+    ) -> Optional[Tuple[List[Series], List[float]]]:
+        """Serve the schedule for a DeviceMessage that doesn't commit to anything (e.g. the prognosis request, whose
+        targeted power is all nan with a zero deviation cost gradient) from the baseline schedule of the EMS, i.e.
+        its schedule against its own commitments only.
+        The baseline only depends on the scheduler input: the window, the commitments of the EMS and the device and
+        EMS constraints (which don't change during the simulation). It is therefore kept until commitments or device
+        state change (see invalidate_baseline).
+        Where no device has stock bounds, the scheduling problem is separable per datetime, so the baseline of a
+        datetime doesn't depend on the window it is scheduled in. It is then kept per datetime, and only the datetimes
+        that are no longer valid are rescheduled. Otherwise the baseline is kept for the window it was last solved for
+        (see keep_baseline).
+        Returns None if the schedule should be solved for instead."""
+
+        if len(self.device_constraints) == 0 or not is_baseline_request(device_message):
+            return None
+        tic = perf_counter()
+        start, end = Timestamp(device_message.start), Timestamp(device_message.end)
+        resolution = self.environment.resolution
+        window = self.ems_data.window(start, end)
+
+        if self.stock_bounded[window].any():
+            if self.baseline_window is None or self.baseline_window[:2] != (start, end):
+                return None
+            power = self.baseline_window[2]
+        else:
+            # Reschedule the datetimes where the baseline is no longer valid
+            invalid = flatnonzero(~self.baseline_valid[window])
+            if len(invalid) > 0:
+                invalid_start = start + int(invalid[0]) * resolution
+                invalid_end = start + (int(invalid[-1]) + 1) * resolution
+                baseline_input, _ = self.select_scheduler_input(
+                    invalid_start, invalid_end, caller="Baseline"
+                )
+                power_per_device, _ = self.run_scheduler(baseline_input)
+                invalid_window = self.ems_data.window(invalid_start, invalid_end)
+                self.baseline_power[:, invalid_window] = [power.values for power in power_per_device]
+                self.baseline_valid[invalid_window] = True
+            power = self.baseline_power[:, window]
+
+        solution = schedule_from_given_power(scheduler_input, power)
+        record_scheduler_path("Baseline")
+        if self.environment.solver_parameter["Instrumentation"]:
+            record_solver_call(
+                scheduler_input["call_info"],
+                "Baseline",
+                power.shape + (len(scheduler_input["commitment_quantities"]),),
+                perf_counter() - tic,
+            )
+        return solution
+
+    def keep_baseline(
+        self, device_message: DeviceMessage, solution: Tuple[List[Series], List[float]]
+    ):
+        """Keep the schedule solved for a DeviceMessage that doesn't commit to anything as the baseline of its window,
+        if the window has stock bounds (see serve_baseline)."""
+        if len(self.device_constraints) == 0 or not is_baseline_request(device_message):
+            return
+        if self.stock_bounded[self.ems_data.window(device_message.start, device_message.end)].any():
+            self.baseline_window = (
+                Timestamp(device_message.start),
+                Timestamp(device_message.end),
+                array([power.values for power in solution[0]]),
+            )
+
+    def invalidate_baseline(self, start: datetime, end: datetime):
+        """Mark the baseline schedule to be recomputed between start and end, e.g. for the window of a new
+        commitment. The baseline kept for a window with stock bounds is dropped altogether."""
+        self.baseline_valid[self.ems_data.window(start, end)] = False
+        self.baseline_window = None
+
+    def prepare_udi_event(self, device_message: DeviceMessage) -> Tuple[dict, List]:
+        """Select the constraints and applicable commitments for a DeviceMessage, and return the input of the device
+        scheduler together with the applicable commitments. The scheduling itself can then be done elsewhere,
+        e.g. in another process (see TradingAgent.collect_udi_events)."""
+
         # TODO: use planboard messages instead of instance variable
         # self.device_messages.loc[device_message.start] = device_message
 
         # Todo: create udi_event based on targets (from FlexRequest), by including the target in the previous commitments lists
+        return self.select_scheduler_input(
+            device_message.start,
+            device_message.end,
+            [device_message.commitment],
+            caller=device_message.description,
+        )
+
+    def select_scheduler_input(
+        self,
+        start: datetime,
+        end: datetime,
+        commitments: Optional[List[Commitment]] = None,
+        caller: str = None,
+    ) -> Tuple[dict, List]:
+        """Select the constraints and applicable commitments for a time window, adding the given commitments,
+        and return the input of the device scheduler together with the applicable commitments."""
         device_constraints = [
-            device_constraints.loc[
-                device_message.start : device_message.end - device_message.resolution
-            ]
+            device_constraints.loc[start : end - self.environment.resolution]
             for device_constraints in self.device_constraints
         ]
         ems_constraints = self.ems_constraints.loc[
-            device_message.start : device_message.end - device_message.resolution
+            start : end - self.environment.resolution
         ]
 
-        # Get previous commitments
-        commitments = self.commitments.copy()
-
-        # Add requested commitment
-        commitments.append(device_message.commitment)
-
+        # Get previous commitments, and add the given commitments
         applicable_commitments = select_applicable(
-            commitments, (device_message.start, device_message.end), slice=True
+            self.commitments, (start, end), slice=True
+        ) + select_applicable(
+            commitments if commitments is not None else [], (start, end), slice=True
         )
 
-        scheduled_power_per_device, costs_per_commitment = device_scheduler(
-            device_constraints=device_constraints,
-            ems_constraints=ems_constraints,
-            commitment_quantities=[
-                commitment.constants for commitment in applicable_commitments
-            ],
-            commitment_downwards_deviation_price=[
-                commitment.deviation_cost_curve.gradient_down
-                for commitment in applicable_commitments
-            ],
-            commitment_upwards_deviation_price=[
-                commitment.deviation_cost_curve.gradient_up
-                for commitment in applicable_commitments
-            ],
+        return (
+            self.scheduler_input(
+                device_constraints, ems_constraints, applicable_commitments, caller=caller
+            ),
+            applicable_commitments,
         )
 
-        print("------------AT SOLVER------------")
+    def complete_udi_event(
+        self,
+        device_message: DeviceMessage,
+        applicable_commitments: List,
+        scheduled_power_per_device: List[Series],
+        costs_per_commitment: List[float],
+    ) -> UdiEvent:
+        """Store the scheduled power and costs, and create the UdiEvent for a DeviceMessage."""
+
         data = self.store_data(device_message=device_message,
                                targeted_power_per_device=scheduled_power_per_device,
                                costs_per_commitment=costs_per_commitment,
@@ -287,17 +475,21 @@ class EMS(Agent):
             store_realised_and_commited_values(self,
                                                commitment=commitments,
                                                device_message=device_message)
+            self.invalidate_baseline(device_message.start, device_message.end)
 
 
             # Store commitment only if a negotiation got cleared
             if "Succeeded Negotiation" in device_message.description:
 
-                self.commitments.append(Commitment(label=None,
+                # Only keep the actual window of the commitment
+                commitment = trim_commitment(Commitment(label=None,
                                                    constants=device_message.commitment.constants,
                                                    costs=device_message.costs,
                                                    deviation_cost_curve=device_message.commitment.deviation_cost_curve,
                                                    flow_unit_multiplier=1) # keep 1 as value here
                                         )
+                self.commitments.append(commitment)
+                self.invalidate_baseline(commitment.start, commitment.end)
             return
 
         #-------------------- PRICE data ---------------------#
@@ -305,93 +497,54 @@ class EMS(Agent):
 
 
         #-------------------- DEVICE data --------------------#
-        for enum, device in enumerate(self.device_types):
-
-            for index, row in targeted_power_per_device[0].iteritems():
-
-                # POWER per device: Derived from solver output
-                self.device_data.loc[(index, device), str(prefix + "power")] = targeted_power_per_device[enum][index]
-
-                # FLEXIBILITY per device
-                flexibility_per_device = store_flexibility_per_device(
-                                                        self,
-                                                        prefix=prefix,
-                                                        enum=enum,
-                                                        index=index,
-                                                        targeted_power_per_device=targeted_power_per_device,
-                                                        commitments=commitments,
-                                                        device=device
-                                                    )
-
-                # CONTRACT COSTS per device
-                contract_costs_per_device = store_contract_costs_per_device(
-                                                        self,
-                                                        prefix=prefix,
-                                                        enum=enum,
-                                                        index=index,
-                                                        targeted_power_per_device=targeted_power_per_device,
-                                                        device=device
-                                                    )
+        # Values per datetime and device for the whole horizon at once [datetime, device]
+        end = end + self.environment.resolution
+        targeted_power = array([power.values for power in targeted_power_per_device], dtype="float64").T
+
+        # POWER per device: Derived from solver output
+        store_power_per_device(self, prefix=prefix, start=start, end=end, targeted_power=targeted_power)
+
+        # FLEXIBILITY per device
+        flexibility_per_device = store_flexibility_per_device(self, prefix=prefix, start=start, end=end,
+                                                              targeted_power=targeted_power)
+
+        # CONTRACT COSTS per device
+        contract_costs_per_device = store_contract_costs_per_device(self, prefix=prefix, start=start, end=end,
+                                                                    targeted_power=targeted_power)
 
         #---------------------- EMS data --------------------#
-        for index, row in targeted_power_per_device[0].iteritems():
-
-            # REQUESTED POWER: Derived from commitment
-            requested_power  = store_requested_power_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix,
-                                                        commitments=commitments)
-
-            # REQUESTED FLEX: Derived from commitment
-            requested_flexibility = store_requested_flex_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix,
-                                                        device_message=device_message)
+        # REQUESTED POWER: Derived from commitment
+        requested_power = store_requested_power_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                             commitments=commitments)
 
+        # REQUESTED FLEX: Derived from commitment
+        requested_flexibility = store_requested_flex_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                                  device_message=device_message)
 
-            # POWER over all devices for current timestep
-            power_over_all_devices = store_power_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix)
-
-            # FLEXBILITY over all devices for current timestep
-            flexibility_over_all_devices = store_flexibility_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix)
-
-            # CONTRACT COSTS over all devices for current timestep
-            contract_costs_over_all_devices = store_contract_costs_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix,
-                                                        power_over_all_devices=power_over_all_devices)
-
-            # DEVIATION COSTS over all devices for one timestep
-            deviation_costs_over_all_devices = store_deviation_costs_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix,
-                                                        power_over_all_devices=power_over_all_devices,
-                                                        requested_power=requested_power)
-
-            # FLEX COSTS: flexibility_over_all_devices * flex_price
-            flex_costs_over_all_devices = store_flex_costs_per_datetime(
-                                                        self,
-                                                        index=index,
-                                                        prefix=prefix,
-                                                        flexibility_over_all_devices=flexibility_over_all_devices)
-
-            # COMMTMENT COSTS: flex_costs_over_all_devices +
-            commitment_costs_over_all_devices = store_commitment_costs_per_datetime(
-                                                                        self,
-                                                                        index=index,
-                                                                        prefix=prefix,
-                                                                        flex_costs_over_all_devices=flex_costs_over_all_devices,
-                                                                        deviation_costs_over_all_devices=deviation_costs_over_all_devices)
+        # POWER over all devices
+        power_over_all_devices = store_power_per_datetime(self, prefix=prefix, start=start, end=end)
+
+        # FLEXBILITY over all devices
+        flexibility_over_all_devices = store_flexibility_per_datetime(self, prefix=prefix, start=start, end=end)
+
+        # CONTRACT COSTS over all devices
+        contract_costs_over_all_devices = store_contract_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                                            power_over_all_devices=power_over_all_devices)
+
+        # DEVIATION COSTS over all devices
+        deviation_costs_over_all_devices = store_deviation_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                                              power_over_all_devices=power_over_all_devices,
+                                                                              requested_power=requested_power)
+
+        # FLEX COSTS: flexibility_over_all_devices * flex_price
+        flex_costs_over_all_devices = store_flex_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                                    flexibility_over_all_devices=flexibility_over_all_devices)
+
+        # COMMTMENT COSTS: flex_costs_over_all_devices + deviation_costs_over_all_devices
+        commitment_costs_over_all_devices = store_commitment_costs_per_datetime(
+                                                                    self, prefix=prefix, start=start, end=end,
+                                                                    flex_costs_over_all_devices=flex_costs_over_all_devices,
+                                                                    deviation_costs_over_all_devices=deviation_costs_over_all_devices)
 
         #         #-------------------- HORIZON data --------------------#
         #         # Prognosed POWER horizon: Stores the prognosed power values over the actual horizon as a list per device.
@@ -403,33 +556,34 @@ class EMS(Agent):
         # # Prognosed FLEX horizon: Values for each datetime of the actual horizon, stored as a list per device.
         # self.horizon_data.loc[(self.environment.now, "Flexibility"), "Prog"] = self.device_data.loc[IndexSlice[self.environment.now, :], "Prog flexibility"].sum(axis=0)
 
-        #-------------------- PRINTS --------------------#
-        for c in commitments:
-            print("EMS: Applicable commitments constants.values: {}".format(c.constants.values))
-
-        # print("\nDEVICE: Contract costs: {}\n".format(self.device_data.loc[:, str(prefix + "contract costs")]))
-        # print("\nDEVICE: Flex: {}\n".format(self.device_data.loc[:, str(prefix + "flexibility")]))
+        return {"EMS power": around(self.ems_data.get_series(str(prefix + "power"), start, end),3), \
+                "EMS flexibility": around(self.ems_data.get_series(str(prefix +"flexibility"), start, end),3), \
+                "EMS contract costs": around(self.ems_data.get_series(str(prefix +"contract costs"), start, end),3), \
+                "EMS deviation costs": around(self.ems_data.get_series(str(prefix +"dev costs"), start, end),3), \
+                "EMS flex costs": around(self.ems_data.get_series(str(prefix +"flex costs"), start, end),3), \
+                "EMS commitment costs": around(self.ems_data.get_series(str(prefix +"commitment costs"), start, end),3)}
 
-        print("EMS: Targeted Flex: {}\n".format(list(device_message.targeted_flexibility.values)))
-        print("EMS: Dev Curve Down: {}".format([c.deviation_cost_curve.gradient_down for c in commitments]))
-        print("EMS: Dev Curve Up: {}".format([c.deviation_cost_curve.gradient_up for c in commitments]))
 
-        print("\nEMS: Costs per commitment:{}".format(costs_per_commitment))
-
-        print("\n Power over all: {}".format(self.ems_data.loc[start:end, str(prefix + "power")]))
-        # print("\n Flex over all: {}".format(self.ems_data.loc[start:end, "flexibility"]))
-        # print("\n CC over all: {}".format(self.ems_data.loc[start:end, "contract costs"]))
-        # print("\n Dev costs over all: {}".format(self.ems_data.loc[start:end, "dev costs"]))
-        # print("\n Tot costs over all: {}".format(self.ems_data.loc[start:end, "total costs"]))
-        # print("\n Com costs over all: {}".format(self.ems_data.loc[start:end, "commitment costs"]))
+    def step(self):
 
-        return {"EMS power": around(self.ems_data.loc[start:end, str(prefix + "power")].astype("float64"),3), \
-                "EMS flexibility": around(self.ems_data.loc[start:end, str(prefix +"flexibility")].astype("float64"),3), \
-                "EMS contract costs": around(self.ems_data.loc[start:end, str(prefix +"contract costs")].astype("float64"),3), \
-                "EMS deviation costs": around(self.ems_data.loc[start:end, str(prefix +"dev costs")].astype("float64"),3), \
-                "EMS flex costs": around(self.ems_data.loc[start:end, str(prefix +"flex costs")].astype("float64"),3), \
-                "EMS commitment costs": around(self.ems_data.loc[start:end, str(prefix +"commitment costs")].astype("float64"),3)}
+        # Move elapsed commitments to the ledger of settled commitments
+        settled_commitments = self.commitments.settle(self.environment.now)
+        for commitment in settled_commitments:
+            self.invalidate_baseline(commitment.start, commitment.end)
+        self.settled_commitments.extend(settled_commitments)
+        return
 
 
-    def step(self):
-        return
+def is_baseline_request(device_message: DeviceMessage) -> bool:
+    """Whether the DeviceMessage commits to nothing, i.e. its targeted power is all nan or it has a zero deviation
+    cost gradient, so that the EMS only schedules against its own commitments."""
+    commitment = device_message.commitment
+    deviation_cost_curve = commitment.deviation_cost_curve
+    if isnan(commitment.values).all():
+        return True
+    return (
+        deviation_cost_curve is not None
+        and deviation_cost_curve.function_type in (None, "Linear")
+        and bool(all_of(deviation_cost_curve.gradient_up == 0))
+        and bool(all_of(deviation_cost_curve.gradient_down == 0))
+    )
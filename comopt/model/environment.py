@@ -1,5 +1,6 @@
-from typing import Callable, Dict, List, Union
+from typing import Callable, Dict, List, Optional, Union
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 from pandas import DataFrame, Series
 from comopt.model.utils import initialize_index
@@ -7,6 +8,9 @@ from comopt.model.market_agent import MarketAgent
 from comopt.model.plan_board import PlanBoard
 from comopt.model.trading_agent import TradingAgent
 from comopt.model.ems import EMS
+from comopt.solver.solver_backends import get_solver_parameter
+from comopt.solver.scheduler_cache import SchedulerCache
+from comopt.solver.instrumentation import SolverCallLog, solver_call_log
 
 
 class Environment:
@@ -64,6 +68,25 @@ class Environment:
         # Used for downsampling hourly values within device scheduler
         self.flow_unit_multiplier = input_data["Flow unit multiplier"]
 
+        # Solver backends and model formulation used by the device scheduler of each EMS
+        self.solver_parameter = get_solver_parameter(input_data)
+
+        # Cache of device scheduler solutions, shared by all EMS
+        if self.solver_parameter["Cache size"] > 0:
+            self.scheduler_cache = SchedulerCache(
+                size=self.solver_parameter["Cache size"],
+                file=self.solver_parameter["Cache file"],
+            )
+        else:
+            self.scheduler_cache = None
+
+        # Solver calls of this simulation, collected from the log of the process after each step (see step)
+        self.solver_call_log = SolverCallLog()
+        solver_call_log.clear()
+
+        # Pool of worker processes to schedule the EMS in parallel, created on first use (see get_process_pool)
+        self.process_pool = None
+
         # self.commitment_snapshots = commitment_snapshots(start=start, end=end, ta_horizon=input_data["TA horizon"], ma_horizon=input_data["MA horizon"])
 
         # Set up agents
@@ -115,6 +138,16 @@ class Environment:
                                     input_data=input_data,
                                     environment=self)
 
+    def get_process_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Return the pool of worker processes for scheduling the EMS, or None if the EMS are scheduled one by one."""
+        if self.solver_parameter["Processes"] < 1 or len(self.ems_agents) < 2:
+            return None
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.solver_parameter["Processes"]
+            )
+        return self.process_pool
+
     def run_model(self):
         """Run the model until the end condition is reached."""
 
@@ -135,35 +168,53 @@ class Environment:
                 self.logfile.write("Simulation progress: day %s" % self.now.day)
             self.step()
 
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+        if self.scheduler_cache is not None:
+            self.scheduler_cache.save()
+            self.logfile.write(
+                "\nSCHEDULER CACHE: {} hits, {} misses\n".format(
+                    self.scheduler_cache.hits, self.scheduler_cache.misses
+                )
+            )
+
+        if len(self.solver_call_log) > 0:
+            self.logfile.write(
+                "\nSOLVER CALLS:\n \n{}\n".format(self.solver_call_log.summary())
+            )
+            if self.solver_parameter["Solver call log"] is not None:
+                self.solver_call_log.export(self.solver_parameter["Solver call log"])
+
         Prefix = "Prog "
-        self.logfile.write("\nDEVICE: Prognosis data:\n \n{}".format(self.ems_agents[0].device_data.loc[
-                                                                :, [str(Prefix + "power"), str(Prefix + "flexibility"), \
+        self.logfile.write("\nDEVICE: Prognosis data:\n \n{}".format(self.ems_agents[0].device_data.to_frame([str(Prefix + "power"), str(Prefix + "flexibility"), \
                                                                                   str(Prefix + "contract costs"), \
-                                                                                  ]], '.2f'))
+                                                                                  ]), '.2f'))
 
-        self.logfile.write("\nEMS: Prognosis data:\n \n{}".format(self.ems_agents[0].ems_data.loc[:, ["Req power", str(Prefix + "power"), \
+        self.logfile.write("\nEMS: Prognosis data:\n \n{}".format(self.ems_agents[0].ems_data.to_frame(["Req power", str(Prefix + "power"), \
                                                                             "Req flexibility", str(Prefix + "flexibility"), \
                                                                             str(Prefix + "contract costs"), str(Prefix + "dev costs"), \
-                                                                            str(Prefix + "flex costs"), str(Prefix + "commitment costs")]],'.2f'))
+                                                                            str(Prefix + "flex costs"), str(Prefix + "commitment costs")]), '.2f'))
         Prefix = "Plan "
-        self.logfile.write("\nDEVICE: Planned data:\n \n{}".format(self.ems_agents[0].device_data.loc[:, [str(Prefix + "power"), str(Prefix + "flexibility"), \
+        self.logfile.write("\nDEVICE: Planned data:\n \n{}".format(self.ems_agents[0].device_data.to_frame([str(Prefix + "power"), str(Prefix + "flexibility"), \
                                                                                   str(Prefix + "contract costs"), \
-                                                                                  ]],'.2f'))
+                                                                                  ]), '.2f'))
 
-        self.logfile.write("\nEMS: Planned data:\n \n{}".format(self.ems_agents[0].ems_data.loc[:, ["Req power", str(Prefix + "power"), \
+        self.logfile.write("\nEMS: Planned data:\n \n{}".format(self.ems_agents[0].ems_data.to_frame(["Req power", str(Prefix + "power"), \
                                                                     "Req flexibility", str(Prefix + "flexibility"), \
                                                                     str(Prefix + "contract costs"), str(Prefix + "dev costs"), \
-                                                                    str(Prefix + "flex costs"), str(Prefix + "commitment costs")]],'.2f'))
+                                                                    str(Prefix + "flex costs"), str(Prefix + "commitment costs")]), '.2f'))
 
         Prefix = "Real "
-        self.logfile.write("\nDEVICE: Realised data:\n \n \n{}".format(self.ems_agents[0].device_data.loc[:, [str(Prefix + "power"), str(Prefix + "flexibility"), \
+        self.logfile.write("\nDEVICE: Realised data:\n \n \n{}".format(self.ems_agents[0].device_data.to_frame([str(Prefix + "power"), str(Prefix + "flexibility"), \
                                                                           str(Prefix + "contract costs") \
-                                                                          ]],'.2f'))
+                                                                          ]), '.2f'))
 
-        self.logfile.write("\nEMS: Realised data:\n \n{}".format(self.ems_agents[0].ems_data.loc[:, ["Req power", str(Prefix + "power"), \
+        self.logfile.write("\nEMS: Realised data:\n \n{}".format(self.ems_agents[0].ems_data.to_frame(["Req power", str(Prefix + "power"), \
                                                                     "Req flexibility", str(Prefix + "flexibility"), \
                                                                     str(Prefix + "contract costs"), \
-                                                                    str(Prefix + "flex costs"), str(Prefix + "commitment costs")]],'.2f'))
+                                                                    str(Prefix + "flex costs"), str(Prefix + "commitment costs")]), '.2f'))
 
 
         self.logfile.close()
@@ -183,6 +234,10 @@ class Environment:
         # Let the Market Agent move (to store its own commitments)
         self.market_agent.step()
 
+        # Collect the solver calls of this step
+        self.solver_call_log.extend(solver_call_log.rows)
+        solver_call_log.clear()
+
         # Update simulation time
         self.now += self.resolution
         self.step_now += 1
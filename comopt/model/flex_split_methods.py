@@ -1,10 +1,20 @@
-from typing import List
+from typing import List, Tuple
+from time import perf_counter
 
 from pandas import Series
-from numpy import nan_to_num
+from numpy import array, full, isnan, nan, nan_to_num, sqrt, where, zeros
 from comopt.data_structures.usef_message_types import FlexRequest
 from comopt.model.ems import EMS
 from comopt.model.utils import initialize_series
+from comopt.solver.ems_solver import schedule_in_process, process_result
+
+# Defaults of the "Dual decomposition" entry of the TA flexrequest parameter (see dual_decomposition_flex_split)
+DEFAULT_DUAL_DECOMPOSITION_PARAMETER = {
+    "Step size": 1,  # Price update per unit of aggregated power mismatch (e.g. in EUR/MWh per MW), in the first iteration
+    "Tolerance": 0.01,  # Largest acceptable mismatch between aggregated and requested power (e.g. in MW)
+    "Iterations": 20,  # Maximum number of price updates
+    "Time budget": 10,  # Maximum number of seconds spent on price updates
+}
 
 
 def equal_flex_split_requested(
@@ -56,3 +66,152 @@ def implement_your_own_flex_split_method_here(
         end=flex_request.end,
         resolution=flex_request.resolution,
     )
+
+
+def dual_decomposition_flex_split(
+    ems_agents: List[EMS], flex_request: FlexRequest, environment
+) -> dict:
+    """Split up the requested values in the FlexRequest by coordinating the EMS agents with prices.
+    The Trading Agent broadcasts a price per datetime, with which each EMS schedules its devices against its own
+    commitments plus the price (as a commitment to 0 power with equal upwards and downwards deviation prices).
+    The EMS schedules are independent subproblems, so they are solved in parallel if the environment has a process
+    pool. The Trading Agent then raises prices where the aggregated power exceeds the requested power and lowers them
+    where it falls short (a subgradient step on the dual problem, with a step size that decreases with each
+    iteration), until the mismatch is within tolerance, or the iteration or time budget runs out.
+    The targets are the schedules of each EMS averaged over the iterations, which smooths out the jumps of the
+    (linear) subproblems between iterations. The final prices are kept by the Trading Agent, to warm-start the
+    overlapping datetimes of the next FlexRequest.
+    Parameters are taken from the "Dual decomposition" entry of the TA flexrequest parameter, if any (see
+    DEFAULT_DUAL_DECOMPOSITION_PARAMETER). Returns targets per EMS."""
+
+    trading_agent = environment.trading_agent
+    parameter = dict(DEFAULT_DUAL_DECOMPOSITION_PARAMETER)
+    parameter.update(trading_agent.flexrequest_parameter.get("Dual decomposition", {}))
+
+    requested_power = array(flex_request.commitment.constants.values, dtype="float64")
+    requested = ~isnan(requested_power)
+    number_of_datetimes = len(requested_power)
+
+    # Warm start with the prices of the previous FlexRequest, where known
+    window = slice(
+        trading_agent.flex_split_prices.index.get_loc(flex_request.start),
+        trading_agent.flex_split_prices.index.get_loc(flex_request.start)
+        + number_of_datetimes,
+    )
+    prices = where(
+        requested, nan_to_num(trading_agent.flex_split_prices.values[window]), 0
+    )
+
+    scheduler_inputs = [
+        ems.select_scheduler_input(
+            flex_request.start, flex_request.end, caller="Dual decomposition"
+        )[0]
+        for ems in ems_agents
+    ]
+    price_commitment = initialize_series(
+        0, start=flex_request.start, end=flex_request.end, resolution=flex_request.resolution
+    )
+
+    average_power = zeros((len(ems_agents), number_of_datetimes))
+    mismatch = full(number_of_datetimes, nan)
+    iteration = 0
+    started = perf_counter()
+    while iteration < parameter["Iterations"]:
+        iteration += 1
+        price_series = initialize_series(
+            prices, start=flex_request.start, end=flex_request.end, resolution=flex_request.resolution
+        )
+        solutions = schedule_ems_subproblems(
+            ems_agents,
+            [
+                dict(
+                    scheduler_input,
+                    commitment_quantities=scheduler_input["commitment_quantities"]
+                    + [price_commitment],
+                    commitment_downwards_deviation_price=scheduler_input[
+                        "commitment_downwards_deviation_price"
+                    ]
+                    + [price_series],
+                    commitment_upwards_deviation_price=scheduler_input[
+                        "commitment_upwards_deviation_price"
+                    ]
+                    + [price_series],
+                )
+                for scheduler_input in scheduler_inputs
+            ],
+            environment,
+        )
+        ems_power = array(
+            [
+                array([power.values for power in power_per_device], dtype="float64")
+                .reshape(-1, number_of_datetimes)
+                .sum(axis=0)
+                for power_per_device, _ in solutions
+            ]
+        )
+        average_power += (ems_power - average_power) / iteration
+
+        # Update the prices with the mismatch between the aggregated and the requested power
+        mismatch = where(requested, average_power.sum(axis=0) - requested_power, 0)
+        if abs(mismatch).max() <= parameter["Tolerance"]:
+            break
+        step_size = (
+            parameter["Step size"] * environment.flow_unit_multiplier / sqrt(iteration)
+        )
+        prices = where(requested, prices + step_size * mismatch, 0)
+        if perf_counter() - started > parameter["Time budget"]:
+            break
+
+    trading_agent.flex_split_prices.values[window] = where(requested, prices, nan)
+
+    environment.logfile.write(
+        "\nDUAL DECOMPOSITION FLEX SPLIT: {} iterations, largest mismatch {} \n".format(
+            iteration, abs(mismatch).max()
+        )
+    )
+
+    target_power, target_flex = [], []
+    for ems, power in zip(ems_agents, average_power):
+        target_power.append(
+            initialize_series(
+                where(requested, power, nan),
+                start=flex_request.start,
+                end=flex_request.end,
+                resolution=flex_request.resolution,
+            )
+        )
+        prognosed_power = ems.ems_data["Prog power"][
+            ems.ems_data.window(flex_request.start, flex_request.end)
+        ]
+        target_flex.append(
+            initialize_series(
+                where(requested, power - nan_to_num(prognosed_power), nan),
+                start=flex_request.start,
+                end=flex_request.end,
+                resolution=flex_request.resolution,
+            )
+        )
+    return {"target_power": target_power, "target_flex": target_flex}
+
+
+def schedule_ems_subproblems(
+    ems_agents: List[EMS], scheduler_inputs: List[dict], environment
+) -> List[Tuple[List[Series], List[float]]]:
+    """Schedule the devices of each EMS, in parallel if the environment has a process pool.
+    The scheduler cache is bypassed, as the prices of a price coordination are unlikely to recur."""
+    process_pool = environment.get_process_pool()
+    if process_pool is None:
+        return [
+            ems.device_scheduler(**scheduler_input)
+            for ems, scheduler_input in zip(ems_agents, scheduler_inputs)
+        ]
+    futures = [
+        process_pool.submit(
+            schedule_in_process,
+            ems.name,
+            scheduler_input,
+            environment.solver_parameter["Persistent"],
+        )
+        for ems, scheduler_input in zip(ems_agents, scheduler_inputs)
+    ]
+    return [process_result(future.result()) for future in futures]
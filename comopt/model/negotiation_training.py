@@ -0,0 +1,173 @@
+"""Offline training of learning TA policies (e.g. Q_learning) on negotiations alone.
+A simulation only yields one negotiation episode per step, after scheduling the EMS for the prognosis and the flex
+request. Here, episodes are run back to back with start_negotiation, between the TA policy and an MA policy (see
+comopt.policies.ma_policies), for reservation prices that are sampled from recorded or synthetic prices. The trained
+Q-table can then be written into the plan board of a simulation (see NegotiationTrainer.deploy)."""
+
+from typing import Callable, Union
+from datetime import datetime, timedelta
+from random import getrandbits
+
+from pandas import DataFrame
+from numpy import ndarray, asarray, empty, full, isnan, nan, nansum
+from numpy.random import Generator, default_rng
+
+from comopt.data_structures.negotiation_log import NegotiationLog
+from comopt.data_structures.q_table import QTable, QTableSnapshots, snapshot_steps
+from comopt.model.negotiation_utils import start_negotiation
+from comopt.model.plan_board import PlanBoard
+
+# Datetime of the (single) negotiation log entry, which is reused for every episode
+TRAINING_START = datetime(2000, 1, 1)
+
+
+def recorded_reservation_prices(
+    negotiation_log: NegotiationLog, agent: str = "MA"
+) -> ndarray:
+    """Reservation prices of the agent ("MA" or "TA") in the negotiations of a log, e.g. of a simulation run."""
+    prices = negotiation_log["{} reservation price".format(agent)][:, 0]
+    return prices[~isnan(prices)]
+
+
+def draw_reservation_prices(
+    prices: Union[float, ndarray, Callable[[Generator, int], ndarray]],
+    episodes: int,
+    random: Generator,
+) -> ndarray:
+    """Reservation prices for a number of episodes, either resampled from recorded prices,
+    drawn from a synthetic distribution (a function of the generator and the number of episodes,
+    e.g. lambda random, size: random.normal(5, 1, size)), or constant."""
+    if callable(prices):
+        return asarray(prices(random, episodes), dtype="float64")
+    elif isinstance(prices, (int, float)):
+        return full(episodes, prices, dtype="float64")
+    return random.choice(asarray(prices, dtype="float64"), size=episodes)
+
+
+class NegotiationTrainer:
+    """
+    Runs negotiation episodes between a TA policy and an MA policy outside of a simulation, to train the Q-table
+    of the TA policy. The trainer takes the place of the plan board in start_negotiation (see get_q_table), and keeps
+    only a single negotiation log entry, which is cleared after each episode, so memory doesn't grow with the
+    number of episodes.
+    Each episode starts from the markups of the parameters, with newly sampled reservation prices. Other
+    parameters the policies write to (e.g. "Step now" for decaying exploration) carry over between episodes.
+        description:
+            "Prognosis" (or e.g. "Flexrequest"), selects the Q-table of the plan board to deploy to.
+        ta_reservation_prices, ma_reservation_prices:
+            Recorded prices, a synthetic distribution or a constant (see draw_reservation_prices).
+        q_table:
+            Optional Q-table to continue training, e.g. plan_board.get_q_table(description).
+    """
+
+    def __init__(
+        self,
+        description: str,
+        ta_parameter: dict,
+        ma_parameter: dict,
+        ta_reservation_prices: Union[float, ndarray, Callable],
+        ma_reservation_prices: Union[float, ndarray, Callable],
+        q_table: QTable = None,
+        snapshots: int = 8,
+    ):
+        self.description = description
+
+        # Copies, since policies write their bids and markups into their parameters
+        self.ta_parameter = dict(ta_parameter)
+        self.ma_parameter = dict(ma_parameter)
+        self.ta_markup = ta_parameter["Markup"]
+        self.ma_markup = ma_parameter["Markup"]
+        self.ta_reservation_prices = ta_reservation_prices
+        self.ma_reservation_prices = ma_reservation_prices
+
+        if q_table is None:
+            q_table = QTable(
+                actions=ta_parameter["Action function"](
+                    action=None, markup=None, show_actions=True
+                ),
+                rounds_total=ta_parameter["Negotiation rounds"],
+            )
+        self.q_table = q_table
+        self.number_of_snapshots = snapshots
+        self.q_table_snapshots = None
+
+        self.negotiation_log = NegotiationLog(
+            start=TRAINING_START,
+            end=TRAINING_START,
+            resolution=timedelta(minutes=15),
+            rounds_total=ta_parameter["Negotiation rounds"],
+        )
+        self.empty_entry = self.negotiation_log.data[0].copy()
+        self.random = default_rng(getrandbits(64))
+
+        # Outcome per episode, see train
+        self.cleared = empty(0, dtype="bool")
+        self.clearing_prices = empty(0, dtype="float64")
+        self.ta_profits = empty(0, dtype="float64")
+
+    def get_q_table(self, description: str) -> QTable:
+        """Q-table being trained, in place of the plan board's (see PlanBoard.get_q_table)."""
+        return self.q_table
+
+    def train(self, episodes: int) -> DataFrame:
+        """Run a number of negotiation episodes, updating the Q-table after each round (see update_q_learning_tables).
+        Snapshots of the Q-table are taken at evenly spaced episodes. Returns the outcome of each episode."""
+        ta_prices = draw_reservation_prices(
+            self.ta_reservation_prices, episodes, self.random
+        )
+        ma_prices = draw_reservation_prices(
+            self.ma_reservation_prices, episodes, self.random
+        )
+        self.q_table_snapshots = QTableSnapshots(
+            q_table=self.q_table,
+            steps=snapshot_steps(total_steps=episodes, number=self.number_of_snapshots),
+        )
+        self.cleared = full(episodes, False, dtype="bool")
+        self.clearing_prices = full(episodes, nan, dtype="float64")
+        self.ta_profits = full(episodes, nan, dtype="float64")
+
+        for episode in range(episodes):
+            self.ta_parameter["Reservation price"] = ta_prices[episode]
+            self.ta_parameter["Markup"] = self.ta_markup
+            self.ma_parameter["Reservation price"] = ma_prices[episode]
+            self.ma_parameter["Markup"] = self.ma_markup
+            self.negotiation_log.data[0] = self.empty_entry
+
+            decision = start_negotiation(
+                description=self.description,
+                environment_now=TRAINING_START,
+                ta_parameter=self.ta_parameter,
+                ma_parameter=self.ma_parameter,
+                negotiation_log=self.negotiation_log,
+                plan_board=self,
+            )
+
+            if decision["Status"] == "Cleared":
+                self.cleared[episode] = True
+                self.clearing_prices[episode] = decision["Clearing price"]
+            self.ta_profits[episode] = nansum(self.negotiation_log.data[0]["TA profit"])
+            self.q_table_snapshots.take(q_table=self.q_table, step=episode + 1)
+
+        return self.to_frame()
+
+    def to_frame(self) -> DataFrame:
+        """Outcome of each episode of the last training run."""
+        df = DataFrame(
+            {
+                "Cleared": self.cleared,
+                "Clearing price": self.clearing_prices,
+                "TA profit": self.ta_profits,
+            }
+        )
+        df.index.name = "Episode"
+        return df
+
+    def deploy(self, plan_board: PlanBoard):
+        """Write the trained Q-values and action counts into the Q-table of the plan board."""
+        q_table = plan_board.get_q_table(self.description)
+        if q_table.actions != self.q_table.actions or q_table.rounds_total != self.q_table.rounds_total:
+            raise Exception(
+                "Trained Q-table does not match the Q-table of the plan board for {}".format(self.description)
+            )
+        q_table.q_values[...] = self.q_table.q_values
+        q_table.action_counts[...] = self.q_table.action_counts
@@ -14,6 +14,7 @@ from matplotlib.lines import Line2D
 
 from comopt.data_structures.message_types import Prognosis, Offer
 from comopt.model.plan_board import PlanBoard
+from comopt.data_structures.negotiation_log import NegotiationLog
 
 
 # -------------------------------------------------- Negotiation related functions --------------------------------------------------#
@@ -26,20 +27,19 @@ def start_negotiation(
     # ta_policy: Callable,
     ta_parameter: dict,
     ma_parameter: dict,
-    negotiation_log: DataFrame,
+    negotiation_log: NegotiationLog,
     plan_board: PlanBoard) -> str:
 
     """ Function that gets called within the trading agents step function."""
 
-    # placeholder dataframe
-    df = negotiation_log
-
     rounds_total = rounds_left = ta_parameter["Negotiation rounds"]
 
     # Start to bargain until number of rounds_total has been exceeded or clearing price has been settled
     for round in range(1, rounds_total + 1):
 
         round_now = rounds_total - rounds_left + 1
+        # Each round is written in place through its record (see NegotiationLog.record)
+        record = negotiation_log.record(environment_now, round)
 
         # Compute round_next
         # round_next = round_now + 1
@@ -54,9 +54,9 @@ def start_negotiation(
             ma_parameter=ma_parameter,
         )
         # Store values
-        df.loc[(environment_now, round), "MA reservation price"] = ma["Reservation price"]
-        df.loc[(environment_now, round), "MA markup"] = around(ma["Markup"], 3)
-        df.loc[(environment_now, round), "MA bid"] = around(ma["Bid"], 3)
+        record["MA reservation price"] = ma["Reservation price"]
+        record["MA markup"] = around(ma["Markup"], 3)
+        record["MA bid"] = around(ma["Bid"], 3)
 
         # ta variable stores dict with bid, res, mark_up and action.
         ta = ta_parameter["Policy"](
@@ -68,17 +68,17 @@ def start_negotiation(
         )
 
         # Store values
-        df.loc[(environment_now, round), "TA reservation price"] = ta["Reservation price"]
-        df.loc[(environment_now, round), "TA markup"] = around(ta["Markup"], 3)
-        df.loc[(environment_now, round), "TA bid"] = around(ta["Bid"], 3)
-        df.loc[(environment_now, round), "TA Counter offer"] = 0
+        record["TA reservation price"] = ta["Reservation price"]
+        record["TA markup"] = around(ta["Markup"], 3)
+        record["TA bid"] = around(ta["Bid"], 3)
+        record["TA Counter offer"] = 0
 
         # If MAs bid is higher than TAs bids the negotation ends.
         if ma["Bid"] >= ta["Bid"]:
-            df.loc[(environment_now, round), "Cleared"] = 1
-            df.loc[(environment_now, round), "Clearing price"] = ma["Bid"]
-            df.loc[(environment_now, round), "MA profit"] = ma["Reservation price"] - ma["Bid"]
-            df.loc[(environment_now, round), "TA profit"] = ma["Bid"] - ta["Reservation price"]
+            record["Cleared"] = 1
+            record["Clearing price"] = ma["Bid"]
+            record["MA profit"] = ma["Reservation price"] - ma["Bid"]
+            record["TA profit"] = ma["Bid"] - ta["Reservation price"]
 
             # TODO: write decorator function to update adaptive strategy patterns
             update_adaptive_strategy_data(description=description,
@@ -86,7 +86,7 @@ def start_negotiation(
                                           plan_board=plan_board,
                                           round_now=round_now,
                                           action=ta["Action"],
-                                          profit=df.loc[(environment_now, round), "TA profit"],
+                                          profit=record["TA profit"],
                                           )
 
             return {"Status": "Cleared", "Clearing price": ma["Bid"]}
@@ -101,19 +101,19 @@ def start_negotiation(
                 rounds_left=rounds_left,
             )
             # Store values
-            df.loc[(environment_now, round), "TA Counter reservation price"] = ta[
+            record["TA Counter reservation price"] = ta[
                 "Reservation price"
             ]
-            df.loc[(environment_now, round), "TA Counter markup"] = around(ta["Markup"], 3)
-            df.loc[(environment_now, round), "TA Counter offer"] = around(ta["Bid"], 3)
+            record["TA Counter markup"] = around(ta["Markup"], 3)
+            record["TA Counter offer"] = around(ta["Bid"], 3)
 
             if ma["Bid"] >= ta["Bid"]:
-                df.loc[(environment_now, round), "Cleared"] = 1
-                df.loc[(environment_now, round), "Clearing price"] = ma["Bid"]
-                df.loc[(environment_now, round), "MA profit"] = (
+                record["Cleared"] = 1
+                record["Clearing price"] = ma["Bid"]
+                record["MA profit"] = (
                     ma["Reservation price"] - ma["Bid"]
                 )
-                df.loc[(environment_now, round), "TA profit"] = (
+                record["TA profit"] = (
                     ma["Bid"] - ta["Reservation price"]
                 )
 
@@ -123,14 +123,14 @@ def start_negotiation(
                                               plan_board=plan_board,
                                               round_now=round_now,
                                               action=ta["Action"],
-                                              profit=df.loc[(environment_now, round), "TA profit"],
+                                              profit=record["TA profit"],
                                               )
 
                 return {"Status": "Cleared", "Clearing price": ma["Bid"]}
 
             else:
                 # Update q-table in case of no clearing
-                df.loc[(environment_now, round), "TA profit"] = 0
+                record["TA profit"] = 0
 
                 # Update adaptive strategy data.
                 update_adaptive_strategy_data(description=description,
@@ -138,7 +138,7 @@ def start_negotiation(
                                               plan_board=plan_board,
                                               round_now=round_now,
                                               action=ta["Action"],
-                                              profit=df.loc[(environment_now, round), "TA profit"],
+                                              profit=record["TA profit"],
                                               )
 
                 # q_table.loc[round_now, ta["Action"]] = update_q_table(
@@ -181,22 +181,21 @@ def update_adaptive_strategy_data(description: str = None,
     elif "Hill-climbing" in adaptive_strategy:
         pass
 
-    elif "Q-learning" in adaptive_strategy:
-
-        # Take snapshots of q-learSning related tables. Argument snapshot needs to be "True".
-        if snapshot is True and step_now in plan_board.snapshot_timesteps:
+    elif "Q_learning" in adaptive_strategy:
 
-            update_q_learning_table_snapshots(
+        # Take snapshots of q-learning related tables. Argument snapshot needs to be "True".
+        if snapshot is True:
+            update_table_snapshots(
                 description=description,
-                snapshot_timesteps=plan_board.snapshot_timesteps,
+                plan_board=plan_board,
                 step_now=step_now,
                 timeperiod_now=timeperiod_now,
-                plan_board=plan_board
             )
         else:
             update_q_learning_tables(
                 description=description,
                 ta_parameter=ta_parameter,
+                plan_board=plan_board,
                 action=action,
                 state_now=round_now,
                 reward=profit,
@@ -206,67 +205,39 @@ def update_adaptive_strategy_data(description: str = None,
 def update_q_learning_tables(
     description:str,
     ta_parameter: dict,
-    action: str,
+    plan_board: PlanBoard,
+    action: int,
     reward: float,
     state_now: int,
 ):
-    # # Escape function if Q-learning is not applied
-    # if action is None:
-    #     return
-
-    if "Prognosis" in description:
-        q_table = plan_board.q_table_prognosis
-        action_table = plan_board.action_table_prognosis
-
-    elif "Offer" in description:
-        q_table = plan_board.q_table_flexrequest
-        action_table = plan_board.action_table_flexrequest
-
-    state_next = state_now + 1
-
-    # Update Q-Values: Q[state_now, action] = Q[state_now, action] + alpha*(reward + gamma*np.max(Q[state_next, :]) - Q[state, action])
-    q_table.loc[state_now, action] = q_table.loc[state_now, action] + ta_parameter["Alpha"] * (
-        reward
-        + ta_parameter["Gamma"] * q_table.loc[state_next, :].max()
-        - q_table.loc[state_now, action]
+    # Escape function if no action has been chosen
+    if action is None:
+        return
+
+    # Update Q-Values and count the chosen action (see QTable.update)
+    plan_board.get_q_table(description).update(
+        round=state_now,
+        action=action,
+        reward=reward,
+        alpha=ta_parameter["Alpha"],
+        gamma=ta_parameter["Gamma"],
     )
 
-    # Count actions that have been chosen:
-    action_table.loc[state_now, action] += 1
-
     return
 
 def update_table_snapshots(
     description: str,
-    plan_board):
-
-    ''' Take snapshots of q- and action-tables at certain timeperiods for analysis purposes'''
-
-    if "Prognosis" in description:
-
-        q_table = plan_board.q_table_prognosis
-        action_table = plan_board.action_table_prognosis
+    plan_board: PlanBoard,
+    step_now: int,
+    timeperiod_now: datetime):
 
-        plan_board.snapshots_q_table_prognosis[(step_now, timeperiod_now)] = deepcopy(q_table)
-        plan_board.snapshots_action_table_prognosis[(step_now, timeperiod_now)] = deepcopy(action_table)
+    ''' Take snapshots of q- and action-tables at certain timeperiods for analysis purposes (see QTableSnapshots)'''
 
-    elif "Flexrequest" in description:
-
-        q_table = plan_board.q_table_flexrequest
-        action_table = plan_board.action_table_flexrequest
-
-        plan_board.snapshots_q_table_flexrequest[(step_now, timeperiod_now)] = deepcopy(q_table)
-        plan_board.snapshots_action_table_flexrequest[(step_now, timeperiod_now)] = deepcopy(action_table)
-
-        # table_snapshots(
-        #     snapshots=self.store_table_steps,
-        #     step_now=self.environment.step_now,
-        #     timeperiod_now=self.environment.now,
-        #     stored_q_tables=self.stored_q_tables_flexrequest_1,
-        #     stored_action_tables=self.stored_action_tables_flexrequest_1,
-        #     q_table_now=self.flexrequest_q_table_df_1,
-        #     action_table_now=self.flexrequest_action_table_df_1,
-        # )
+    plan_board.get_q_table_snapshots(description).take(
+        q_table=plan_board.get_q_table(description),
+        step=step_now,
+        timeperiod=timeperiod_now,
+    )
 
     return
 
@@ -1,12 +1,11 @@
 from typing import List, Union
 from datetime import datetime, timedelta, date
 from pandas import DataFrame, MultiIndex, date_range
-from numpy import linspace
-from copy import deepcopy
-from collections import OrderedDict
 
 from comopt.data_structures.message_types import Request
 from comopt.model.utils import initialize_df
+from comopt.data_structures.negotiation_log import NegotiationLog
+from comopt.data_structures.q_table import QTable, QTableSnapshots, snapshot_steps
 # from comopt.model.environment import Environment
 
 class PlanBoard:
@@ -33,10 +32,10 @@ class PlanBoard:
             ems_agents=environment.ems_agents
         )
 
-        # Set up prognosis negotiation log 1
+        # Set up prognosis negotiation log 1, up to and including the last step (see Environment.run_model)
         self.prognosis_negotiations_log = self.create_negotiation_data_log(
             start=start,
-            end=end - resolution - environment.max_horizon,
+            end=end - environment.max_horizon,
             resolution=resolution,
             rounds_total=input_data["TA prognosis parameter"]["Negotiation rounds"],
         )
@@ -44,7 +43,7 @@ class PlanBoard:
         # Set up prognosis negotiation log 1
         self.flexrequest_negotiations_log = self.create_negotiation_data_log(
             start=start,
-            end=end - resolution - environment.max_horizon,
+            end=end - environment.max_horizon,
             resolution=resolution,
             rounds_total=input_data["TA flexrequest parameter"]["Negotiation rounds"],
         )
@@ -57,7 +56,7 @@ class PlanBoard:
 
         self.flexrequest_adaptive_strategy_data_log = self.create_adaptive_strategy_data_log(
             description="Flexrequest",
-            ta_parameter=input_data["TA prognosis parameter"],
+            ta_parameter=input_data["TA flexrequest parameter"],
             total_steps=environment.total_steps
             )
 
@@ -69,35 +68,17 @@ class PlanBoard:
         end: Union[date, datetime],
         resolution: timedelta,
         rounds_total: int,
-    ) -> DataFrame:
+    ) -> NegotiationLog:
         #TODO: change arguments to first_index,second_indexS
 
-        """ Returns a multiindex dataframe with inidices (datetime, rounds) and columns for prices, bids, profits, etc. """
-
-        print(rounds_total)
-        logfile = DataFrame(
-            index=MultiIndex.from_product(
-                iterables=[
-                    date_range(start, end, freq=resolution),
-                    range(1, rounds_total + 1),
-                ],
-                names=["Datetime", "Round"],
-            ),
-            columns=[
-                "Clearing price",
-                "Cleared",
-                "MA reservation price",
-                "TA reservation price",
-                "TA Counter reservation price",
-                "MA markup",
-                "TA markup",
-                "TA Counter markup",
-                "MA bid",
-                "TA bid",
-                "TA Counter offer",
-                "MA profit",
-                "TA profit",
-            ],
+        """ Returns a negotiation log with indices (datetime, rounds) and columns for prices, bids, profits, etc.
+        Use its to_frame() method for a multiindex dataframe. """
+
+        logfile = NegotiationLog(
+            start=start,
+            end=end,
+            resolution=resolution,
+            rounds_total=rounds_total,
         )
         return logfile
 
@@ -118,39 +99,44 @@ class PlanBoard:
 
         elif "Q_learning" in adaptive_strategy:
 
-            # Define timeperiods for storing snapshots
-            self.snapshot_timesteps = linspace(
-                1, total_steps, num=8, dtype="int", endpoint=True)
+            # Q-values and action counts per round and action
+            q_table = QTable(
+                actions=ta_parameter["Action function"](
+                    action=None, markup=None, show_actions=True
+                ),
+                rounds_total=ta_parameter["Negotiation rounds"],
+            )
 
-            if "Prognosis" in description:
+            # Snapshots of the Q-table, taken at evenly spaced steps for analysis purposes
+            q_table_snapshots = QTableSnapshots(
+                q_table=q_table,
+                steps=snapshot_steps(
+                    total_steps=total_steps,
+                    number=ta_parameter.get("Snapshots", 8),
+                ),
+            )
 
-                self.q_table_prognosis = DataFrame(
-                    data=0,
-                    index=range(1,ta_parameter["Negotiation rounds"] + 1),
-                    columns=ta_parameter["Action function"](
-                        action=None, markup=None, show_actions=True
-                    ).keys(),
-                )
+            if "Prognosis" in description:
 
-                self.q_table_prognosis.index.name = "Rounds"
-                self.action_table_prognosis = deepcopy(self.q_table_prognosis)
-                self.snapshots_q_table_prognosis = OrderedDict()
-                self.snapshots_action_table_prognosis = OrderedDict()
+                self.q_table_prognosis = q_table
+                self.q_table_snapshots_prognosis = q_table_snapshots
 
             elif "Flexrequest" in description:
 
-                    self.q_table_flexrequest = DataFrame(
-                        data=0,
-                        index=range(1, ta_parameter["Negotiation rounds"] + 1),
-                        columns=ta_parameter["Action function"](
-                            action=None, markup=None, show_actions=True
-                        ).keys(),
-                    )
-
-                    self.q_table_flexrequest.index.name = "Rounds"
-                    self.action_table_flexrequest = deepcopy(self.q_table_flexrequest)
-                    self.snapshots_q_table_flexrequest = OrderedDict()
-                    self.snapshots_action_table_flexrequest = OrderedDict()
+                self.q_table_flexrequest = q_table
+                self.q_table_snapshots_flexrequest = q_table_snapshots
+
+    def get_q_table(self, description: str) -> QTable:
+        """Q-table of the prognosis negotiations, or of the flex request negotiations (for any other description)."""
+        if "Prognosis" in description:
+            return self.q_table_prognosis
+        return self.q_table_flexrequest
+
+    def get_q_table_snapshots(self, description: str) -> QTableSnapshots:
+        """Q-table snapshots of the prognosis negotiations, or of the flex request negotiations (for any other description)."""
+        if "Prognosis" in description:
+            return self.q_table_snapshots_prognosis
+        return self.q_table_snapshots_flexrequest
 
 
     def create_message_log(
@@ -1,16 +1,25 @@
 from typing import Callable, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
-from numpy import nan
+from numpy import array, nan, nan_to_num
 from pandas import DataFrame, Series, concat, isnull
 from copy import deepcopy
+from concurrent.futures import FIRST_COMPLETED, wait
 
 from comopt.data_structures.commitments import (
     DeviationCostCurve,
     PiecewiseConstantProfileCommitment as Commitment,
 )
 from comopt.model.ems import EMS
+from comopt.solver.ems_solver import (
+    schedule_in_process,
+    batched_device_scheduler,
+    schedule_costs,
+    schedule_cost_bound,
+    process_result,
+)
 from comopt.model.flex_split_methods import (
     equal_flex_split_requested,
+    dual_decomposition_flex_split,
     implement_your_own_flex_split_method_here,
 )
 from comopt.model.market_agent import MarketAgent
@@ -132,6 +141,11 @@ class TradingAgent(Agent):
         self.flex_trade_horizon = flex_trade_horizon
         self.reprognosis_period = reprognosis_period
         self.central_optimization = central_optimization
+
+        # Prices of the dual decomposition flex split (see the "Flex split methods" of the flexrequest parameter), kept to warm-start the next FlexRequest
+        self.flex_split_prices = initialize_series(
+            nan, environment.start, environment.end, environment.resolution
+        )
         # self.flexrequest_parameter["Negotiation rounds"] = flexrequest_rounds
 
 
@@ -246,6 +260,335 @@ class TradingAgent(Agent):
                 deviation_cost_curve=deviation_cost_curve,
             )
 
+    def collect_udi_events(
+        self, device_messages: List[Tuple[EMS, DeviceMessage]]
+    ) -> List[UdiEvent]:
+        """Pull a UdiEvent from each EMS while pushing its DeviceMessage.
+        If the environment has a process pool, the devices of the EMS are scheduled in parallel by the worker
+        processes. The UdiEvents are completed (and their data stored) in the order of the DeviceMessages, so the
+        results don't depend on which process finishes first.
+        With batched scheduling, the devices of all EMS are scheduled in one model instead (see
+        collect_udi_events_batched)."""
+
+        if self.environment.solver_parameter["Batched"] is True:
+            return self.collect_udi_events_batched(device_messages)
+
+        process_pool = self.environment.get_process_pool()
+        if process_pool is None:
+            return [
+                ems.post_udi_event(device_message)
+                for ems, device_message in device_messages
+            ]
+
+        # Prepare the scheduler input of each EMS, and dispatch those that are not in the scheduler cache
+        cache = self.environment.scheduler_cache
+        prepared = []
+        for ems, device_message in device_messages:
+            scheduler_input, applicable_commitments = ems.prepare_udi_event(
+                device_message
+            )
+            key, solution = None, None
+            solution = ems.serve_baseline(device_message, scheduler_input)
+            if solution is None and cache is not None:
+                key, data = cache.key(**scheduler_input)
+                solution = cache.get(key, data)
+            if solution is None:
+                solution = process_pool.submit(
+                    schedule_in_process,
+                    ems.name,
+                    scheduler_input,
+                    self.environment.solver_parameter["Persistent"],
+                )
+            prepared.append((key, applicable_commitments, solution))
+
+        # Complete the UdiEvents in order
+        udi_events = []
+        for (ems, device_message), (key, applicable_commitments, solution) in zip(
+            device_messages, prepared
+        ):
+            if not isinstance(solution, tuple):
+                solution = process_result(solution.result())
+                if cache is not None:
+                    cache.put(key, solution)
+                ems.keep_baseline(device_message, solution)
+            scheduled_power_per_device, costs_per_commitment = solution
+            udi_events.append(
+                ems.complete_udi_event(
+                    device_message,
+                    applicable_commitments,
+                    scheduled_power_per_device,
+                    costs_per_commitment,
+                )
+            )
+        return udi_events
+
+    def collect_udi_events_batched(
+        self, device_messages: List[Tuple[EMS, DeviceMessage]]
+    ) -> List[UdiEvent]:
+        """Pull a UdiEvent from each EMS while pushing its DeviceMessage, scheduling the devices of all EMS with a
+        single model build and solver call (see batched_device_scheduler). EMS found in the scheduler cache are
+        left out of the batch."""
+
+        cache = self.environment.scheduler_cache
+        prepared = []
+        for ems, device_message in device_messages:
+            scheduler_input, applicable_commitments = ems.prepare_udi_event(
+                device_message
+            )
+            key, solution = None, None
+            solution = ems.serve_baseline(device_message, scheduler_input)
+            if solution is None and cache is not None:
+                key, data = cache.key(**scheduler_input)
+                solution = cache.get(key, data)
+            prepared.append([scheduler_input, applicable_commitments, key, solution])
+
+        batch = [p for p in prepared if p[3] is None]
+        if batch:
+            solutions, _ = batched_device_scheduler(
+                [scheduler_input for scheduler_input, _, _, _ in batch],
+                formulation=self.environment.solver_parameter["Formulation"],
+                solver_parameter=self.environment.solver_parameter,
+                call_info={"Caller": "Batched", "EMS": "All"},
+            )
+            for p, solution in zip(batch, solutions):
+                p[3] = solution
+                if cache is not None:
+                    cache.put(p[2], solution)
+
+        return [
+            ems.complete_udi_event(
+                device_message,
+                applicable_commitments,
+                scheduled_power_per_device,
+                costs_per_commitment,
+            )
+            for (ems, device_message), (
+                _,
+                applicable_commitments,
+                _,
+                (scheduled_power_per_device, costs_per_commitment),
+            ) in zip(device_messages, prepared)
+        ]
+
+    def evaluate_flex_split_candidates(
+        self, candidates: List[List[Tuple[EMS, DeviceMessage]]]
+    ) -> Tuple[int, List[Tuple[List, Tuple[List[Series], List[float]]]]]:
+        """Schedule the devices of each EMS for each candidate flex split (a DeviceMessage per EMS), and return the
+        candidate with the lowest costs (summed over EMS and their commitments), together with its applicable
+        commitments and solution per EMS. Nothing is stored by the EMS yet (see EMS.complete_udi_event).
+        Each (candidate, EMS) pair is a separate task, run in parallel if the environment has a process pool.
+        A candidate is dropped as soon as its solved costs plus a lower bound on the costs of its remaining tasks
+        (see schedule_cost_bound) exceed the costs of a fully solved candidate, cancelling its remaining tasks."""
+
+        cache = self.environment.scheduler_cache
+        # Per candidate and EMS: [applicable commitments, solution, scheduler input, cache key, bound, scheduler arrays]
+        tasks = []
+        for device_messages in candidates:
+            candidate_tasks = []
+            for ems, device_message in device_messages:
+                scheduler_input, applicable_commitments = ems.prepare_udi_event(
+                    device_message
+                )
+                key, data, solution = None, None, None
+                if cache is not None:
+                    key, data = cache.key(**scheduler_input)
+                    solution = cache.get(key, data)
+                candidate_tasks.append(
+                    [
+                        applicable_commitments,
+                        solution,
+                        scheduler_input,
+                        key,
+                        schedule_cost_bound(scheduler_input, data) if solution is None else None,
+                        data,
+                    ]
+                )
+            tasks.append(candidate_tasks)
+
+        def costs(task) -> float:
+            return sum(task[1][1]) if task[1] is not None else task[4]
+
+        def dominated(candidate: int) -> bool:
+            best_costs = min(
+                [
+                    sum(costs(task) for task in candidate_tasks)
+                    for candidate_tasks in tasks
+                    if all(task[1] is not None for task in candidate_tasks)
+                ],
+                default=float("inf"),
+            )
+            # Solved costs are rounded per datetime, so only prune candidates whose bound is clearly worse
+            bound = sum(costs(task) for task in tasks[candidate])
+            return bound > best_costs + 1e-6 * max(1, abs(best_costs))
+
+        def solved(task, solution):
+            task[1] = solution
+            if cache is not None:
+                cache.put(task[3], solution)
+
+        process_pool = self.environment.get_process_pool()
+        if process_pool is None:
+            for candidate, device_messages in enumerate(candidates):
+                for (ems, _), task in zip(device_messages, tasks[candidate]):
+                    if dominated(candidate):
+                        break
+                    if task[1] is None:
+                        solved(task, ems.device_scheduler(data=task[5], **task[2]))
+        else:
+            futures = dict()
+            for candidate, device_messages in enumerate(candidates):
+                for (ems, _), task in zip(device_messages, tasks[candidate]):
+                    if task[1] is None:
+                        future = process_pool.submit(
+                            schedule_in_process,
+                            ems.name,
+                            task[2],
+                            self.environment.solver_parameter["Persistent"],
+                        )
+                        futures[future] = (candidate, task)
+            while futures:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    candidate, task = futures.pop(future)
+                    solved(task, process_result(future.result()))
+
+                # Cancel the remaining tasks of dominated candidates (tasks already running are ignored)
+                for future, (candidate, task) in list(futures.items()):
+                    if dominated(candidate):
+                        future.cancel()
+                        futures.pop(future)
+
+        # Choose the cheapest fully solved candidate (the first one, in case of a tie)
+        total_costs = [
+            sum(costs(task) for task in candidate_tasks)
+            if all(task[1] is not None for task in candidate_tasks)
+            else float("inf")
+            for candidate_tasks in tasks
+        ]
+        best_candidate = total_costs.index(min(total_costs))
+        self.environment.logfile.write(
+            "\nFLEX SPLIT CANDIDATES: costs {}, chose candidate {} \n".format(
+                total_costs, best_candidate
+            )
+        )
+        return (
+            best_candidate,
+            [(task[0], task[1]) for task in tasks[best_candidate]],
+        )
+
+    def collect_central_udi_events(self, flex_request: FlexRequest) -> List[UdiEvent]:
+        """Schedule the devices of all EMS centrally, i.e. with full information about their devices and
+        commitments, against the FlexRequest as one commitment on their aggregated power (see
+        batched_device_scheduler). Each EMS is then sent its part of the central schedule as a DeviceMessage,
+        and completes its UdiEvent without scheduling again."""
+
+        deviation_cost_curve = flex_request.commitment.deviation_cost_curve
+        scheduler_inputs = [
+            ems.select_scheduler_input(
+                flex_request.start, flex_request.end, caller="Central optimization"
+            )[0]
+            for ems in self.ems_agents
+        ]
+        solutions, coupling_costs = batched_device_scheduler(
+            scheduler_inputs,
+            coupling_quantity=flex_request.commitment.constants,
+            coupling_downwards_deviation_price=deviation_cost_curve.gradient_down,
+            coupling_upwards_deviation_price=deviation_cost_curve.gradient_up,
+            formulation=self.environment.solver_parameter["Formulation"],
+            solver_parameter=self.environment.solver_parameter,
+            call_info={"Caller": "Central optimization", "EMS": "All"},
+        )
+
+        udi_events = []
+        for ems, (scheduled_power_per_device, _) in zip(self.ems_agents, solutions):
+            window = ems.ems_data.window(flex_request.start, flex_request.end)
+            targeted_power = initialize_series(
+                data=array(
+                    [power.values for power in scheduled_power_per_device],
+                    dtype="float64",
+                ).reshape(-1, len(flex_request.commitment.constants)).sum(axis=0),
+                start=flex_request.start,
+                end=flex_request.end,
+                resolution=flex_request.resolution,
+            )
+            targeted_flexibility = initialize_series(
+                data=targeted_power.values - nan_to_num(ems.ems_data["Prog power"][window]),
+                start=flex_request.start,
+                end=flex_request.end,
+                resolution=flex_request.resolution,
+            )
+            ems.ems_data["Requested flexibility"][window] = targeted_flexibility.values
+
+            device_message = ems.get_device_message(
+                self.create_device_message(
+                    ems,
+                    description="Flex request",
+                    targeted_power=targeted_power,
+                    targeted_flexibility=targeted_flexibility,
+                    deviation_cost_curve=deviation_cost_curve,
+                )
+            )
+            scheduler_input, applicable_commitments = ems.prepare_udi_event(
+                device_message
+            )
+            udi_events.append(
+                ems.complete_udi_event(
+                    device_message,
+                    applicable_commitments,
+                    scheduled_power_per_device,
+                    schedule_costs(scheduler_input, scheduled_power_per_device),
+                )
+            )
+        self.environment.logfile.write(
+            "\nCENTRAL OPTIMIZATION: FlexRequest deviation costs {} \n".format(coupling_costs)
+        )
+        return udi_events
+
+    def aggregate_udi_events(
+        self, udi_events: List[UdiEvent], flex_request: FlexRequest
+    ) -> UdiEvent:
+        """Aggregate the UdiEvents of the EMS into one UdiEvent for the Trading Agent."""
+
+        # Calculate aggregated power values and total costs (private and bid)
+        offered_values_aggregated = initialize_series(
+            data=[sum(x) for x in zip(*[udi_event.offered_power.values for udi_event in udi_events])],
+            start=udi_events[0].start,
+            end=udi_events[0].end,
+            resolution=udi_events[0].resolution,
+        )
+
+        offered_flexibility_aggregated = initialize_series(
+            data=[sum(x) for x in zip(*[udi_event.offered_flexibility.values for udi_event in udi_events])],
+            start=udi_events[0].start,
+            end=udi_events[0].end,
+            resolution=udi_events[0].resolution,
+        )
+
+        offered_costs_aggregated = initialize_series(
+            data=[sum(x) for x in zip(*[udi_event.costs.values for udi_event in udi_events])],
+            start=udi_events[0].start,
+            end=udi_events[0].end,
+            resolution=udi_events[0].resolution,
+        )
+
+        # Check if already commited values are same as actual offer values. If true, don't offer them again.
+        offered_values_aggregated, offered_flexibility_aggregated, offered_costs_aggregated = \
+            sort_out_already_commited_values(self,
+                                             offered_values_aggregated,
+                                             offered_flexibility_aggregated,
+                                             offered_costs_aggregated)
+
+        #TODO: Check if dev costs and contract costs are still used
+        return UdiEvent(
+            id=-1,  # Not part of the plan board, as this is just a convenient object for the Trading Agent
+            offered_values=offered_values_aggregated,
+            offered_flexibility=offered_flexibility_aggregated,
+            contract_costs=sum([udi_event.contract_costs for udi_event in udi_events]),
+            deviation_costs=sum([udi_event.deviation_costs for udi_event in udi_events]),
+            deviation_cost_curve=flex_request.commitment.deviation_cost_curve,
+            costs=offered_costs_aggregated,
+        )
+
     def create_prognosis(self, udi_events: List[UdiEvent]) -> Prognosis:
         """Todoc: write doc string."""
         # Todo: create prognosed values based on udi_events
@@ -278,35 +621,40 @@ class TradingAgent(Agent):
         # Todo: set aspiration margin
         udi_events_local_memory = []
         udi_event_cnt = 0
-        udi_event_costs = float("inf")
 
         # Either do a central optimisation just for the analysis, or do a flex split
         if self.central_optimization is True:
-            # Todo: create a UdiEvent based on central optimization
-            best_udi_event = None
-            best_udi_events = [None]
+            udi_events = self.collect_central_udi_events(flex_request)
+            udi_events_local_memory.append(udi_events)
+            best_udi_event = self.aggregate_udi_events(udi_events, flex_request)
         else:
             # Todo: write more flex_split_methods if needed, where each method results in one UdiEvent
-            flex_split_methods = [
-                equal_flex_split_requested,
-                # implement_your_own_flex_split_method_here,
-            ]
-            aggregated_udi_events = []
+            flex_split_methods = self.flexrequest_parameter.get(
+                "Flex split methods",
+                [
+                    equal_flex_split_requested,
+                    # dual_decomposition_flex_split,
+                    # implement_your_own_flex_split_method_here,
+                ],
+            )
+            candidates = []
             for flex_split_method in flex_split_methods:
                 # TODO: Find other way to get absolute flex values and remove environment from arguments then
                 output = flex_split_method(
                     self.ems_agents, flex_request, self.environment
                 )
-                targeted_power = output["target_power"]
-                targeted_flexibility = output["target_flex"]
+                # Split methods return either the same targets for each EMS, or a list of targets per EMS
+                targeted_power_per_ems = output["target_power"]
+                targeted_flexibility_per_ems = output["target_flex"]
+                if not isinstance(targeted_power_per_ems, list):
+                    targeted_power_per_ems = [targeted_power_per_ems] * len(self.ems_agents)
+                    targeted_flexibility_per_ems = [targeted_flexibility_per_ems] * len(self.ems_agents)
 
                 # Find out how well the EMS agents can fulfil the FlexRequest.
-                udi_events = []
-                for ems in self.ems_agents:
-
-                    # TODO: Get targeted_flex into device message and store values at EMS
-                    for index, row in targeted_flexibility.iteritems():
-                        ems.ems_data.loc[index,"Requested flexibility"] = targeted_flexibility.loc[index]
+                device_messages = []
+                for ems, targeted_power, targeted_flexibility in zip(
+                    self.ems_agents, targeted_power_per_ems, targeted_flexibility_per_ems
+                ):
 
                     # Determine DeviceMessage
                     device_message = self.create_device_message(
@@ -317,65 +665,44 @@ class TradingAgent(Agent):
                         deviation_cost_curve=flex_request.commitment.deviation_cost_curve,
                     )
 
-                    # Pull UdiEvent while pushing DeviceMessage to EMS
-                    udi_events.append(
-                        ems.post_udi_event(ems.get_device_message(device_message))
-                    )
-
-                udi_events_local_memory.append(udi_events)
-
-                # Calculate aggregated power values and total costs (private and bid)
-
-                offered_values_aggregated = initialize_series(
-                    data=[sum(x) for x in zip(*[udi_event.offered_power.values for udi_event in udi_events])],
-                    start=udi_events[0].start,
-                    end=udi_events[0].end,
-                    resolution=udi_events[0].resolution,
-                )
-
-                offered_flexibility_aggregated = initialize_series(
-                    data=[sum(x) for x in zip(*[udi_event.offered_flexibility.values for udi_event in udi_events])],
-                    start=udi_events[0].start,
-                    end=udi_events[0].end,
-                    resolution=udi_events[0].resolution,
-                )
+                    device_messages.append((ems, ems.get_device_message(device_message)))
+                candidates.append((device_messages, targeted_flexibility_per_ems))
 
-                offered_costs_aggregated = initialize_series(
-                    data=[sum(x) for x in zip(*[udi_event.costs.values for udi_event in udi_events])],
-                    start=udi_events[0].start,
-                    end=udi_events[0].end,
-                    resolution=udi_events[0].resolution,
+            # Choose the split with the cheapest aggregated costs. With a single split there is nothing to choose.
+            if len(candidates) == 1:
+                best_candidate, solutions = 0, None
+            else:
+                best_candidate, solutions = self.evaluate_flex_split_candidates(
+                    [device_messages for device_messages, _ in candidates]
                 )
-
-                # Check if already commited values are same as actual offer values. If true, don't offer them again.
-                offered_values_aggregated, offered_flexibility_aggregated, offered_costs_aggregated = \
-                    sort_out_already_commited_values(self,
-                                                     offered_values_aggregated,
-                                                     offered_flexibility_aggregated,
-                                                     offered_costs_aggregated)
-
-                #TODO: Check if dev costs and contract costs are still used
-                aggregated_udi_events.append(
-                    UdiEvent(
-                        id=-1,  # Not part of the plan board, as this is just a convenient object for the Trading Agent
-                        offered_values=offered_values_aggregated,
-                        offered_flexibility=offered_flexibility_aggregated,
-                        contract_costs=sum([udi_event.contract_costs for udi_event in udi_events]),
-                        deviation_costs=sum([udi_event.deviation_costs for udi_event in udi_events]),
-                        deviation_cost_curve=flex_request.commitment.deviation_cost_curve,
-                        costs=offered_costs_aggregated,
+            device_messages, targeted_flexibility_per_ems = candidates[best_candidate]
+
+            # TODO: Get targeted_flex into device message and store values at EMS
+            for (ems, _), targeted_flexibility in zip(
+                device_messages, targeted_flexibility_per_ems
+            ):
+                ems.ems_data["Requested flexibility"][
+                    ems.ems_data.window(flex_request.start, flex_request.end)
+                ] = targeted_flexibility.values
+
+            # Pull UdiEvents while pushing DeviceMessages to EMS (only the chosen split is stored by the EMS)
+            if solutions is None:
+                udi_events = self.collect_udi_events(device_messages)
+            else:
+                udi_events = [
+                    ems.complete_udi_event(
+                        device_message,
+                        applicable_commitments,
+                        scheduled_power_per_device,
+                        costs_per_commitment,
                     )
-                )
-
-            # Todo: choose the best aggregated UdiEvent (implement policies as separate module)
-            best_udi_event = None
-            for event in aggregated_udi_events:
-                if event.costs.sum() < udi_event_costs:
-                    best_udi_event = event
-                else:
-                    pass
-                if len(aggregated_udi_events) > 1:
-                    udi_event_cnt += 1
+                    for (ems, device_message), (
+                        applicable_commitments,
+                        (scheduled_power_per_device, costs_per_commitment),
+                    ) in zip(device_messages, solutions)
+                ]
+            udi_events_local_memory.append(udi_events)
+            best_udi_event = self.aggregate_udi_events(udi_events, flex_request)
 
         # Unpack opportunity costs for actual horizon
         opportunity_costs = self.commitment_data["Opportunity costs"].loc[
@@ -465,7 +792,7 @@ class TradingAgent(Agent):
 
         # Pull UdiEvents while pushing empty DeviceMessages to each EMS
         print("---------------------PROGNOSIS UDI EVENTS--------------------------")
-        udi_events = []
+        device_messages = []
         for ems in self.ems_agents:
             # Create empty device message
             device_message = self.create_device_message(
@@ -491,8 +818,10 @@ class TradingAgent(Agent):
             # Add DeviceMessage to plan board
             self.environment.plan_board.store_message(timeperiod=self.environment.now, message=device_message, keys=[ems.name])
 
-            # Get UDI event
-            udi_events.append(ems.post_udi_event(device_message))
+            device_messages.append((ems, device_message))
+
+        # Get UDI events
+        udi_events = self.collect_udi_events(device_messages)
 
         # Add UDI events to plan board
         for event in udi_events:
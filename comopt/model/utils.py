@@ -4,7 +4,7 @@ from datetime import date, datetime, timedelta
 from pandas import DataFrame, DatetimeIndex, Series, MultiIndex, Index, isnull, IndexSlice, to_numeric
 from pandas.tseries.frequencies import to_offset
 
-from numpy import ndarray, nan, nan_to_num
+from numpy import ndarray, nan, nan_to_num, nansum, isnan, where
 
 
 def initialize_df(
@@ -106,228 +106,215 @@ def select_prognosis_or_planned_prefix(
 def store_prices_per_device(self,
                             commitments):
 
+    now = self.ems_data.offset(self.environment.now)
+
     # Deviation prices are different at every step related to imbalance market prices of MA
-    self.ems_data.loc[self.environment.now, "Deviation price up"] = commitments[-1].deviation_cost_curve.gradient_up
-    self.ems_data.loc[self.environment.now, "Deviation price down"] = commitments[-1].deviation_cost_curve.gradient_down
+    self.ems_data["Deviation price up"][now] = commitments[-1].deviation_cost_curve.gradient_up
+    self.ems_data["Deviation price down"][now] = commitments[-1].deviation_cost_curve.gradient_down
 
     # Contract Prices:
     # NOTE: self.ems_prices could be adapted (e.g. indexed Series-valeus) for dynamic price schemes (e.g. Day/Nite-tariff)
-    self.ems_data.loc[self.environment.now, "Feedin price"] = commitments[0].deviation_cost_curve.gradient_down
-    self.ems_data.loc[self.environment.now, "Purchase price"] = commitments[0].deviation_cost_curve.gradient_up
+    self.ems_data["Feedin price"][now] = commitments[0].deviation_cost_curve.gradient_down
+    self.ems_data["Purchase price"][now] = commitments[0].deviation_cost_curve.gradient_up
 
     return
 
-def store_contract_costs_per_device(self,
-                                    prefix: str,
-                                    index: datetime,
-                                    enum: int,
-                                    targeted_power_per_device: Series,
-                                    device: str) -> Series:
-
-    # If targeted power is positive multiply with purchase price
-    if targeted_power_per_device[enum][index] >= 0:
-        self.device_data.loc[
-                            (index, device),
-                            str(prefix + "contract costs")
-                                ] = targeted_power_per_device[enum][index] * self.ems_data.loc[self.environment.now, "Purchase price"]
-
-    # If targeted power is negative multiply with feed-in-price
-    else:
-        self.device_data.loc[
-                            (index, device),
-                            str(prefix + "contract costs")
-                                ] = targeted_power_per_device[enum][index] * self.ems_data.loc[self.environment.now, "Feedin price"]
-
-    return self.device_data.loc[(index, device), str(prefix + "contract costs")]
-
-
-def store_flexibility_per_device(self,
-                                 index: datetime,
-                                 prefix: str,
-                                 enum: int,
-                                 device: str,
-                                 targeted_power_per_device,
-                                 commitments) -> Series:
-
-    flexibility_per_device = nan
-    if "Prog" in prefix:
-
-       # If a prognosis optimization leads to the same values as the old prog power(=planned values from last step), keep planned flex
-        if self.device_data.loc[(index, device), "Prog power"] == targeted_power_per_device[enum].loc[index]:
-            flexibility_per_device = self.device_data.loc[(index, device), str(prefix + "flexibility")]
+def store_power_per_device(self,
+                           prefix: str,
+                           start: datetime,
+                           end: datetime,
+                           targeted_power: ndarray) -> ndarray:
 
-        # Update if the prognosis optimization changes the prognosed flex values (=planned flex from the previous step)
-        else:
-            if self.device_data.loc[(index, device), "Prog power"] > targeted_power_per_device[enum].loc[index]:
+    # POWER per device [datetime, device]: Derived from solver output
+    window = self.device_data.window(start, end)
+    self.device_data[str(prefix + "power")][window] = targeted_power
 
-                flexibility_per_device = self.device_data.loc[(index, device), "Prog power"] \
-                                            - targeted_power_per_device[enum].loc[index]
+    return self.device_data[str(prefix + "power")][window]
 
-                self.device_data.loc[(index, device), str(prefix + "flexibility")] = flexibility_per_device
 
-            elif self.device_data.loc[(index, device), "Prog power"] < targeted_power_per_device[enum].loc[index]:
-
-                flexibility_per_device = targeted_power_per_device[enum].loc[index] \
-                                            - self.device_data.loc[(index, device), "Prog power"]
+def store_contract_costs_per_device(self,
+                                    prefix: str,
+                                    start: datetime,
+                                    end: datetime,
+                                    targeted_power: ndarray) -> ndarray:
 
-                self.device_data.loc[(index, device), str(prefix + "flexibility")] = flexibility_per_device
+    window = self.device_data.window(start, end)
+    now = self.ems_data.offset(self.environment.now)
 
-            else:
-                flexibility_per_device = nan
+    # If targeted power is positive multiply with purchase price, if negative multiply with feed-in-price
+    self.device_data[str(prefix + "contract costs")][window] = where(targeted_power >= 0,
+                                                                     targeted_power * self.ems_data["Purchase price"][now],
+                                                                     targeted_power * self.ems_data["Feedin price"][now])
 
-    if "Plan" in prefix:
+    return self.device_data[str(prefix + "contract costs")][window]
 
-        if self.device_data.loc[(index, device), "Prog power"] == targeted_power_per_device[enum].loc[index]:
-            flexibility_per_device = self.device_data.loc[(index, device), str(prefix + "flexibility")]
 
-        else:
-            if self.device_data.loc[(index, device), "Prog power"] > self.device_data.loc[(index, device), "Plan power"]:
+def store_flexibility_per_device(self,
+                                 prefix: str,
+                                 start: datetime,
+                                 end: datetime,
+                                 targeted_power: ndarray) -> ndarray:
 
-                flexibility_per_device = (self.device_data.loc[(index, device), "Prog power"] \
-                                            - self.device_data.loc[(index, device), "Plan power"])
+    window = self.device_data.window(start, end)
+    prog_power = self.device_data["Prog power"][window]
+    plan_power = self.device_data["Plan power"][window]
+    flexibility = self.device_data[str(prefix + "flexibility")][window]
 
-                self.device_data.loc[(index, device), str(prefix + "flexibility")] = flexibility_per_device
+    # Where the optimization leads to the same values as the prog power (=planned values from last step), keep the flex
+    unchanged = prog_power == targeted_power
+    flexibility_per_device = where(unchanged, flexibility, nan)
 
-            elif self.device_data.loc[(index, device), "Prog power"] < self.device_data.loc[(index, device), "Plan power"]:
+    if "Prog" in prefix:
 
-                flexibility_per_device = (self.device_data.loc[(index, device), "Plan power"] \
-                                            - self.device_data.loc[(index, device), "Prog power"])
+        # Update if the prognosis optimization changes the prognosed flex values (=planned flex from the previous step)
+        decreased = ~unchanged & (prog_power > targeted_power)
+        increased = ~unchanged & (prog_power < targeted_power)
+        flexibility_per_device = where(decreased, prog_power - targeted_power, flexibility_per_device)
+        flexibility_per_device = where(increased, targeted_power - prog_power, flexibility_per_device)
 
-                self.device_data.loc[(index, device), str(prefix + "flexibility")] = flexibility_per_device
+    if "Plan" in prefix:
 
+        decreased = ~unchanged & (prog_power > plan_power)
+        increased = ~unchanged & (prog_power < plan_power)
+        flexibility_per_device = where(decreased, prog_power - plan_power, flexibility_per_device)
+        flexibility_per_device = where(increased, plan_power - prog_power, flexibility_per_device)
 
+    # Only changed flexibility values are written
+    changed = decreased | increased
+    flexibility[changed] = flexibility_per_device[changed]
 
     return flexibility_per_device
 
 #-------------------------- Data storage: Sum over devices per datetime  --------------------------#
 
 def store_requested_power_per_datetime(self,
-                                       index: datetime,
                                        prefix: str,
-                                       commitments) -> Series:
-
+                                       start: datetime,
+                                       end: datetime,
+                                       commitments) -> ndarray:
 
-    requested_power  = commitments[-1].constants.loc[index]
+    window = self.ems_data.window(start, end)
+    requested_power = commitments[-1].constants.loc[start : end - self.ems_data.resolution].values.astype("float64")
 
     # Only store non-nan values
-    if not isnull(requested_power):
-
-        self.ems_data.loc[index, "Req power"] = requested_power
+    requested = ~isnan(requested_power)
+    self.ems_data["Req power"][window][requested] = requested_power[requested]
 
     return requested_power
 
 
 def store_requested_flex_per_datetime(self,
-                                     index: datetime,
-                                     prefix: str,
-                                     device_message) -> Series:
-
-
-    requested_flexibility = device_message.targeted_flexibility.loc[index]
-
-    # Only store non-nan values
-    if not isnull(requested_flexibility):
-
-        # All nans gets overwritten with zero at first datetime
-        if isnull(self.ems_data.loc[index, "Req flexibility"]):
-
-            self.ems_data.loc[index, "Req flexibility"] = requested_flexibility
+                                      prefix: str,
+                                      start: datetime,
+                                      end: datetime,
+                                      device_message) -> ndarray:
 
-        # Only write once again after first datetime
-        elif self.ems_data.loc[index, "Req flexibility"] == 0:
+    window = self.ems_data.window(start, end)
+    requested_flexibility = device_message.targeted_flexibility.loc[start : end - self.ems_data.resolution].values.astype("float64")
+    stored_flexibility = self.ems_data["Req flexibility"][window]
 
-            self.ems_data.loc[index, "Req flexibility"] = requested_flexibility
+    # Only store non-nan values. All nans gets overwritten at first datetime, and only write once again after first
+    # datetime (i.e. over zeros)
+    overwrite = ~isnan(requested_flexibility) & (isnan(stored_flexibility) | (stored_flexibility == 0))
+    stored_flexibility[overwrite] = requested_flexibility[overwrite]
 
-    return self.ems_data.loc[index, str(prefix + "power")]
+    return stored_flexibility
 
 
 def store_power_per_datetime(self,
-                             index: datetime,
-                             prefix: str) -> Series:
-
+                             prefix: str,
+                             start: datetime,
+                             end: datetime) -> ndarray:
 
-    self.ems_data.loc[index, str(prefix + "power")] = self.device_data.loc[
-                                                                        IndexSlice[index,:],
-                                                                        str(prefix + "power")
-                                                                            ].sum(axis="index")
+    window = self.ems_data.window(start, end)
+    self.ems_data[str(prefix + "power")][window] = nansum(self.device_data[str(prefix + "power")][window], axis=1)
 
-    return self.ems_data.loc[index, str(prefix + "power")]
+    return self.ems_data[str(prefix + "power")][window]
 
 
 def store_flexibility_per_datetime(self,
-                                   index: datetime,
-                                   prefix: str) -> Series:
+                                   prefix: str,
+                                   start: datetime,
+                                   end: datetime) -> ndarray:
 
+    window = self.ems_data.window(start, end)
     if "Plan" in prefix:
 
-        # min_counts helps here to avoid errors due to nan values
-        self.ems_data.loc[index, str(prefix + "flexibility")] = self.device_data.loc[
-                                                                                IndexSlice[index,:],
-                                                                                str(prefix + "flexibility")
-                                                                                        ].sum(axis="index", min_count=1)
+        # Like a sum with min_count=1: nan if there is no flexibility value for any device
+        flexibility_per_device = self.device_data[str(prefix + "flexibility")][window]
+        self.ems_data[str(prefix + "flexibility")][window] = where(isnan(flexibility_per_device).all(axis=1),
+                                                                   nan,
+                                                                   nansum(flexibility_per_device, axis=1))
 
-    return self.ems_data.loc[index, str(prefix + "flexibility")]
+    return self.ems_data[str(prefix + "flexibility")][window]
 
 
 def store_contract_costs_per_datetime(self,
-                                      index: datetime,
                                       prefix: str,
-                                      power_over_all_devices: Series) -> Series:
+                                      start: datetime,
+                                      end: datetime,
+                                      power_over_all_devices: ndarray) -> ndarray:
 
-    if power_over_all_devices >= 0:
+    window = self.ems_data.window(start, end)
+    now = self.ems_data.offset(self.environment.now)
 
-        # If power is positive multiply with purchase price
-        self.ems_data.loc[index, str(prefix + "contract costs")] = power_over_all_devices \
-                                                                    * self.ems_data.loc[self.environment.now, "Purchase price"]
-    else:
-        # If power is negative multiply with feed in price
-        self.ems_data.loc[index, str(prefix + "contract costs")] = power_over_all_devices \
-                                                                    * self.ems_data.loc[self.environment.now, "Feedin price"]
+    # If power is positive multiply with purchase price, if negative multiply with feed in price
+    self.ems_data[str(prefix + "contract costs")][window] = where(power_over_all_devices >= 0,
+                                                                  power_over_all_devices * self.ems_data["Purchase price"][now],
+                                                                  power_over_all_devices * self.ems_data["Feedin price"][now])
 
-    return self.ems_data.loc[index, str(prefix + "contract costs")]
+    return self.ems_data[str(prefix + "contract costs")][window]
 
 
 def store_deviation_costs_per_datetime(self,
-                                       index: datetime,
                                        prefix: str,
-                                       power_over_all_devices: Series,
-                                       requested_power: Series) -> Series:
-
-    if power_over_all_devices > requested_power:
+                                       start: datetime,
+                                       end: datetime,
+                                       power_over_all_devices: ndarray,
+                                       requested_power: ndarray) -> ndarray:
 
-        self.ems_data.loc[index, str(prefix + "dev costs")] = (power_over_all_devices - requested_power) \
-                                                                        * self.ems_data.loc[self.environment.now, "Deviation price up"]
+    window = self.ems_data.window(start, end)
+    now = self.ems_data.offset(self.environment.now)
+    deviation_costs = self.ems_data[str(prefix + "dev costs")][window]
 
-    elif power_over_all_devices < requested_power:
+    # Upwards deviations are priced with the upwards deviation price, downwards deviations with the downwards one.
+    # Without deviation (or without requested power) the stored values are kept.
+    up = power_over_all_devices > requested_power
+    down = power_over_all_devices < requested_power
+    deviation_costs[up] = (power_over_all_devices[up] - requested_power[up]) \
+                            * self.ems_data["Deviation price up"][now]
+    deviation_costs[down] = (requested_power[down] - power_over_all_devices[down]) * -1 \
+                            * self.ems_data["Deviation price down"][now]
 
-        self.ems_data.loc[index, str(prefix + "dev costs")] = (requested_power - power_over_all_devices) * -1 \
-                                                                        * self.ems_data.loc[self.environment.now, "Deviation price down"]
-
-    return self.ems_data.loc[index, str(prefix + "dev costs")]
+    return deviation_costs
 
 
 def store_flex_costs_per_datetime(self,
-                                   index: datetime,
-                                   prefix: str,
-                                   flexibility_over_all_devices: Series,
-                                   ) -> Series:
+                                  prefix: str,
+                                  start: datetime,
+                                  end: datetime,
+                                  flexibility_over_all_devices: ndarray,
+                                  ) -> ndarray:
 
-    self.ems_data.loc[index, str(prefix + "flex costs")] = abs(flexibility_over_all_devices) * self.flex_price
+    window = self.ems_data.window(start, end)
+    self.ems_data[str(prefix + "flex costs")][window] = abs(flexibility_over_all_devices) * self.flex_price
 
-    return self.ems_data.loc[index, str(prefix + "flex costs")]
+    return self.ems_data[str(prefix + "flex costs")][window]
 
 
 def store_commitment_costs_per_datetime(self,
-                                        index: datetime,
                                         prefix: str,
-                                        flex_costs_over_all_devices,
-                                        deviation_costs_over_all_devices):
+                                        start: datetime,
+                                        end: datetime,
+                                        flex_costs_over_all_devices: ndarray,
+                                        deviation_costs_over_all_devices: ndarray) -> ndarray:
 
     # if "Plan" in prefix:
 
-    self.ems_data.loc[index, str("Plan commitment costs")] = nan_to_num(deviation_costs_over_all_devices) + flex_costs_over_all_devices\
+    window = self.ems_data.window(start, end)
+    self.ems_data[str("Plan commitment costs")][window] = nan_to_num(deviation_costs_over_all_devices) + flex_costs_over_all_devices
 
-    return self.ems_data.loc[index, str("Plan commitment costs")]
+    return self.ems_data[str("Plan commitment costs")][window]
 
 
 def store_realised_and_commited_values(self,
@@ -339,17 +326,17 @@ def store_realised_and_commited_values(self,
 
     self.device_messages.loc[self.environment.now, "Order"] = device_message
 
+    s = self.ems_data.offset(start)
+    window = self.ems_data.window(start, device_message.end)
+
     # Negotiation failed
     if device_message.description is "Failed Negotiation":
 
         print("\n UTILS: Failed Negotiatio\n")
 
         # Store actual prognosed values as realised ones. No commitments, no commitment data update.
-        self.ems_data.loc[start, "Real power"] = self.ems_data.loc[start, "Prog power"]
-        self.ems_data.loc[start, "Real flexibility"] = self.ems_data.loc[start, "Prog flexibility"]
-        self.ems_data.loc[start, "Real contract costs"] = self.ems_data.loc[start, "Prog contract costs"]
-        self.ems_data.loc[start, "Real flex costs"] = self.ems_data.loc[start, "Prog flex costs"]
-        self.ems_data.loc[start, "Real commitment costs"] = self.ems_data.loc[start, "Prog commitment costs"]
+        for column in ["power", "flexibility", "contract costs", "flex costs", "commitment costs"]:
+            self.ems_data["Real " + column][s] = self.ems_data["Prog " + column][s]
 
     # Negotiation succeeded
     elif "Succeeded Negotiation" in device_message.description:
@@ -357,34 +344,30 @@ def store_realised_and_commited_values(self,
         print("UTILS: Succeeded Negotiation\n")
 
         # Storing realised values on EMS level
-        self.ems_data.loc[start, "Real power"] = self.ems_data.loc[start, "Plan power"]
-        self.ems_data.loc[start, "Real flexibility"] = self.ems_data.loc[start, "Plan flexibility"]
-        self.ems_data.loc[start, "Real contract costs"] = self.ems_data.loc[start, "Plan contract costs"]
-        self.ems_data.loc[start, "Real flex costs"] = self.ems_data.loc[start, "Plan flex costs"]
-        self.ems_data.loc[start, "Real commitment costs"] = self.ems_data.loc[start, "Plan commitment costs"]
+        for column in ["power", "flexibility", "contract costs", "flex costs", "commitment costs"]:
+            self.ems_data["Real " + column][s] = self.ems_data["Plan " + column][s]
         # self.ems_data.loc[start:end, "Prog flexibility"] = self.ems_data.loc[start:end, "Plan flexibility"]
 
         # Storing commited values and "prognosed next round = planned this round"-operation on EMS-Level
         for index, row in  device_message.targeted_flexibility.iteritems():
 
+            t = self.ems_data.offset(index)
             if not isnull(device_message.targeted_flexibility[index]):
-                self.ems_data.loc[index, "Com flexibility"] = device_message.targeted_flexibility.loc[index]
-                self.ems_data.loc[index, "Prog flexibility"] = device_message.targeted_flexibility.loc[index]
-                self.ems_data.loc[index, "Prog dev costs"] = self.ems_data.loc[index, "Plan dev costs"]
+                self.ems_data["Com flexibility"][t] = device_message.targeted_flexibility.loc[index]
+                self.ems_data["Prog flexibility"][t] = device_message.targeted_flexibility.loc[index]
+                self.ems_data["Prog dev costs"][t] = self.ems_data["Plan dev costs"][t]
 
             if not isnull(device_message.ordered_power[index]):
-                self.ems_data.loc[index, "Com power"] = device_message.ordered_power.loc[index]
-                self.ems_data.loc[index, "Prog power"] = device_message.ordered_power[index]
+                self.ems_data["Com power"][t] = device_message.ordered_power.loc[index]
+                self.ems_data["Prog power"][t] = device_message.ordered_power[index]
 
         # Storing realised Device Values
-        self.device_data.loc[IndexSlice[start, :], "Real power"] = self.device_data.loc[IndexSlice[start, :], "Plan power"]
-        self.device_data.loc[IndexSlice[start, :], "Real flexibility"] = self.device_data.loc[IndexSlice[start, :], "Plan flexibility"]
-        self.device_data.loc[IndexSlice[start, :], "Real contract costs"] = self.device_data.loc[IndexSlice[start, :], "Plan contract costs"]
+        for column in ["power", "flexibility", "contract costs"]:
+            self.device_data["Real " + column][s] = self.device_data["Plan " + column][s]
 
         # "prognosed next round = planned this round"-operation on Device-Level
-        self.device_data.loc[IndexSlice[start:end, :], "Prog power"] = self.device_data.loc[IndexSlice[start:end, :], "Plan power"]
-        self.device_data.loc[IndexSlice[start:end, :], "Prog flexibility"] = self.device_data.loc[IndexSlice[start:end, :], "Plan flexibility"]
-        self.device_data.loc[IndexSlice[start:end, :], "Prog contract costs"] = self.device_data.loc[IndexSlice[start:end, :], "Plan contract costs"]
+        for column in ["power", "flexibility", "contract costs"]:
+            self.device_data["Prog " + column][window] = self.device_data["Plan " + column][window]
 
 
     # print("EMS: Device message targeted power: {}".format(device_message.ordered_power))
@@ -392,17 +375,4 @@ def store_realised_and_commited_values(self,
     # print("\nEMS: Store commitment constants: {}".format(commitment.constants))
     # print("\nEMS: Store commitment costs: {}".format(commitment.costs))
 
-    # print(self.device_data.loc[:, str("Prog " + "contract costs")])
-    # print("\nDEVICE: Prog Contract costs after commitment: {}\n".format(self.device_data.loc[:, str("Prog " + "contract costs")]))
-    # print("\nEMS: New EMS Prognosis flexibility: {}".format(self.ems_data.loc[start:end, "Prog flexibility"]))
-    # print("\nEMS: Plan deviation costs: {}".format(self.ems_data.loc[start:end, "Plan dev costs"]))
-    #
-    #
-    # print("\nEMS: Commited power values: {}".format(self.ems_data.loc[start:end, "Com power"]))
-    # print("\nEMS: Commited flex values: {}".format(self.ems_data.loc[start:end, "Com flexibility"]))
-    # print("\nEMS: Realised power values: {}".format(self.ems_data.loc[start:end, "Real power"]))
-    # print("\nEMS: Realised flex values: {}".format(self.ems_data.loc[start:end, "Real flexibility"]))
-    # print("\nEMS: Realised com costs: {}".format(self.ems_data.loc[start:end, "Real commitment costs"]))
-    # print("\nEMS: Planned com costs: {}".format(self.ems_data.loc[start:end, "Plan commitment costs"]))
-
     return
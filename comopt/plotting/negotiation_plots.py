@@ -1,3 +1,5 @@
+from typing import Union
+
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
@@ -5,13 +7,18 @@ from pandas import DataFrame
 import numpy as np
 from numpy import exp, poly1d, polyfit, unique, asarray
 
+from comopt.data_structures.negotiation_log import NegotiationLog
+from comopt.data_structures.q_table import QTableSnapshots
+
 
 def plot_negotiation_data(
     input_data: dict,
     negotiation_data_df: DataFrame,
-    q_tables: dict = None,
+    q_tables: Union[QTableSnapshots, dict] = None,
     action_tables: dict = None,
 ):
+    """Plot the negotiation log. Heatmaps of the Q- and action tables are taken from the snapshots of a Q-table
+    (see PlanBoard.get_q_table_snapshots), in which case action_tables is not needed."""
     # Figure layout parameter
     plt.rcParams["figure.figsize"] = [40, 80]
     gs = gridspec.GridSpec(
@@ -23,6 +30,8 @@ def plot_negotiation_data(
     gs.update(wspace=0.25, hspace=0.4)
 
     # Dummy variables
+    if isinstance(negotiation_data_df, NegotiationLog):
+        negotiation_data_df = negotiation_data_df.to_frame()
     df = negotiation_data_df
     rounds_index = negotiation_data_df.index.get_level_values("Round").unique()
     datetime_index = negotiation_data_df.index.get_level_values("Datetime").unique()
@@ -215,52 +224,41 @@ def plot_negotiation_data(
     ax27.set_xticklabels(invisible=True, labels="")
     ax27.legend(handles=legend_elements_ax27, fontsize=15, loc="center", ncol=2)
     try:
-        # Heatmap plots
-        heatmaps = [ax11, ax12, ax13, ax14, ax15, ax16, ax17, ax18]
-        # TODO: Implement better loop here
-        for table, ax in zip(list(q_tables.items()), heatmaps):
-            im = ax.imshow(table[1].transpose())
-            ax.set_title(
-                "Environment runtime: {} %".format(
-                    round(100 * table[0][0] / (len(datetime_index))), fontsize=12
+        # Heatmap plots, read from the snapshot arrays (or from dicts of tables, keyed by (step, datetime))
+        if isinstance(q_tables, QTableSnapshots):
+            actions = q_tables.actions
+            rounds = range(1, q_tables.rounds_total + 1)
+            action_tables = q_tables.select(number=8, counts=True)
+            q_tables = q_tables.select(number=8)
+        else:
+            actions = list(list(q_tables.values())[0].columns)
+            rounds = list(list(q_tables.values())[0].index)
+            q_tables = [(key[0], table.values) for key, table in q_tables.items()]
+            action_tables = [
+                (key[0], table.values) for key, table in action_tables.items()
+            ]
+
+        for heatmaps, tables, cmap in [
+            ([ax11, ax12, ax13, ax14, ax15, ax16, ax17, ax18], q_tables, None),
+            ([ax19, ax20, ax21, ax22, ax23, ax24, ax25, ax26], action_tables, "Greens"),
+        ]:
+            for (step, table), ax in zip(tables, heatmaps):
+                im = ax.imshow(table.transpose(), cmap=cmap)
+                ax.set_title(
+                    "Environment runtime: {} %".format(
+                        round(100 * step / (len(datetime_index))), fontsize=12
+                    )
                 )
-            )
-            ax.set_xticks(np.arange(len(table[1].index)))
-            ax.set_yticks(np.arange(len(table[1].columns)))
-            ax.set_yticklabels(table[1].columns)
-            ax.set_xticklabels(["R {}:".format(i) for i in table[1].index])
-            cbar = ax.figure.colorbar(im, ax=ax)
-
-            # ax.margins(x=0, y=0.5)
-            plt.setp(
-                ax.get_xticklabels(), rotation=45, ha="right", rotation_mode="anchor"
-            )
-
-            for i in range(len(table[1].index)):
-                for j in range(len(table[1].columns)):
-                    ax.text(j, i, "", ha="center", va="center", color="w")
-
-        heatmaps = [ax19, ax20, ax21, ax22, ax23, ax24, ax25, ax26]
-        for table, ax in zip(list(action_tables.items()), heatmaps):
-            im = ax.imshow(table[1].transpose(), cmap="Greens")
-            ax.set_title(
-                "Environment runtime: {} %".format(
-                    round(100 * table[0][0] / (len(datetime_index))), fontsize=12
+                ax.set_xticks(np.arange(len(rounds)))
+                ax.set_yticks(np.arange(len(actions)))
+                ax.set_yticklabels(actions)
+                ax.set_xticklabels(["R {}:".format(i) for i in rounds])
+                cbar = ax.figure.colorbar(im, ax=ax)
+
+                # ax.margins(x=0, y=0.5)
+                plt.setp(
+                    ax.get_xticklabels(), rotation=45, ha="right", rotation_mode="anchor"
                 )
-            )
-            ax.set_xticks(np.arange(len(table[1].index)))
-            ax.set_yticks(np.arange(len(table[1].columns)))
-            ax.set_yticklabels(table[1].columns)
-            ax.set_xticklabels(["R {}:".format(i) for i in table[1].index])
-            cbar = ax.figure.colorbar(im, ax=ax)
-            # ax.margins(x=0, y=0.5)
-            plt.setp(
-                ax.get_xticklabels(), rotation=45, ha="right", rotation_mode="anchor"
-            )
-
-            for i in range(len(table[1].index)):
-                for j in range(len(table[1].columns)):
-                    ax.text(j, i, "", ha="center", va="center", color="w")
 
         for ax in [ax0, ax1, ax2, ax31, ax4, ax6, ax8]:
             ax.xaxis.grid(True)
@@ -44,7 +44,9 @@ def plot_ems_net_demand_data(environment):
         )
         cum_planned_costs = planned_costs.cumsum()
         realised_costs = Series(
-            index=index, data=[c.costs for c in ems.commitments[1:]]
+            index=index,
+            data=ems.settled_commitments.costs
+            + [c.costs for c in ems.commitments[1:]],
         )
         cum_realised_costs = realised_costs.cumsum()
 
@@ -277,7 +279,9 @@ def plot_ems_data(environment):
         )
         cum_planned_costs = planned_costs.cumsum()
         realised_costs = Series(
-            index=index, data=[c.costs for c in ems.commitments[1:]]
+            index=index,
+            data=ems.settled_commitments.costs
+            + [c.costs for c in ems.commitments[1:]],
         )
         cum_realised_costs = realised_costs.cumsum()
 
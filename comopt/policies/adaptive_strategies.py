@@ -1,7 +1,21 @@
 from typing import List, Optional, Union, Tuple, Callable
 from random import uniform, gauss, seed, randint
 from copy import deepcopy
-from numpy import abs, sin
+from numpy import (
+    abs,
+    sin,
+    ndarray,
+    add,
+    subtract,
+    multiply,
+    divide,
+    floor,
+    exp,
+    log,
+    sqrt,
+    cumsum,
+    searchsorted,
+)
 from pandas import DataFrame
 # from comopt.model.negotiation_utils import (
 #     root_divided_by_2,
@@ -15,6 +29,8 @@ from pandas import DataFrame
 # )
 from functools import wraps
 
+from comopt.data_structures.q_table import QTable
+
 """Policy functions configures the strategy arguments for agents within negotiations"""
 
 # Decorator for exploration functions
@@ -22,7 +38,7 @@ def exploration_function(exploration_function: Callable) -> Callable:
 
     @wraps(exploration_function)
     def exploration_function_wrapper(
-        q_table: DataFrame, ta_parameter: dict, round_now: int
+        q_table: QTable, ta_parameter: dict, round_now: int
     ):
         return exploration_function(
             q_table=q_table, ta_parameter=ta_parameter, round_now=round_now
@@ -50,72 +66,131 @@ def action_function(action_function: Callable) -> Callable:
     return action_function_wrapper
 
 
+# ---------------------------------- EXPLORATION POLICIES ----------------------------------------#
+# Vectorized policies on a row of Q-values of any Q-table (e.g. of prognoses or flex requests). The noise row holds
+# pre-drawn uniform values in [0, 1), and out is a scratch row to compute in (see QTable.draw_noise and QTable.buffer).
+
+def epsilon_greedy(q_values: ndarray, noise: ndarray, epsilon: float) -> int:
+    """Random action if the first noise value is above epsilon, otherwise the action with the max Q-value."""
+    if noise[0] > epsilon:
+        return int(noise[-1] * len(q_values))
+    return int(q_values.argmax())
+
+
+def greedy_with_decaying_noise(
+    q_values: ndarray, noise: ndarray, scale: float, out: ndarray
+) -> int:
+    """Action with the max Q-value, after adding integer noise between 1 and the number of actions times scale."""
+    multiply(noise, len(q_values), out=out)
+    floor(out, out=out)
+    add(out, 1, out=out)
+    multiply(out, scale, out=out)
+    add(out, q_values, out=out)
+    return int(out.argmax())
+
+
+def softmax(
+    q_values: ndarray, noise: ndarray, temperature: float, out: ndarray
+) -> int:
+    """Action sampled with probabilities proportional to exp(Q-value / temperature), i.e. Boltzmann exploration."""
+    subtract(q_values, q_values.max(), out=out)
+    divide(out, temperature, out=out)
+    exp(out, out=out)
+    cumsum(out, out=out)
+    return min(int(searchsorted(out, noise[0] * out[-1], side="right")), len(out) - 1)
+
+
+def upper_confidence_bound(
+    q_values: ndarray, counts: ndarray, c: float, out: ndarray
+) -> int:
+    """Action with the max Q-value plus c*sqrt(ln(N)/n), for an action that has been chosen n out of N times.
+    Actions that have never been chosen go first."""
+    if counts.min() == 0:
+        return int(counts.argmin())
+    divide(log(counts.sum()), counts, out=out)
+    sqrt(out, out=out)
+    multiply(out, c, out=out)
+    add(out, q_values, out=out)
+    return int(out.argmax())
+
+
 # ---------------------------------- DECORATED EXPLORATION FUNCTIONS ----------------------------------------#
 @exploration_function
-# Randomizes existing Q-table with decaying noise (-> 1/environment.step_now). Action then gets chosen based on max Q-values of the randomized table.
+# Randomizes existing Q-values with decaying noise (-> 1/environment.step_now). Action then gets chosen based on max Q-values of the randomized values.
 def choose_action_greedily_with_noise(
-    q_table: DataFrame, ta_parameter: dict, round_now: int
-) -> str:
-
-    # Make copy of Q-Table
-    randomized_table = deepcopy(q_table)
-    # Get number of possible actions
-    number_of_actions = len(
-        ta_parameter["Action function"](
-            action=None, markup=None, show_actions=True
-        ).keys()
+    q_table: QTable, ta_parameter: dict, round_now: int
+) -> int:
+
+    return greedy_with_decaying_noise(
+        q_values=q_table.row(round_now),
+        noise=q_table.draw_noise(),
+        scale=1. / ta_parameter["Step now"],
+        out=q_table.buffer,
     )
 
-    # Randomize Q-value(=value) for each action(=column) in round_now(=index)
-    for col in q_table.columns:
-        randomized_table.loc[round_now, col] = q_table.loc[round_now, col] + randint(
-            1, number_of_actions
-        ) * (1. / (ta_parameter["Step now"]))
-
-    # Get column name of max Q-value from randomized Q-Table
-    action = randomized_table.loc[round_now, :].idxmax(axis=1)
-
-    return action
-
 
 @exploration_function
 # If uniform(0,1) gives a number above q_parameter["Epsilon"], agent uses random action sampling. Otherwise the action with max Q-Value gets selected.
 def choose_action_randomly_using_uniform(
-    q_table: DataFrame, ta_parameter: dict, round_now: int
-) -> str:
+    q_table: QTable, ta_parameter: dict, round_now: int
+) -> int:
+
+    return epsilon_greedy(
+        q_values=q_table.row(round_now),
+        noise=q_table.draw_noise(),
+        epsilon=ta_parameter["Epsilon"],
+    )
 
-    # Random selection
-    if uniform(0, 1) > ta_parameter["Epsilon"]:
-        action = q_table.loc[round_now, :].sample(1)
-        return action.index.format()[0]
 
-    # Greedy selection
-    else:
-        action = q_table.loc[round_now, :].idxmax()
+@exploration_function
+# Samples actions with probabilities based on their Q-Values, the higher ta_parameter["Temperature"] the more uniform.
+def choose_action_using_softmax(
+    q_table: QTable, ta_parameter: dict, round_now: int
+) -> int:
+
+    return softmax(
+        q_values=q_table.row(round_now),
+        noise=q_table.draw_noise(),
+        temperature=ta_parameter["Temperature"],
+        out=q_table.buffer,
+    )
 
-        return action
+
+@exploration_function
+# Chooses the action with max Q-Value plus a bonus for rarely chosen actions, weighted by ta_parameter["UCB constant"].
+def choose_action_using_upper_confidence_bound(
+    q_table: QTable, ta_parameter: dict, round_now: int
+) -> int:
+
+    return upper_confidence_bound(
+        q_values=q_table.row(round_now),
+        counts=q_table.counts(round_now),
+        c=ta_parameter["UCB constant"],
+        out=q_table.buffer,
+    )
 
 
 # ---------------------------------- DECORATED ACTION FUNCTIONS ----------------------------------------#
+# Describe actions and action values here
+MULTIPLY_MARKUP_EVENLY_ACTIONS = {
+    "+75": 1.75,
+    "+50": 1.5,
+    "+25": 1.25,
+    "0": 1,
+    "-25": 0.75,
+    "-50": 0.5,
+    "-75": 0.25,
+}
+
+
 @action_function
 # Action function for learning based policies
 def multiply_markup_evenly(
     action: str, markup: float, show_actions: bool = False
 ) -> float:
 
-    # Describe actions and action values here
-    actions = {
-        "+75": 1.75,
-        "+50": 1.5,
-        "+25": 1.25,
-        "0": 1,
-        "-25": 0.75,
-        "-50": 0.5,
-        "-75": 0.25,
-    }
-
     # If called only for the action names, make sure you pass markup = None to the action functions arguments.
     if markup is not None:
-        markup = markup * actions[action]
+        markup = markup * MULTIPLY_MARKUP_EVENLY_ACTIONS[action]
 
-    return {"Markup": markup, "Actions": actions}
+    return {"Markup": markup, "Actions": MULTIPLY_MARKUP_EVENLY_ACTIONS}
@@ -21,6 +21,8 @@ from comopt.policies.adaptive_strategies import (
     action_function,
     choose_action_greedily_with_noise,
     choose_action_randomly_using_uniform,
+    choose_action_using_softmax,
+    choose_action_using_upper_confidence_bound,
     multiply_markup_evenly,
 )
 
@@ -222,24 +224,18 @@ def Q_learning(
     rounds_left: int,
 ) -> dict:
 
-    if "Prognosis" in description:
-        q_table = plan_board.q_table_prognosis
-        # action_table = plan_board.action_table_prognosis
-
-    else:
-        q_table = plan_board.q_table_flexrequest
-        # action_table = plan_board.action_table_flexrequest
+    q_table = plan_board.get_q_table(description)
 
     round_now = rounds_total - rounds_left + 1
 
-    # Use an exploration function to choose an action
+    # Use an exploration function to choose an action (by its index in the Q-table)
     action = ta_parameter["Exploration function"](
         q_table=q_table, ta_parameter=ta_parameter, round_now=round_now
     )
 
     # Modify shaped markup based on choosen action function
     ta_parameter["Markup"] = ta_parameter["Action function"](
-        action=action,
+        action=q_table.actions[action],
         markup=(
             ta_parameter["Markup"] * ta_parameter["Concession"](rounds_total=rounds_total, rounds_left=rounds_left)
         ),
@@ -260,7 +256,7 @@ def Q_learning(
     # e.g if rounds_left == 5, then reservation_price == 10
 
     return {
-        "Bid": 0,
+        "Bid": ta_parameter["Bid"],
         "Reservation price": ta_parameter["Reservation price"],
         "Markup": ta_parameter["Markup"],
         "Concession": ta_parameter["Concession"],
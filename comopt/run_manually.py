@@ -46,6 +46,8 @@ from comopt.policies.ta_policies import (
 from comopt.policies.adaptive_strategies import (
     choose_action_randomly_using_uniform,
     choose_action_greedily_with_noise,
+    choose_action_using_softmax,
+    choose_action_using_upper_confidence_bound,
     multiply_markup_evenly
 )
 
@@ -264,6 +266,18 @@ input_data = {
     "EMS prices": [(feed_in_price, purchase_price, flex_price)],
     # "MA imbalance_market_costs": imbalance_market_costs,
     "Central optimization": False,
+    "Solver parameter": {
+        "Backends": ["highs", "glpk", "cbc"],  # Tried in this order
+        "Options": {},
+        "Formulation": "LP",
+        "Persistent": True,  # Reuse and warm-start the scheduling model of each EMS
+        "Cache size": 256,
+        "Cache file": None,  # e.g. "comopt/pickles/scheduler_cache.pickle"
+        "Processes": 0,  # Worker processes to schedule the EMS in parallel
+        "Batched": False,  # Schedule all EMS in one block-diagonal model
+        "Instrumentation": False,  # Record statistics of each device scheduler call
+        "Solver call log": None,  # e.g. "comopt/solver_calls.csv" (or .parquet)
+    },
     "MA horizon": timedelta(hours=1),
     "TA horizon": timedelta(hours=1),
     # "Timestep now": 0,
@@ -290,7 +304,10 @@ input_data = {
         "Alpha": 0.1,  # Learning rate
         "Epsilon": 0.2,  # Exploration range: 0 = Always random exploration, 1 = Always Argmax(Q-Value)
         "Action function": multiply_markup_evenly,
-        "Exploration function": choose_action_randomly_using_uniform,
+        "Exploration function": choose_action_randomly_using_uniform,  # choose_action_greedily_with_noise, choose_action_using_softmax, choose_action_using_upper_confidence_bound
+        "Temperature": 1,  # Used in softmax exploration
+        "UCB constant": 1,  # Used in upper confidence bound exploration
+        "Snapshots": 8,  # Number of Q-table snapshots taken over the simulation runtime
         "Step now": 1, # Used in Q-Learing exploration function
     },
 
@@ -318,8 +335,13 @@ input_data = {
         "Alpha": 0.1,  # Learning rate
         "Epsilon": 0.2,  # Exploration range: 0 = Always random exploration, 1 = Always Argmax(Q-Value)
         "Action function": multiply_markup_evenly,
-        "Exploration function": choose_action_randomly_using_uniform,
+        "Exploration function": choose_action_randomly_using_uniform,  # choose_action_greedily_with_noise, choose_action_using_softmax, choose_action_using_upper_confidence_bound
+        "Temperature": 1,  # Used in softmax exploration
+        "UCB constant": 1,  # Used in upper confidence bound exploration
+        "Snapshots": 8,  # Number of Q-table snapshots taken over the simulation runtime
         "Step now": 1,
+        # "Flex split methods": [equal_flex_split_requested, dual_decomposition_flex_split],  # Evaluated concurrently
+        # "Dual decomposition": {"Step size": 1, "Tolerance": 0.01, "Iterations": 20, "Time budget": 10},
     },
 }
 
@@ -366,8 +388,7 @@ env.trading_agent.cleared_flex_negotiations
 
 plt_2 = plot_negotiation_data(
     negotiation_data=env.plan_board.flexrequest_negotiation_log_1,
-    q_tables=env.trading_agent.stored_q_tables_flexrequest_1,
-    action_tables=env.trading_agent.stored_action_tables_flexrequest_1,
+    q_tables=env.plan_board.q_table_snapshots_flexrequest,
     input_data=input_data,
 )
 
@@ -377,6 +398,18 @@ plt_2 = plot_negotiation_data(
 #                       input_data = input_data,
 #                       )
 # %%
+# Pre-train the flex request Q-table on negotiations alone, and deploy it for the next simulation run
+# from comopt.model.negotiation_training import NegotiationTrainer, recorded_reservation_prices
+# trainer = NegotiationTrainer(
+#     description="Flexrequest",
+#     ta_parameter=input_data["TA flexrequest parameter"],
+#     ma_parameter=input_data["MA flexrequest parameter"],
+#     ta_reservation_prices=recorded_reservation_prices(env.plan_board.flexrequest_negotiations_log, agent="TA"),
+#     ma_reservation_prices=lambda random, size: random.normal(6.5, 1, size),
+# )
+# training_results = trainer.train(episodes=100000)
+# trainer.deploy(env.plan_board)
+# %%
 # hierarchical indices and columns
 
 
@@ -1,8 +1,31 @@
-from typing import List, Tuple, Union
-import cplex
+from typing import List, Optional, Tuple, Union
+from itertools import product
 
 from pandas import DataFrame, MultiIndex, Series, to_timedelta, DatetimeIndex
-from numpy import isnan, nanmin, nanmax
+from numpy import (
+    ndarray,
+    array,
+    broadcast_to,
+    isnan,
+    isfinite,
+    nanmin,
+    nanmax,
+    nan_to_num,
+    where,
+    minimum,
+    maximum,
+    around,
+    arange,
+    clip,
+    concatenate,
+    errstate,
+    flatnonzero,
+    zeros,
+    unique,
+    diff,
+    cumsum,
+    argsort,
+)
 from pyomo.core import (
     ConcreteModel,
     Var,
@@ -10,12 +33,14 @@ from pyomo.core import (
     RangeSet,
     Param,
     Reals,
+    NonNegativeReals,
     Binary,
     Constraint,
     Objective,
     minimize,
     TransformationFactory,
     BuildAction,
+    Block,
 )
 from pyomo.gdp import Disjunct, Disjunction
 from pyomo.environ import UnknownSolver, Suffix
@@ -23,13 +48,22 @@ from pyomo.core.kernel.numvalue import value
 from pyomo.opt import SolverFactory
 
 from comopt.model.utils import initialize_series
+from comopt.solver.solver_backends import get_solvers, solve_model, reads_warmstart
+from comopt.solver.instrumentation import record_solver_call, solver_call_log
 
+from collections import Counter
+from time import perf_counter
 import logging
 
+logger = logging.getLogger(__name__)
+
 # logging.getLogger('pyomo.core').setLevel(logging.ERROR)
 #
 infinity = float("inf")
 
+# Number of device scheduler calls per path taken: "NumPy" (see separable_schedule), "LP" or "GDP"
+scheduler_paths = Counter()
+
 
 def device_scheduler(
     device_constraints: List[DataFrame],
@@ -37,6 +71,10 @@ def device_scheduler(
     commitment_quantities: List[Series],
     commitment_downwards_deviation_price: Union[List[Series], List[float]],
     commitment_upwards_deviation_price: Union[List[Series], List[float]],
+    formulation: str = "LP",
+    solver_parameter: dict = None,
+    call_info: dict = None,
+    data: dict = None,
 ) -> Tuple[List[Series], List[float]]:
     """Schedule devices given constraints on a device and EMS level, and given a list of commitments by the EMS.
     The commitments are assumed to be with regards to the flow of energy to the device (positive for consumption,
@@ -61,11 +99,693 @@ def device_scheduler(
     All Series and DataFrames should have the same resolution.
     For now we pass in the various constraints and prices as separate variables, from which we make a MultiIndex
     DataFrame. Later we could pass in a MultiIndex DataFrame directly.
+    The formulation determines how deviations from commitments are priced:
+        LP: deviations are split into non-negative upwards and downwards deviation variables, which keeps the model
+            a pure linear program (no binaries). This requires convex deviation costs, i.e. an upwards deviation price
+            that is at least the downwards deviation price. Otherwise we fall back to the GDP formulation.
+        GDP: each deviation is priced with a disjunction (upwards or downwards), transformed with big-M constraints.
+    The solver parameter selects the solver backends (see comopt.solver.solver_backends), defaulting to open-source
+    solvers.
+    The call info describes the call in the solver call log (see comopt.solver.instrumentation), e.g.
+    {"Caller": "Prognosis", "EMS": "EMS 1"}.
+    The scheduler arrays of the input (see scheduler_arrays) can be passed in as data, if they were already built
+    (e.g. by the scheduler cache).
     """
 
     # If the EMS has no devices, don't bother
     if len(device_constraints) == 0:
         return [], [] * len(commitment_quantities)
+    instrumented = (solver_parameter or {}).get("Instrumentation", False)
+    tic = perf_counter()
+
+    # Convert all constraints, commitments and prices to arrays once
+    if data is None:
+        data = scheduler_arrays(
+            device_constraints,
+            ems_constraints,
+            commitment_quantities,
+            commitment_downwards_deviation_price,
+            commitment_upwards_deviation_price,
+        )
+
+    # Merge commitments that don't conflict, so the model size doesn't grow with the number of commitments
+    if (solver_parameter or {}).get("Compaction", True):
+        data = compact_commitments(data)
+
+    # Schedule simple device structures without building a model
+    if (solver_parameter or {}).get("Fast path", True):
+        power = separable_schedule(data)
+        if power is not None:
+            record_scheduler_path("NumPy")
+            if instrumented:
+                record_solver_call(
+                    call_info, "NumPy", problem_shape(data), perf_counter() - tic
+                )
+            return schedule_from_power(power, data)
+
+    # The LP formulation is only exact for convex deviation costs
+    if formulation == "LP" and not data["convex"]:
+        formulation = "GDP"
+    record_scheduler_path(formulation)
+
+    model = build_device_model(data)
+    if formulation == "LP":
+        add_split_deviations(model)
+    else:
+        add_disjunctive_deviations(
+            model, data["overall min price"], data["overall max price"]
+        )
+
+    # Transform and solve
+    if formulation == "GDP":
+        xfrm = TransformationFactory("gdp.bigm")
+        xfrm.apply_to(model)
+    toc = perf_counter()
+    backend, results = solve_model(model, solver_parameter)
+    if instrumented:
+        record_solver_call(
+            call_info,
+            formulation,
+            problem_shape(data),
+            build_time=toc - tic,
+            solve_time=perf_counter() - toc,
+            model=model,
+            backend=backend,
+            results=results,
+        )
+
+    return extract_schedule(model, data)
+
+
+def problem_shape(data: dict) -> Tuple[int, int, int]:
+    """Number of devices, datetimes and commitments of the scheduler arrays."""
+    return data["power max"].shape + data["commitment quantity"].shape[:1]
+
+
+class PersistentDeviceScheduler:
+    """Device scheduler that keeps its models alive between calls, e.g. for the rolling horizon of an EMS.
+    A model is kept per shape (number of devices, datetimes and commitments), so that the prognosis and the flex
+    request of a step (which differ in their number of commitments) each reuse their own model. On each call, only
+    the bounds and commitment parameters are updated. Solvers are kept per model too, so persistent solver interfaces
+    (e.g. highs) update their instance and restart from their previous basis. For solvers that read a warm start from
+    the variable values instead (e.g. cbc), the previous solution is shifted to the new window.
+    Only the LP formulation is kept alive; calls that need the GDP formulation are passed on to device_scheduler."""
+
+    def __init__(self, solver_parameter: dict = None):
+        self.solver_parameter = solver_parameter
+        self.models = dict()
+        self.solvers = dict()
+        self.starts = dict()
+
+    def __call__(
+        self,
+        device_constraints: List[DataFrame],
+        ems_constraints: DataFrame,
+        commitment_quantities: List[Series],
+        commitment_downwards_deviation_price: Union[List[Series], List[float]],
+        commitment_upwards_deviation_price: Union[List[Series], List[float]],
+        formulation: str = "LP",
+        solver_parameter: dict = None,
+        call_info: dict = None,
+        data: dict = None,
+    ) -> Tuple[List[Series], List[float]]:
+        if solver_parameter is None:
+            solver_parameter = self.solver_parameter
+
+        # If the EMS has no devices, don't bother
+        if len(device_constraints) == 0:
+            return [], [] * len(commitment_quantities)
+        instrumented = (solver_parameter or {}).get("Instrumentation", False)
+        tic = perf_counter()
+
+        if data is None:
+            data = scheduler_arrays(
+                device_constraints,
+                ems_constraints,
+                commitment_quantities,
+                commitment_downwards_deviation_price,
+                commitment_upwards_deviation_price,
+            )
+        if formulation != "LP" or not data["convex"]:
+            return device_scheduler(
+                device_constraints,
+                ems_constraints,
+                commitment_quantities,
+                commitment_downwards_deviation_price,
+                commitment_upwards_deviation_price,
+                formulation=formulation,
+                solver_parameter=solver_parameter,
+                call_info=call_info,
+                data=data,
+            )
+        start, end, resolution = data["start"], data["end"], data["resolution"]
+        if (solver_parameter or {}).get("Compaction", True):
+            data = compact_commitments(data)
+        if (solver_parameter or {}).get("Fast path", True):
+            power = separable_schedule(data)
+            if power is not None:
+                record_scheduler_path("NumPy")
+                if instrumented:
+                    record_solver_call(
+                        call_info, "NumPy", problem_shape(data), perf_counter() - tic
+                    )
+                return schedule_from_power(power, data)
+        record_scheduler_path("LP")
+
+        shape = problem_shape(data)
+        if shape not in self.models:
+            model = build_device_model(data)
+            add_split_deviations(model)
+            self.models[shape] = model
+            self.solvers[shape] = get_solvers(solver_parameter)
+            warmstart = False
+        else:
+            model = self.models[shape]
+            update_device_model(model, data)
+
+            # Shift the previous solution to the new window, for solvers that read it as a warm start
+            # (persistent solvers restart from their own basis instead, see comopt.solver.solver_backends)
+            warmstart = any(
+                reads_warmstart(backend, solver) for backend, solver in self.solvers[shape]
+            )
+            if warmstart:
+                offset = int((start - self.starts[shape]) / resolution.to_timedelta64())
+                for var in (
+                    model.power,
+                    model.stock,
+                    model.ems_power,
+                    model.deviation_up,
+                    model.deviation_down,
+                ):
+                    shift_values(var, offset, shape[1])
+        self.starts[shape] = start
+
+        toc = perf_counter()
+        backend, results = solve_model(
+            model,
+            solver_parameter,
+            warmstart=warmstart,
+            solvers=self.solvers[shape],
+        )
+        if instrumented:
+            record_solver_call(
+                call_info,
+                "LP",
+                shape,
+                build_time=toc - tic,
+                solve_time=perf_counter() - toc,
+                model=model,
+                backend=backend,
+                results=results,
+            )
+
+        return extract_schedule(model, data)
+
+
+def batched_device_scheduler(
+    scheduler_inputs: List[dict],
+    coupling_quantity: Optional[Series] = None,
+    coupling_downwards_deviation_price: Union[Series, float] = 0,
+    coupling_upwards_deviation_price: Union[Series, float] = 0,
+    formulation: str = "LP",
+    solver_parameter: dict = None,
+    call_info: dict = None,
+) -> Tuple[List[Tuple[List[Series], List[float]]], Optional[float]]:
+    """Schedule the devices of several EMS at once, in a single block-diagonal model with one block per EMS, which
+    is built once and solved with one solver call (instead of one model and one solver call per EMS).
+    Each scheduler input holds the keyword arguments of device_scheduler for one EMS (see EMS.scheduler_input).
+    Without a coupling commitment, the blocks are independent, and each EMS gets the schedule it would get from
+    device_scheduler. Optionally, the blocks are coupled by a commitment on the aggregated power of all EMS
+    (e.g. the FlexRequest of the Market Agent), whose deviation costs are minimised together with those of the EMS.
+    The coupling commitment should have the same time window as the EMS, and convex deviation costs.
+    Returns the solution of each EMS (as returned by device_scheduler) and the costs of the coupling commitment
+    (None without a coupling commitment)."""
+
+    solutions = [([], []) for _ in scheduler_inputs]
+    instrumented = (solver_parameter or {}).get("Instrumentation", False)
+    tic = perf_counter()
+
+    # Convert the input of each EMS to arrays, skipping EMS without devices
+    blocks = dict()
+    for i, scheduler_input in enumerate(scheduler_inputs):
+        if len(scheduler_input["device_constraints"]) == 0:
+            continue
+        data = scheduler_input_arrays(scheduler_input)
+        if (solver_parameter or {}).get("Compaction", True):
+            data = compact_commitments(data)
+        blocks[i] = data
+    if len(blocks) == 0:
+        return solutions, None if coupling_quantity is None else 0
+
+    # The LP formulation is only exact for convex deviation costs
+    if formulation == "LP" and not all(data["convex"] for data in blocks.values()):
+        formulation = "GDP"
+
+    # Add a block per EMS, and minimise the sum of their costs
+    model = ConcreteModel()
+    model.ems = Block(list(blocks.keys()))
+    for i, data in blocks.items():
+        block = build_device_model(data, model.ems[i])
+        if formulation == "LP":
+            add_split_deviations(block)
+        else:
+            add_disjunctive_deviations(
+                block, data["overall min price"], data["overall max price"]
+            )
+        block.costs.deactivate()
+    costs = sum(model.ems[i].costs.expr for i in blocks)
+
+    # Couple the blocks with a commitment on the aggregated power
+    if coupling_quantity is not None:
+        first = next(iter(blocks.values()))
+        if not all(
+            data["start"] == first["start"] and data["end"] == first["end"]
+            for data in blocks.values()
+        ):
+            raise Exception("Not implemented for EMS with different time windows.")
+        number_of_datetimes = first["power max"].shape[1]
+        quantity = array(coupling_quantity, dtype="float64").reshape(
+            number_of_datetimes
+        )
+        down_price, up_price = (
+            array(
+                broadcast_to(
+                    price.values if isinstance(price, Series) else price,
+                    (number_of_datetimes,),
+                ),
+                dtype="float64",
+            )
+            for price in (
+                coupling_downwards_deviation_price,
+                coupling_upwards_deviation_price,
+            )
+        )
+        no_commitment = isnan(quantity)
+        if not (up_price >= down_price)[~no_commitment].all():
+            raise Exception(
+                "Not implemented for nonconvex deviation costs of the coupling commitment."
+            )
+        quantity = where(no_commitment, 0, quantity)
+        down_price = where(no_commitment, 0, down_price)
+        up_price = where(no_commitment, 0, up_price)
+
+        model.j = RangeSet(0, number_of_datetimes - 1, doc="Set of datetimes")
+        model.coupling_quantity = Param(model.j, initialize=indexed(quantity))
+        model.coupling_up = Var(model.j, domain=NonNegativeReals, initialize=0)
+        model.coupling_down = Var(model.j, domain=NonNegativeReals, initialize=0)
+
+        def coupling_split(m, j):
+            aggregated_power = sum(m.ems[i].ems_power[j] for i in blocks)
+            return (
+                aggregated_power - m.coupling_quantity[j]
+                == m.coupling_up[j] - m.coupling_down[j]
+            )
+
+        model.coupling_split = Constraint(model.j, rule=coupling_split)
+        costs += sum(
+            model.coupling_up[j] * float(up_price[j])
+            - model.coupling_down[j] * float(down_price[j])
+            for j in model.j
+        )
+    model.costs = Objective(expr=costs, sense=minimize)
+
+    # Transform and solve
+    if formulation == "GDP":
+        xfrm = TransformationFactory("gdp.bigm")
+        xfrm.apply_to(model)
+    toc = perf_counter()
+    backend, results = solve_model(model, solver_parameter)
+    if instrumented:
+        shapes = [problem_shape(data) for data in blocks.values()]
+        record_solver_call(
+            call_info,
+            formulation,
+            (
+                sum(shape[0] for shape in shapes),
+                max(shape[1] for shape in shapes),
+                sum(shape[2] for shape in shapes),
+            ),
+            build_time=toc - tic,
+            solve_time=perf_counter() - toc,
+            model=model,
+            backend=backend,
+            results=results,
+        )
+
+    for i, data in blocks.items():
+        solutions[i] = extract_schedule(model.ems[i], data)
+    if coupling_quantity is None:
+        return solutions, None
+
+    # Redo the cost calculation of the coupling commitment, as for the commitments of each EMS
+    aggregated_power = array([power_values(model.ems[i]).sum(axis=0) for i in blocks])
+    coupling_costs = commitment_costs(
+        aggregated_power, quantity[None, :], up_price[None, :], down_price[None, :]
+    )[0]
+    return solutions, coupling_costs
+
+
+def record_scheduler_path(path: str):
+    """Count which path a device scheduler call took (see scheduler_paths)."""
+    scheduler_paths[path] += 1
+    logger.debug("Device scheduler path: %s" % path)
+
+
+# Persistent schedulers of a worker process, per EMS name (see schedule_in_process)
+process_schedulers = dict()
+
+
+def schedule_in_process(
+    ems_name: str, scheduler_input: dict, persistent: bool = True
+) -> Tuple[Tuple[List[Series], List[float]], List[dict]]:
+    """Entry point for scheduling the devices of an EMS in a worker process of a process pool.
+    With persistent scheduling, each worker process keeps its own PersistentDeviceScheduler per EMS.
+    Returns the solution together with the solver calls recorded by the worker (see process_result)."""
+    logged_calls = len(solver_call_log)
+    if not persistent:
+        solution = device_scheduler(**scheduler_input)
+    else:
+        if ems_name not in process_schedulers:
+            process_schedulers[ems_name] = PersistentDeviceScheduler(
+                scheduler_input.get("solver_parameter")
+            )
+        solution = process_schedulers[ems_name](**scheduler_input)
+    calls = solver_call_log.rows[logged_calls:]
+    del solver_call_log.rows[logged_calls:]
+    return solution, calls
+
+
+def process_result(
+    result: Tuple[Tuple[List[Series], List[float]], List[dict]]
+) -> Tuple[List[Series], List[float]]:
+    """Unpack the result of schedule_in_process, adding the solver calls of the worker to the solver call log."""
+    solution, calls = result
+    solver_call_log.extend(calls)
+    return solution
+
+
+def extract_schedule(
+    model: ConcreteModel, data: dict
+) -> Tuple[List[Series], List[float]]:
+    """Read the planned power per device and the costs per commitment from a solved model.
+    For compacted commitments, the costs are calculated per original commitment."""
+    return schedule_from_power(power_values(model), data)
+
+
+def power_values(model: ConcreteModel) -> ndarray:
+    """The solved power of a device model as an array (d, j)."""
+    return values_array(model.power, (len(model.d), len(model.j)))
+
+
+def values_array(component: Union[Var, Param], shape: Tuple[int, ...]) -> ndarray:
+    """The values of an indexed variable or parameter as an array, read in one pass in index order."""
+    return array(
+        list(component.extract_values().values()), dtype="float64"
+    ).reshape(shape)
+
+
+def commitment_costs(
+    power: ndarray, quantity: ndarray, up_price: ndarray, down_price: ndarray
+) -> List[float]:
+    """Costs per commitment of the planned power per device (d, j), given commitment quantities and prices (c, j).
+    Each deviation is priced with the upwards or downwards deviation price depending on its sign, and the costs
+    per datetime are rounded before summing."""
+    deviation = power.sum(axis=0) - quantity
+    costs = around(where(deviation >= 0, deviation * up_price, deviation * down_price), 3)
+    return costs.sum(axis=1).tolist()
+
+
+def scheduler_input_arrays(scheduler_input: dict) -> dict:
+    """The scheduler arrays (see scheduler_arrays) of the keyword arguments of a device_scheduler call."""
+    return scheduler_arrays(
+        scheduler_input["device_constraints"],
+        scheduler_input["ems_constraints"],
+        scheduler_input["commitment_quantities"],
+        scheduler_input["commitment_downwards_deviation_price"],
+        scheduler_input["commitment_upwards_deviation_price"],
+    )
+
+
+def schedule_costs(
+    scheduler_input: dict, power_per_device: List[Series]
+) -> List[float]:
+    """Costs per commitment of a given schedule (e.g. one planned centrally, see batched_device_scheduler), for the
+    keyword arguments of a device_scheduler call."""
+    if len(power_per_device) == 0:
+        return []
+    power = array([power.values for power in power_per_device], dtype="float64")
+    return schedule_from_given_power(scheduler_input, power)[1]
+
+
+def schedule_from_given_power(
+    scheduler_input: dict, power: ndarray
+) -> Tuple[List[Series], List[float]]:
+    """The planned power per device and the costs per commitment (see schedule_from_power) of a given power (d, j),
+    for the keyword arguments of a device_scheduler call. Only the commitments are converted to arrays."""
+    index = scheduler_input["device_constraints"][0].index
+    data = commitment_arrays(
+        scheduler_input["commitment_quantities"],
+        scheduler_input["commitment_downwards_deviation_price"],
+        scheduler_input["commitment_upwards_deviation_price"],
+        len(index),
+    )
+    data["resolution"] = to_timedelta(index.freq)
+    data["start"], data["end"] = index[0], index[-1] + data["resolution"]
+    return schedule_from_power(power, data)
+
+
+def schedule_cost_bound(scheduler_input: dict, data: dict = None) -> float:
+    """Lower bound on the costs of a device_scheduler call, i.e. on the sum of its costs per commitment, found
+    without solving. Stock constraints are relaxed, so that the EMS power of each datetime can be chosen freely
+    within its flow bounds. The deviation costs of each datetime are then piecewise linear in the EMS power, so their
+    minimum lies at a bound or at a committed quantity (whether or not the costs are convex).
+    The scheduler arrays of the input can be passed in as data, if they were already built."""
+    if len(scheduler_input["device_constraints"]) == 0:
+        return 0
+    if data is None:
+        data = scheduler_input_arrays(scheduler_input)
+    lower = maximum(data["ems derivative min"], data["power min"].sum(axis=0))
+    upper = minimum(data["ems derivative max"], data["power max"].sum(axis=0))
+    if (lower > upper).any():
+        return infinity  # Infeasible
+
+    # Candidate EMS power (k, j), and the costs of each candidate summed over commitments (k, j)
+    candidates = power_candidates(data, lower, upper)
+    costs = candidate_costs(candidates, data)
+    costs = where(isnan(costs), -infinity, costs)  # Unbounded candidates give no bound
+    return float(costs.min(axis=0).sum())
+
+
+def power_candidates(data: dict, lower: ndarray, upper: ndarray) -> ndarray:
+    """Candidate EMS power (k, j) for minimising piecewise linear deviation costs within flow bounds: the committed
+    quantities (clipped to the bounds), followed by the bounds themselves."""
+    return concatenate(
+        [clip(data["commitment quantity"], lower, upper), lower[None, :], upper[None, :]]
+    )
+
+
+def candidate_costs(candidates: ndarray, data: dict) -> ndarray:
+    """Deviation costs (k, j) of candidate EMS power (k, j), summed over commitments."""
+    quantity = data["commitment quantity"]
+    up_price, down_price = data["up price"][None, :, :], data["down price"][None, :, :]
+    with errstate(invalid="ignore"):
+        deviation = candidates[:, None, :] - quantity[None, :, :]
+        return where(
+            deviation >= 0,
+            where(up_price == 0, 0, deviation * up_price),
+            where(down_price == 0, 0, deviation * down_price),
+        ).sum(axis=1)
+
+
+def separable_schedule(data: dict) -> Optional[ndarray]:
+    """Schedule devices without stock bounds (e.g. curtailable generators and fixed loads) without building a model.
+    Their flows are then only bounded per datetime, so the deviation costs can be minimised for each datetime
+    separately. These costs are piecewise linear in the EMS power, so the minimum lies at a committed quantity or at
+    a flow bound (whether or not the costs are convex), and evaluating these candidates is exact. The EMS power is
+    then split over the devices by raising their flows from their lower bounds, in device order.
+    A single device with stock bounds (e.g. a buffer) is scheduled with stock_limited_schedule.
+    Returns the planned power (d, j), or None if the device scheduler has to build a model."""
+    power_min, power_max = data["power min"], data["power max"]
+    if not (isfinite(power_min).all() and isfinite(power_max).all()):
+        return None  # Leave unbounded problems to the solver
+    stock_limited = flatnonzero(
+        isfinite(data["device max"]).any(axis=1) | isfinite(data["device min"]).any(axis=1)
+    )
+    if len(stock_limited) > 1:
+        return None
+    elif len(stock_limited) == 1:
+        return stock_limited_schedule(data, stock_limited[0])
+    lower = maximum(data["ems derivative min"], power_min.sum(axis=0))
+    upper = minimum(data["ems derivative max"], power_max.sum(axis=0))
+    if (lower > upper).any():
+        return None  # Leave infeasible problems to the solver
+
+    candidates = power_candidates(data, lower, upper)
+    best = candidate_costs(candidates, data).argmin(axis=0)  # Prefers committed quantities in case of a tie
+    ems_power = candidates[best, arange(candidates.shape[1])]
+    return split_power(ems_power, power_min, power_max)
+
+
+def split_power(ems_power: ndarray, power_min: ndarray, power_max: ndarray) -> ndarray:
+    """Split the EMS power (j) over the devices (d, j), by raising their flows from their lower bounds, in device
+    order."""
+    power = power_min.copy()
+    remaining = ems_power - power_min.sum(axis=0)
+    for d in range(power.shape[0]):
+        raised = clip(remaining, 0, power_max[d] - power_min[d])
+        power[d] += raised
+        remaining = remaining - raised
+    return power
+
+
+def stock_limited_schedule(data: dict, device: int) -> Optional[ndarray]:
+    """Schedule a single device with stock bounds (e.g. a buffer), together with any devices without stock bounds,
+    without building a model. This requires convex deviation costs.
+    The cheapest costs up to each datetime are then convex piecewise linear in the stock of the device, and are
+    found by dynamic programming: the costs up to the previous datetime are combined with the costs of the flow of
+    the device (an infimal convolution, which merges their segments in order of slope), and limited to the stock
+    bounds. The costs of a flow of the device are those of the cheapest EMS power that the other devices can make
+    up for. Going back from the cheapest final stock, each stock is then split into the previous stock and a flow.
+    Returns the planned power (d, j), or None if the device scheduler has to build a model."""
+    if not data["convex"]:
+        return None
+    power_min, power_max = data["power min"], data["power max"]
+    others = arange(power_min.shape[0]) != device
+    other_min, other_max = power_min[others].sum(axis=0), power_max[others].sum(axis=0)
+    lower = maximum(data["ems derivative min"], power_min[device] + other_min)
+    upper = minimum(data["ems derivative max"], power_max[device] + other_max)
+    if (lower > upper).any():
+        return None  # Leave infeasible problems to the solver
+    candidates = power_candidates(data, lower, upper)
+    costs = candidate_costs(candidates, data)
+    number_of_datetimes = candidates.shape[1]
+
+    # Costs over the EMS power and over the flow of the device, and costs over the stock up to each datetime
+    ems_costs, flow_costs, stock_costs = [], [], [(0, array([]), array([]))]
+    for j in range(number_of_datetimes):
+        ems_costs.append(cost_segments(candidates[:, j], costs[:, j]))
+        other_flow = (-other_max[j], array([other_max[j] - other_min[j]]), array([0.0]))
+        flow_costs.append(
+            clip_segments(
+                convolve_segments(ems_costs[j], other_flow)[:3],
+                power_min[device, j],
+                power_max[device, j],
+            )
+        )
+        if flow_costs[j] is None:
+            return None
+        stock_costs.append(
+            clip_segments(
+                convolve_segments(stock_costs[j], flow_costs[j])[:3],
+                data["device min"][device, j],
+                data["device max"][device, j],
+            )
+        )
+        if stock_costs[-1] is None:
+            return None  # Leave infeasible problems to the solver
+
+    # Go back from the cheapest final stock
+    device_power = zeros(number_of_datetimes)
+    stock = cheapest(stock_costs[-1])
+    for j in reversed(range(number_of_datetimes)):
+        previous_stock = split_segments(stock_costs[j], flow_costs[j], stock)
+        device_power[j] = stock - previous_stock
+        stock = previous_stock
+
+    # Let the other devices make up for the cheapest EMS power they can
+    ems_power = clip(
+        [cheapest(ems_costs[j]) for j in range(number_of_datetimes)],
+        maximum(lower, device_power + other_min),
+        minimum(upper, device_power + other_max),
+    )
+    power = zeros(power_min.shape)
+    power[device] = device_power
+    power[others] = split_power(ems_power - device_power, power_min[others], power_max[others])
+    return power
+
+
+# Convex piecewise linear functions on an interval are represented by the lower end of their interval, and by the
+# lengths and slopes of their segments, in order of slope
+
+
+def cost_segments(points: ndarray, costs: ndarray) -> Tuple[float, ndarray, ndarray]:
+    """Segments of the piecewise linear function through the given points and costs."""
+    points, index = unique(points, return_index=True)
+    lengths = diff(points)
+    return points[0], lengths, diff(costs[index]) / lengths
+
+
+def convolve_segments(f: tuple, g: tuple) -> Tuple[float, ndarray, ndarray, ndarray]:
+    """Infimal convolution of two convex piecewise linear functions, i.e. the cheapest sum of f(x) and g(y) for each
+    x + y, together with whether each of its segments comes from f."""
+    slopes = concatenate([f[2], g[2]])
+    order = argsort(slopes, kind="mergesort")
+    from_f = arange(len(slopes)) < len(f[2])
+    return f[0] + g[0], concatenate([f[1], g[1]])[order], slopes[order], from_f[order]
+
+
+def clip_segments(f: tuple, lower: float, upper: float) -> Optional[Tuple[float, ndarray, ndarray]]:
+    """Restrict a piecewise linear function to an interval, or None if they don't overlap."""
+    ends = f[0] + concatenate([[0], cumsum(f[1])])
+    lower, upper = max(lower, ends[0]), min(upper, ends[-1])
+    if lower > upper + 1e-9:
+        return None
+    lengths = diff(clip(ends, lower, max(lower, upper)))
+    return lower, lengths[lengths > 0], f[2][lengths > 0]
+
+
+def split_segments(f: tuple, g: tuple, total: float) -> float:
+    """The argument of f in the cheapest split of a total into arguments of f and g (see convolve_segments)."""
+    start, lengths, _, from_f = convolve_segments(f, g)
+    taken = clip(total - start - (cumsum(lengths) - lengths), 0, lengths)
+    return f[0] + taken[from_f].sum()
+
+
+def cheapest(f: tuple) -> float:
+    """The lowest argument at which a convex piecewise linear function is minimal."""
+    return f[0] + f[1][f[2] < 0].sum()
+
+
+def schedule_from_power(
+    power: ndarray, data: dict
+) -> Tuple[List[Series], List[float]]:
+    """The planned power per device and the costs per commitment, as returned by the device scheduler, for the
+    planned power (d, j). For compacted commitments, the costs are calculated per original commitment."""
+    start, end, resolution = data["start"], data["end"], data["resolution"]
+    planned_power_per_device = [
+        initialize_series(
+            device_power, start=start, end=end, resolution=resolution
+        )
+        for device_power in around(power, 3).tolist()
+    ]
+    if "original commitment quantity" in data:
+        quantity = data["original commitment quantity"]
+        up_price, down_price = data["original up price"], data["original down price"]
+    else:
+        quantity, up_price, down_price = (
+            data["commitment quantity"],
+            data["up price"],
+            data["down price"],
+        )
+    return (
+        planned_power_per_device,
+        commitment_costs(power, quantity, up_price, down_price),
+    )
+
+
+def scheduler_arrays(
+    device_constraints: List[DataFrame],
+    ems_constraints: DataFrame,
+    commitment_quantities: List[Series],
+    commitment_downwards_deviation_price: Union[List[Series], List[float]],
+    commitment_upwards_deviation_price: Union[List[Series], List[float]],
+) -> dict:
+    """Convert the scheduler input to NumPy arrays, indexed by device (d), commitment (c) and datetime (j).
+    Nan constraints become infinite bounds, and nan commitments are discounted by setting their quantity and prices
+    to 0. The derivative equals constraint shifts the derivative bounds, and where it is set while a derivative bound
+    is missing, that bound is taken to be 0 (i.e. the flow equals the derivative equals value).
+    Device stock bounds are kept separately from the flow bounds, so the model can bound a cumulative stock variable
+    instead of summing over all previous flows for each datetime."""
 
     # Check if commitments have the same time window and resolution as the constraints
     start = device_constraints[0].index.values[0]
@@ -85,166 +805,292 @@ def device_scheduler(
                 "Not implemented for different resolutions.\n%s\n%s"
                 % (resolution, resolution_c)
             )
+    number_of_datetimes = len(device_constraints[0].index)
 
-    # Turn prices per commitment into prices per commitment flow
-    if len(commitment_downwards_deviation_price) != 0:
-        if all(
-            not isinstance(price, Series)
-            for price in commitment_downwards_deviation_price
-        ):
-            commitment_downwards_deviation_price = [
-                initialize_series(price, start, end, resolution)
-                for price in commitment_downwards_deviation_price
-            ]
-    if len(commitment_upwards_deviation_price) != 0:
-        if all(
-            not isinstance(price, Series)
-            for price in commitment_upwards_deviation_price
-        ):
-            commitment_upwards_deviation_price = [
-                initialize_series(price, start, end, resolution)
-                for price in commitment_upwards_deviation_price
-            ]
-
-    # Determine appropriate overall bounds for power and price
-    min_down_price = min(min(p) for p in commitment_downwards_deviation_price)
-    max_down_price = max(max(p) for p in commitment_downwards_deviation_price)
-    min_up_price = min(min(p) for p in commitment_upwards_deviation_price)
-    max_up_price = max(max(p) for p in commitment_upwards_deviation_price)
-    overall_min_price = min(min_down_price, min_up_price)
-    overall_max_price = max(max_down_price, max_up_price)
-    overall_min_power = min(ems_constraints["derivative min"])
-    overall_max_power = max(ems_constraints["derivative max"])
+    # Stack device constraints into (d, j) arrays
+    def stack(column: str) -> ndarray:
+        return array(
+            [constraints[column].values for constraints in device_constraints],
+            dtype="float64",
+        ).reshape(len(device_constraints), number_of_datetimes)
 
-    model = ConcreteModel()
+    device_max = stack("max")
+    device_min = stack("min")
+    derivative_max = stack("derivative max")
+    derivative_min = stack("derivative min")
+    derivative_equals = stack("derivative equals")
+    has_equals = ~isnan(derivative_equals)
+    derivative_max = where(
+        isnan(derivative_max), where(has_equals, 0, infinity), derivative_max
+    )
+    derivative_min = where(
+        isnan(derivative_min), where(has_equals, 0, -infinity), derivative_min
+    )
+    derivative_equals = nan_to_num(derivative_equals)
 
-    # Add indices for devices (d), datetimes (j) and commitments (c)
-    model.d = RangeSet(0, len(device_constraints) - 1, doc="Set of devices")
-    model.j = RangeSet(
-        0, len(device_constraints[0].index.values) - 1, doc="Set of datetimes"
+    ems_derivative_max = ems_constraints["derivative max"].values.astype("float64")
+    ems_derivative_min = ems_constraints["derivative min"].values.astype("float64")
+
+    # Determine appropriate overall bounds for power
+    overall_min_power = nanmin(ems_derivative_min)
+    overall_max_power = nanmax(ems_derivative_max)
+
+    data = commitment_arrays(
+        commitment_quantities,
+        commitment_downwards_deviation_price,
+        commitment_upwards_deviation_price,
+        number_of_datetimes,
     )
-    model.c = RangeSet(0, len(commitment_quantities) - 1, doc="Set of commitments")
+    data.update(
+        {
+            "start": start,
+            "end": end,
+            "resolution": resolution,
+            "device max": where(isnan(device_max), infinity, device_max),
+            "device min": where(isnan(device_min), -infinity, device_min),
+            "power max": minimum(derivative_equals + derivative_max, overall_max_power),
+            "power min": maximum(derivative_equals + derivative_min, overall_min_power),
+            "ems derivative max": where(
+                isnan(ems_derivative_max), infinity, ems_derivative_max
+            ),
+            "ems derivative min": where(
+                isnan(ems_derivative_min), -infinity, ems_derivative_min
+            ),
+        }
+    )
+    return data
 
-    # Add parameters
-    def commitment_quantity_select(m, c, j):
-        v = commitment_quantities[c].iloc[j]
-        if isnan(v):  # Discount this nan commitment by setting the prices to 0
-            commitment_downwards_deviation_price[c].iloc[j] = 0
-            commitment_upwards_deviation_price[c].iloc[j] = 0
-            return 0
-        else:
-            return v
 
-    def price_down_select(m, c, j):
-        return commitment_downwards_deviation_price[c].iloc[j]
+def commitment_arrays(
+    commitment_quantities: List[Series],
+    commitment_downwards_deviation_price: Union[List[Series], List[float]],
+    commitment_upwards_deviation_price: Union[List[Series], List[float]],
+    number_of_datetimes: int,
+) -> dict:
+    """The commitment part of the scheduler arrays (see scheduler_arrays), i.e. quantities and prices as (c, j)
+    arrays, with nan commitments discounted."""
 
-    def price_up_select(m, c, j):
-        return commitment_upwards_deviation_price[c].iloc[j]
+    # Stack commitments and prices into (c, j) arrays, where a single price applies to each flow value
+    quantities = array(
+        [quantity.values for quantity in commitment_quantities], dtype="float64"
+    ).reshape(len(commitment_quantities), number_of_datetimes)
 
-    def device_max_select(m, d, j):
-        v = device_constraints[d]["max"].iloc[j]
-        if isnan(v):
-            return infinity
-        else:
-            return v
+    def stack_prices(prices: Union[List[Series], List[float]]) -> ndarray:
+        return array(
+            [
+                broadcast_to(
+                    price.values if isinstance(price, Series) else price,
+                    (number_of_datetimes,),
+                )
+                for price in prices
+            ],
+            dtype="float64",
+        ).reshape(len(prices), number_of_datetimes)
 
-    def device_min_select(m, d, j):
-        v = device_constraints[d]["min"].iloc[j]
-        if isnan(v):
-            return -infinity
-        else:
-            return v
+    down_price = stack_prices(commitment_downwards_deviation_price)
+    up_price = stack_prices(commitment_upwards_deviation_price)
 
-    def device_derivative_max_select(m, d, j):
-        max_v = device_constraints[d]["derivative max"].iloc[j]
-        equal_v = device_constraints[d]["derivative equals"].iloc[j]
-        if isnan(max_v) and isnan(equal_v):
-            return infinity
-        else:
-            return nanmin([max_v])
+    # Determine appropriate overall bounds for price (before discounting nan commitments)
+    overall_min_price = min(down_price.min(), up_price.min())
+    overall_max_price = max(down_price.max(), up_price.max())
 
-    def device_derivative_min_select(m, d, j):
-        min_v = device_constraints[d]["derivative min"].iloc[j]
-        equal_v = device_constraints[d]["derivative equals"].iloc[j]
-        if isnan(min_v) and isnan(equal_v):
-            return -infinity
-        else:
-            return nanmax([min_v])
+    # Discount nan commitments by setting the prices to 0
+    no_commitment = isnan(quantities)
+    convex = bool((up_price >= down_price)[~no_commitment].all())
+    down_price = where(no_commitment, 0, down_price)
+    up_price = where(no_commitment, 0, up_price)
+    quantities = where(no_commitment, 0, quantities)
 
-    def device_derivative_equal_select(m, d, j):
-        min_v = device_constraints[d]["derivative min"].iloc[j]
-        equal_v = device_constraints[d]["derivative equals"].iloc[j]
-        if isnan(equal_v):
-            return 0
-        else:
-            return nanmax([equal_v])
+    return {
+        "commitment quantity": quantities,
+        "commitment active": ~no_commitment,
+        "down price": down_price,
+        "up price": up_price,
+        "overall min price": overall_min_price,
+        "overall max price": overall_max_price,
+        "convex": convex,
+    }
 
-    def ems_derivative_max_select(m, j):
-        v = ems_constraints["derivative max"].iloc[j]
-        if isnan(v):
-            return infinity
-        else:
-            return v
 
-    def ems_derivative_min_select(m, j):
-        v = ems_constraints["derivative min"].iloc[j]
-        if isnan(v):
-            return -infinity
+def compact_commitments(data: dict) -> dict:
+    """Merge commitments into as few layers as possible, so the commitment dimension of the model depends on how many
+    commitments overlap at the same time, rather than on how many commitments there are.
+    Commitments are added greedily to the first layer in which they don't conflict: they may share a layer if at each
+    datetime at most one of them is active (disjoint windows), or if they commit to the same quantity where both are
+    active. In the latter case the deviation costs simply add up, so their prices are summed. The original arrays are
+    kept, to calculate the costs per original commitment after solving (see extract_schedule)."""
+
+    quantities, active = data["commitment quantity"], data["commitment active"]
+    up_price, down_price = data["up price"], data["down price"]
+
+    layers = []  # Each layer is a list of [quantity, active, up price, down price] arrays
+    for c in range(quantities.shape[0]):
+        for layer in layers:
+            layer_quantity, layer_active = layer[0], layer[1]
+            overlap = layer_active & active[c]
+            if (layer_quantity[overlap] == quantities[c][overlap]).all():
+                layer[0] = where(active[c], quantities[c], layer_quantity)
+                layer[1] = layer_active | active[c]
+                layer[2] = layer[2] + up_price[c]
+                layer[3] = layer[3] + down_price[c]
+                break
         else:
-            return v
+            layers.append(
+                [quantities[c], active[c], up_price[c].copy(), down_price[c].copy()]
+            )
 
-    model.commitment_quantity = Param(
-        model.c, model.j, initialize=commitment_quantity_select
-    )
-    model.up_price = Param(model.c, model.j, initialize=price_up_select)
-    model.down_price = Param(model.c, model.j, initialize=price_down_select)
-    model.device_max = Param(model.d, model.j, initialize=device_max_select)
-    model.device_min = Param(model.d, model.j, initialize=device_min_select)
-    model.device_derivative_max = Param(
-        model.d, model.j, initialize=device_derivative_max_select
-    )
-    model.device_derivative_min = Param(
-        model.d, model.j, initialize=device_derivative_min_select
+    if len(layers) == quantities.shape[0]:
+        return data
+
+    compacted = dict(data)
+    compacted["original commitment quantity"] = quantities
+    compacted["original up price"] = up_price
+    compacted["original down price"] = down_price
+    compacted["commitment quantity"] = array([layer[0] for layer in layers])
+    compacted["commitment active"] = array([layer[1] for layer in layers])
+    compacted["up price"] = array([layer[2] for layer in layers])
+    compacted["down price"] = array([layer[3] for layer in layers])
+
+    # Summed prices may exceed the original price range, which bounds the price variable of the GDP formulation
+    compacted["overall min price"] = min(
+        data["overall min price"],
+        compacted["up price"].min(),
+        compacted["down price"].min(),
     )
-    model.device_derivative_equal = Param(
-        model.d, model.j, initialize=device_derivative_equal_select
+    compacted["overall max price"] = max(
+        data["overall max price"],
+        compacted["up price"].max(),
+        compacted["down price"].max(),
     )
+    return compacted
 
-    model.ems_derivative_max = Param(model.j, initialize=ems_derivative_max_select)
-    model.ems_derivative_min = Param(model.j, initialize=ems_derivative_min_select)
 
-    # Add variables
-    model.power = Var(
-        model.d,
-        model.j,
-        domain=Reals,
-        initialize=0,
-        bounds=(overall_min_power, overall_max_power),
-    )
+def indexed(values: ndarray) -> dict:
+    """Map an array onto the (multi-dimensional) integer index of a Pyomo component."""
+    if values.ndim == 1:
+        return dict(enumerate(values.tolist()))
+    return dict(zip(product(*(range(n) for n in values.shape)), values.ravel().tolist()))
 
-    # Add constraints as a tuple of (lower bound, value, upper bound)
-    def device_bounds(m, d, j):
-        return (
-            m.device_min[d, j],
-            sum(m.power[d, k] for k in range(0, j + 1)),
-            m.device_max[d, j],
-        )
 
-    def device_derivative_bounds(m, d, j):
-        return (
-            m.device_derivative_min[d, j],
-            m.power[d, j] - m.device_derivative_equal[d, j],
-            m.device_derivative_max[d, j],
-        )
+def finite_or_none(v: float) -> Optional[float]:
+    """Pyomo expects missing bounds as None rather than infinity."""
+    return float(v) if isfinite(v) else None
 
-    def ems_derivative_bounds(m, j):
-        return m.ems_derivative_min[j], sum(m.power[:, j]), m.ems_derivative_max[j]
 
-    model.device_energy_bounds = Constraint(model.d, model.j, rule=device_bounds)
-    model.device_power_bounds = Constraint(
-        model.d, model.j, rule=device_derivative_bounds
-    )
-    model.ems_power_bounds = Constraint(model.j, rule=ems_derivative_bounds)
+def build_device_model(data: dict, model: Block = None) -> ConcreteModel:
+    """Build the device part of the scheduling model: flows per device, a cumulative stock per device,
+    and the flow bounds on device and EMS level. Deviation pricing is added separately.
+    Commitments and prices are mutable parameters and all bounds are variable bounds, so that a model can be
+    updated in place with the data of another window of the same shape (see update_device_model).
+    The model can also be built on a block of a larger model (see batched_device_scheduler)."""
+
+    number_of_devices, number_of_datetimes = data["power max"].shape
+    number_of_commitments = data["commitment quantity"].shape[0]
+
+    if model is None:
+        model = ConcreteModel()
+
+    # Add indices for devices (d), datetimes (j) and commitments (c)
+    model.d = RangeSet(0, number_of_devices - 1, doc="Set of devices")
+    model.j = RangeSet(0, number_of_datetimes - 1, doc="Set of datetimes")
+    model.c = RangeSet(0, number_of_commitments - 1, doc="Set of commitments")
+
+    # Add parameters
+    model.commitment_quantity = Param(model.c, model.j, initialize=0, mutable=True)
+    model.up_price = Param(model.c, model.j, initialize=0, mutable=True)
+    model.down_price = Param(model.c, model.j, initialize=0, mutable=True)
+
+    # Add variables, with the device flow bounds, device stock bounds and EMS flow bounds as variable bounds
+    model.power = Var(model.d, model.j, domain=Reals, initialize=0)
+    model.stock = Var(model.d, model.j, domain=Reals, initialize=0)
+    model.ems_power = Var(model.j, domain=Reals, initialize=0)
+
+    # Add constraints
+    def stock_balance(m, d, j):
+        if j == 0:
+            return m.stock[d, j] == m.power[d, j]
+        return m.stock[d, j] == m.stock[d, j - 1] + m.power[d, j]
+
+    def ems_power_balance(m, j):
+        return m.ems_power[j] == sum(m.power[d, j] for d in m.d)
+
+    model.device_stock_balance = Constraint(model.d, model.j, rule=stock_balance)
+    model.ems_power_balance = Constraint(model.j, rule=ems_power_balance)
+
+    update_device_model(model, data)
+    return model
+
+
+def update_device_model(model: ConcreteModel, data: dict):
+    """Set the commitments, prices and bounds of a device model built for data of the same shape."""
+
+    model.commitment_quantity.store_values(indexed(data["commitment quantity"]))
+    model.up_price.store_values(indexed(data["up price"]))
+    model.down_price.store_values(indexed(data["down price"]))
+
+    def set_bounds(var: Var, lower: ndarray, upper: ndarray):
+        for index, lb, ub in zip(
+            indexed(lower).keys(), lower.ravel().tolist(), upper.ravel().tolist()
+        ):
+            var[index].setlb(finite_or_none(lb))
+            var[index].setub(finite_or_none(ub))
+
+    set_bounds(model.power, data["power min"], data["power max"])
+    set_bounds(model.stock, data["device min"], data["device max"])
+    set_bounds(model.ems_power, data["ems derivative min"], data["ems derivative max"])
+    return
+
+
+def shift_values(var: Var, offset: int, number_of_datetimes: int):
+    """Shift the values of a variable indexed by datetime (last index) by a number of datetimes, e.g. to warm-start
+    the next window of a rolling horizon with the solution of the previous window. Values shifted in at the end
+    repeat the last known value."""
+    if offset == 0:
+        return
+    values = {index: var[index].value for index in var}
+    for index in var:
+        if isinstance(index, tuple):
+            *other, j = index
+        else:
+            other, j = [], index
+        shifted_j = min(max(j + offset, 0), number_of_datetimes - 1)
+        source = tuple(other) + (shifted_j,) if other else shifted_j
+        var[index].value = values[source]
+    return
+
+
+def add_split_deviations(model: ConcreteModel):
+    """Price deviations from commitments linearly, by splitting each deviation into a non-negative upwards part
+    and a non-negative downwards part. With convex deviation costs the solver never uses both parts at once."""
+
+    model.deviation_up = Var(model.c, model.j, domain=NonNegativeReals, initialize=0)
+    model.deviation_down = Var(model.c, model.j, domain=NonNegativeReals, initialize=0)
+
+    def deviation_split(m, c, j):
+        ems_power_deviation = m.ems_power[j] - m.commitment_quantity[c, j]
+        return ems_power_deviation == m.deviation_up[c, j] - m.deviation_down[c, j]
+
+    model.deviation_split = Constraint(model.c, model.j, rule=deviation_split)
+
+    # Add objective
+    def cost_function(m):
+        costs = 0
+        for j in m.j:
+            for c in m.c:
+                costs += m.deviation_up[c, j] * m.up_price[c, j]
+                costs -= m.deviation_down[c, j] * m.down_price[c, j]
+        return costs
+
+    model.costs = Objective(rule=cost_function, sense=minimize)
+    return
+
+
+def add_disjunctive_deviations(
+    model: ConcreteModel, overall_min_price: float, overall_max_price: float
+):
+    """Price deviations from commitments with a disjunction per commitment, device and datetime: either the
+    deviation is upwards and priced with the upwards deviation price, or it is downwards and priced with the
+    downwards deviation price. The model needs a GDP transformation before solving."""
 
     # Add logical disjunction for deviations
     model.price = Var(
@@ -253,7 +1099,7 @@ def device_scheduler(
 
     def up_linker(b, c, d, j):
         # print("In up linker")
-        m = b.model()
+        m = b.parent_block()
         ems_power_in_j = sum(m.power[d, j] for d in m.d)
         ems_power_deviation = ems_power_in_j - m.commitment_quantity[c, j]
         # try:
@@ -268,7 +1114,7 @@ def device_scheduler(
 
     def down_linker(b, c, d, j):
         # print("In down linker")
-        m = b.model()
+        m = b.parent_block()
         ems_power_in_j = sum(m.power[d, j] for d in m.d)
         ems_power_deviation = ems_power_in_j - m.commitment_quantity[c, j]
         # try:
@@ -326,66 +1172,4 @@ def device_scheduler(
     # def xfrm(m):
     #     TransformationFactory('gdp.chull').apply_to(m)
     # model.xfrm = BuildAction(rule=xfrm)
-
-    # Transform and solve
-    xfrm = TransformationFactory("gdp.bigm")
-    xfrm.apply_to(model)
-    solver = SolverFactory(
-        "cplex", executable="D:/CPLEX/Studio/cplex/bin/x64_win64/cplex"
-    )
-    # solver.options['CPXchgprobtype'] = "CPXPROB_QP"
-    # solver.options["solver"] = "CPXqpopt"
-    solver.options["qpmethod"] = 1
-    solver.options["optimalitytarget"] = 3
-
-    # solver.options["acceptable_constr_viol_tol"] = 10
-    # solver.options['acceptable_tol'] = 1
-    # solver.options['acceptable_dual_inf_tol'] = 10
-    # solver.options['acceptable_compl_inf_tol'] = 10
-    results = solver.solve(model, tee=False)
-
-    planned_costs = value(model.costs)
-    planned_power_per_device = []
-    for d in model.d:
-        planned_device_power = [round(model.power[d, j].value,3) for j in model.j]
-        planned_power_per_device.append(
-            initialize_series(
-                planned_device_power, start=start, end=end, resolution=resolution
-            )
-        )
-    # model.display()
-    # results.pprint()
-    # model.down_deviation.pprint()
-    # model.up_deviation.pprint()
-    # model.power.pprint()
-
-    # print(planned_power_per_device)
-    # input()
-
-    # Redo the cost calculation, because before the solver actually approximated the prices.
-    def redo_cost_calculation(m):
-        commitments_costs = []
-        for c in m.c:
-            commitment_cost = 0
-            for j in m.j:
-
-                ems_power_in_j = sum(m.power[d, j] for d in m.d)
-                ems_power_deviation = ems_power_in_j - m.commitment_quantity[c, j]
-
-                if value(ems_power_deviation) >= 0:
-                    commitment_cost += round(
-                        value(ems_power_deviation * m.up_price[c, j]), 3
-                    )
-
-                else:
-                    commitment_cost += round(
-                        value(ems_power_deviation * m.down_price[c, j]), 3
-                    )
-
-            commitments_costs.append(commitment_cost)
-        return commitments_costs
-
-    planned_costs_per_commitment = redo_cost_calculation(model)
-    # print(planned_costs_per_commitment)
-
-    return planned_power_per_device, planned_costs_per_commitment
+    return
@@ -0,0 +1,122 @@
+"""Instrumentation of device scheduler calls.
+Each call of the device scheduler is recorded as a row of the solver call log of its process: who called it, for
+which EMS, the size of the problem, how long the model took to build and to solve, and how the solver terminated.
+Calls scheduled in worker processes are sent back with their solution (see schedule_in_process). The Environment
+moves the calls of the main process to its own log after each step, so runs don't mix and the process log stays
+small. Instrumentation is off by default (see the "Instrumentation" solver parameter)."""
+
+from typing import List, Optional, Tuple
+
+from pandas import DataFrame
+from pyomo.core import ConcreteModel, Var, Constraint
+from pyomo.core.kernel.numvalue import value
+
+SOLVER_CALL_COLUMNS = [
+    "Caller",  # E.g. "Prognosis" or "Flex request", see EMS.scheduler_input
+    "EMS",
+    "Path",  # "NumPy", "Baseline", "LP" or "GDP"
+    "Backend",
+    "Datetimes",
+    "Devices",
+    "Commitments",
+    "Variables",
+    "Binaries",
+    "Constraints",
+    "Build time (s)",
+    "Solve time (s)",
+    "Status",
+    "Objective",
+]
+
+
+class SolverCallLog:
+    """Rows of solver call statistics, with one row per device scheduler call (see SOLVER_CALL_COLUMNS)."""
+
+    def __init__(self):
+        self.rows = []
+
+    def record(self, **row):
+        self.rows.append(row)
+
+    def extend(self, rows: List[dict]):
+        self.rows.extend(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def clear(self):
+        self.rows = []
+
+    def to_frame(self) -> DataFrame:
+        return DataFrame(self.rows, columns=SOLVER_CALL_COLUMNS)
+
+    def summary(self) -> DataFrame:
+        """Number of calls and total and maximum build and solve times, per caller and path."""
+        df = self.to_frame()
+
+        # Calls without call info are grouped under an empty caller, rather than dropped
+        df[["Caller", "Path"]] = df[["Caller", "Path"]].fillna("")
+        return df.groupby(["Caller", "Path"]).agg(
+            **{
+                "Calls": ("Status", "size"),
+                "Build time (s)": ("Build time (s)", "sum"),
+                "Solve time (s)": ("Solve time (s)", "sum"),
+                "Max solve time (s)": ("Solve time (s)", "max"),
+                "Max variables": ("Variables", "max"),
+            }
+        )
+
+    def export(self, file: str):
+        """Write the log to a Parquet file (for a .parquet extension) or to a CSV file."""
+        df = self.to_frame()
+        if file.endswith(".parquet"):
+            df.to_parquet(file)
+        else:
+            df.to_csv(file, index=False)
+
+
+# Calls of this process, until they are collected (see Environment.step)
+solver_call_log = SolverCallLog()
+
+
+def record_solver_call(
+    call_info: Optional[dict],
+    path: str,
+    shape: Tuple[int, int, int],
+    build_time: float,
+    solve_time: float = 0,
+    model: Optional[ConcreteModel] = None,
+    backend: Optional[str] = None,
+    results=None,
+):
+    """Add a row to the solver call log, for a problem of the given shape (number of devices, datetimes and
+    commitments). Without a model (i.e. for the NumPy path), there is nothing to count, and the status is
+    "fast path"."""
+    call_info = call_info if call_info is not None else {}
+    row = dict(
+        Caller=call_info.get("Caller"),
+        EMS=call_info.get("EMS"),
+        Path=path,
+        Backend=backend,
+        Datetimes=shape[1],
+        Devices=shape[0],
+        Commitments=shape[2],
+        Variables=0,
+        Binaries=0,
+        Constraints=0,
+        Status="fast path" if model is None else None,
+        Objective=None,
+    )
+    row["Build time (s)"] = build_time
+    row["Solve time (s)"] = solve_time
+    if model is not None:
+        variables = list(model.component_data_objects(Var, active=True))
+        row["Variables"] = len(variables)
+        row["Binaries"] = sum(1 for var in variables if var.is_binary())
+        row["Constraints"] = sum(
+            1 for _ in model.component_data_objects(Constraint, active=True)
+        )
+        row["Objective"] = value(model.costs)
+    if results is not None:
+        row["Status"] = str(results.solver.termination_condition)
+    solver_call_log.record(**row)
@@ -0,0 +1,173 @@
+"""Memoization of device scheduler calls.
+Scheduler calls are keyed on a digest of the arrays the scheduler model is built from (constraints, commitments and
+prices) and of the solver parameters that affect the solution, so calls for different windows with identical content
+share their solution. Solutions are stored as plain arrays and indexed to the window of the call on a hit."""
+
+from typing import Callable, List, Optional, Tuple
+from collections import OrderedDict
+from hashlib import sha1
+import os
+import pickle
+
+from numpy import array, ascontiguousarray
+from pandas import Series
+
+from comopt.model.utils import initialize_series
+from comopt.solver.ems_solver import scheduler_arrays
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIGEST_ARRAYS = [
+    "device max",
+    "device min",
+    "power max",
+    "power min",
+    "ems derivative max",
+    "ems derivative min",
+    "commitment quantity",
+    "down price",
+    "up price",
+]
+
+
+# Solver parameters that can change the solution of a scheduler call, e.g. in case of ties
+DIGEST_PARAMETERS = ["Fast path", "Compaction", "Backends"]
+
+
+def scheduler_digest(data: dict, formulation: str, solver_parameter: dict = None) -> str:
+    """Digest of the scheduler arrays (see scheduler_arrays), the formulation and the solver parameters that can
+    change the solution (see DIGEST_PARAMETERS)."""
+    digest = sha1()
+    digest.update(formulation.encode())
+    for parameter in DIGEST_PARAMETERS:
+        digest.update(repr((solver_parameter or {}).get(parameter)).encode())
+    digest.update(b"convex" if data["convex"] else b"nonconvex")
+    for key in DIGEST_ARRAYS:
+        values = ascontiguousarray(data[key], dtype="float64")
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+class SchedulerCache:
+    """Least-recently-used cache of device scheduler solutions.
+    Args:
+        size: maximum number of solutions kept (the least recently used solution is dropped first).
+        file: optional path of a pickle file, from which solutions are loaded on creation and to which they are
+              written with save(), so repeated scenario runs can skip solved subproblems.
+    """
+
+    def __init__(self, size: int = 256, file: Optional[str] = None):
+        self.size = size
+        self.file = file
+        self.solutions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if file is not None and os.path.isfile(file):
+            with open(file, "rb") as f:
+                self.solutions.update(pickle.load(f))
+            self.trim()
+
+    def schedule(
+        self, scheduler: Callable, **scheduler_input
+    ) -> Tuple[List[Series], List[float]]:
+        """Return the cached solution of the scheduler call, or call the scheduler and cache its solution.
+        The scheduler arrays are passed on to the scheduler, so they are only built once (see device_scheduler)."""
+        key, data = self.key(**scheduler_input)
+        solution = self.get(key, data)
+        if solution is not None:
+            return solution
+
+        solution = scheduler(data=data, **scheduler_input)
+        self.put(key, solution)
+        return solution
+
+    def key(
+        self,
+        device_constraints: list,
+        ems_constraints,
+        commitment_quantities: list,
+        commitment_downwards_deviation_price: list,
+        commitment_upwards_deviation_price: list,
+        formulation: str = "LP",
+        solver_parameter: dict = None,
+        **kwargs
+    ) -> Tuple[Optional[str], Optional[dict]]:
+        """Return the key and the scheduler arrays of a scheduler call, or (None, None) if there is nothing to cache."""
+
+        # If the EMS has no devices, don't bother
+        if len(device_constraints) == 0:
+            return None, None
+
+        data = scheduler_arrays(
+            device_constraints,
+            ems_constraints,
+            commitment_quantities,
+            commitment_downwards_deviation_price,
+            commitment_upwards_deviation_price,
+        )
+        return scheduler_digest(data, formulation, solver_parameter), data
+
+    def get(
+        self, key: Optional[str], data: Optional[dict]
+    ) -> Optional[Tuple[List[Series], List[float]]]:
+        """Return the cached solution indexed to the window of the scheduler arrays, or None."""
+        if key is None:
+            return None
+        if key not in self.solutions:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.solutions.move_to_end(key)
+        power_per_device, costs_per_commitment = self.solutions[key]
+        return (
+            [
+                initialize_series(
+                    device_power.tolist(),
+                    start=data["start"],
+                    end=data["end"],
+                    resolution=data["resolution"],
+                )
+                for device_power in power_per_device
+            ],
+            list(costs_per_commitment),
+        )
+
+    def put(self, key: Optional[str], solution: Tuple[List[Series], List[float]]):
+        if key is None:
+            return
+        planned_power_per_device, planned_costs_per_commitment = solution
+        self.solutions[key] = (
+            array([power.values for power in planned_power_per_device], dtype="float64"),
+            list(planned_costs_per_commitment),
+        )
+        self.trim()
+
+    def trim(self):
+        while len(self.solutions) > self.size:
+            self.solutions.popitem(last=False)
+
+    def save(self, file: Optional[str] = None):
+        """Write the cached solutions to a pickle file (by default the file the cache was created with)."""
+        file = file if file is not None else self.file
+        if file is None:
+            return
+        with open(file, "wb") as f:
+            pickle.dump(self.solutions, f)
+        logger.info(
+            "Saved %s scheduler solutions to %s (%s hits, %s misses)."
+            % (len(self.solutions), file, self.hits, self.misses)
+        )
+
+    def clear(self):
+        self.solutions.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls > 0 else 0
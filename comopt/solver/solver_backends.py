@@ -0,0 +1,209 @@
+"""Registry of solver backends for the EMS scheduler.
+Each backend maps a short key (as used in the "Solver parameter" of the input data) to one or more Pyomo solver
+names, default options and whether the solver reads a warm start from the variable values. When a model is solved
+again (see PersistentDeviceScheduler), cbc and cplex are warm-started with the previous solution, while highs (through
+its persistent appsi interface) updates its own instance of the model and restarts from its previous basis, so it
+needs no warm start. glpk is not warm-started.
+Backends are tried in the order given by the "Backends" list of the solver parameter, and the next backend is used if
+a solver is unavailable or fails."""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from time import perf_counter
+
+from pandas import DataFrame
+from pyomo.core import ConcreteModel
+from pyomo.opt import SolverFactory, SolverStatus, TerminationCondition
+import pyomo.environ  # noqa: F401 (registers the solver plugins, e.g. appsi_highs, with the SolverFactory)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOLVER_BACKENDS = {
+    "highs": {"names": ["appsi_highs", "highs"], "options": {}, "warmstart": False},
+    "glpk": {"names": ["glpk"], "options": {}, "warmstart": False},
+    "cbc": {"names": ["cbc"], "options": {}, "warmstart": True},
+    "cplex": {
+        "names": ["cplex"],
+        "options": {"qpmethod": 1, "optimalitytarget": 3},
+        "warmstart": True,
+    },
+}
+
+DEFAULT_SOLVER_PARAMETER = {
+    "Backends": ["highs", "glpk", "cbc"],  # Tried in this order
+    "Options": {},  # Per backend, e.g. {"cbc": {"seconds": 10}}
+    "Executables": {},  # Per backend, e.g. {"cplex": "D:/CPLEX/Studio/cplex/bin/x64_win64/cplex"}
+    "Formulation": "LP",  # "LP" or "GDP", see device_scheduler
+    "Persistent": True,  # Keep the scheduling model of each EMS alive between steps
+    "Compaction": True,  # Merge non-conflicting commitments before building the scheduling model
+    "Fast path": True,  # Schedule EMS with at most one device with stock bounds with NumPy instead of a model
+    "Cache size": 256,  # Number of scheduler solutions kept in memory (0 disables the cache)
+    "Cache file": None,  # Optional pickle file to load and save cached solutions across runs
+    "Processes": 0,  # Number of worker processes to schedule the EMS in parallel (0 schedules them one by one)
+    "Instrumentation": False,  # Record statistics of each device scheduler call (see comopt.solver.instrumentation)
+    "Solver call log": None,  # Optional CSV or Parquet file to export the recorded solver calls to
+    "Batched": False,  # Schedule all EMS of the Trading Agent in one block-diagonal model (instead of processes)
+}
+
+# Names of the solvers that were found to be available, per (backend, executable)
+available_solvers = dict()
+
+
+def register_solver_backend(
+    key: str, names: List[str], options: dict = None, warmstart: bool = False
+):
+    """Add a backend to the registry, or replace an existing one."""
+    SOLVER_BACKENDS[key] = {
+        "names": names,
+        "options": options if options is not None else {},
+        "warmstart": warmstart,
+    }
+
+
+def reads_warmstart(backend: str, solver) -> bool:
+    """Whether the solver of a backend reads a warm start from the variable values. Shell solvers also have to
+    support it in their installed version (e.g. cbc, depending on how it was built)."""
+    if not SOLVER_BACKENDS[backend]["warmstart"]:
+        return False
+    warm_start_capable = getattr(solver, "warm_start_capable", None)
+    return warm_start_capable is None or bool(warm_start_capable())
+
+
+def get_solver_parameter(input_data: dict) -> dict:
+    """Complete the solver parameter of the input data with defaults."""
+    solver_parameter = dict(DEFAULT_SOLVER_PARAMETER)
+    solver_parameter.update(input_data.get("Solver parameter", {}))
+    return solver_parameter
+
+
+def get_solvers(solver_parameter: dict = None) -> List[Tuple[str, object]]:
+    """Return the available solvers as a list of (backend, solver) tuples, in order of preference."""
+    if solver_parameter is None:
+        solver_parameter = DEFAULT_SOLVER_PARAMETER
+
+    solvers = []
+    for backend in solver_parameter["Backends"]:
+        if backend not in SOLVER_BACKENDS:
+            raise KeyError("Unknown solver backend: %s" % backend)
+        executable = solver_parameter.get("Executables", {}).get(backend)
+        if (backend, executable) not in available_solvers:
+            available_solvers[(backend, executable)] = find_solver(backend, executable)
+        name = available_solvers[(backend, executable)]
+        if name is None:
+            continue
+        solver = create_solver(name, executable)
+
+        # Default options of the backend, overwritten by the options given in the solver parameter
+        options = dict(SOLVER_BACKENDS[backend]["options"])
+        options.update(solver_parameter.get("Options", {}).get(backend, {}))
+        for option, option_value in options.items():
+            solver.options[option] = option_value
+        solvers.append((backend, solver))
+    return solvers
+
+
+def create_solver(name: str, executable: Optional[str] = None):
+    if executable is not None:
+        return SolverFactory(name, executable=executable)
+    return SolverFactory(name)
+
+
+def find_solver(backend: str, executable: Optional[str] = None) -> Optional[str]:
+    """Return the name of the first available solver of the backend, or None."""
+    for name in SOLVER_BACKENDS[backend]["names"]:
+        try:
+            if create_solver(name, executable).available(exception_flag=False):
+                return name
+        except Exception:
+            continue
+    logger.info("Solver backend %s is not available." % backend)
+    return None
+
+
+def solve_model(
+    model: ConcreteModel,
+    solver_parameter: dict = None,
+    warmstart: bool = False,
+    solvers: List[Tuple[str, object]] = None,
+) -> Tuple[str, object]:
+    """Solve the model with the first backend that succeeds, and return the backend and the solver results.
+    With warmstart, the variable values are passed as a warm start to the backends that read them.
+    Previously created solvers can be passed in to reuse them, which lets persistent solver interfaces (e.g. appsi)
+    update their instance of the model instead of rebuilding it, and restart from their previous basis."""
+    if solvers is None:
+        solvers = get_solvers(solver_parameter)
+    if not solvers:
+        raise Exception(
+            "None of the solver backends %s is available."
+            % (solver_parameter or DEFAULT_SOLVER_PARAMETER)["Backends"]
+        )
+
+    for backend, solver in solvers:
+        kwargs = {"tee": False}
+        if warmstart and reads_warmstart(backend, solver):
+            kwargs["warmstart"] = True
+        try:
+            results = solver.solve(model, **kwargs)
+        except Exception as e:
+            logger.warning("Solver backend %s failed: %s" % (backend, e))
+            continue
+        if (
+            results.solver.status == SolverStatus.ok
+            and results.solver.termination_condition == TerminationCondition.optimal
+        ):
+            return backend, results
+        logger.warning(
+            "Solver backend %s terminated with status %s (%s)."
+            % (
+                backend,
+                results.solver.status,
+                results.solver.termination_condition,
+            )
+        )
+    raise Exception("No solver backend found an optimal solution.")
+
+
+def benchmark_solver_backends(
+    scheduler: Callable,
+    scenarios: Dict[str, dict],
+    backends: List[str] = None,
+    repetitions: int = 1,
+) -> DataFrame:
+    """Solve each scenario with each backend separately, and tabulate wall time and total costs.
+    Scenarios map a scenario name to the keyword arguments of the scheduler (e.g. device_scheduler).
+    The fast path, commitment compaction and the scheduler cache are switched off, so that each call builds and solves
+    the full model."""
+    if backends is None:
+        backends = list(SOLVER_BACKENDS.keys())
+
+    rows = []
+    for scenario_name, scenario in scenarios.items():
+        for backend in backends:
+            solver_parameter = dict(
+                DEFAULT_SOLVER_PARAMETER,
+                **{
+                    "Backends": [backend],
+                    "Fast path": False,  # Make sure each scenario reaches the solver
+                    "Compaction": False,
+                    "Cache size": 0,
+                }
+            )
+            row = {"Scenario": scenario_name, "Backend": backend}
+            try:
+                wall_times = []
+                for _ in range(repetitions):
+                    tic = perf_counter()
+                    _, costs_per_commitment = scheduler(
+                        solver_parameter=solver_parameter, **scenario
+                    )
+                    wall_times.append(perf_counter() - tic)
+                row["Wall time (s)"] = min(wall_times)
+                row["Total costs"] = sum(costs_per_commitment)
+                row["Status"] = "Solved"
+            except Exception as e:
+                row["Wall time (s)"] = None
+                row["Total costs"] = None
+                row["Status"] = str(e)
+            rows.append(row)
+    return DataFrame(rows).set_index(["Scenario", "Backend"])
@@ -0,0 +1,15 @@
+"""Compares the solver backends on the device scheduling problems of the test scenarios (see scenarios.py).
+Run from the repository root with: python -m comopt.tests.benchmark_solver_backends"""
+
+from pandas import option_context
+
+from comopt.solver.ems_solver import device_scheduler
+from comopt.solver.solver_backends import benchmark_solver_backends
+from comopt.tests.scenarios import scheduler_scenarios
+
+if __name__ == "__main__":
+    results = benchmark_solver_backends(
+        scheduler=device_scheduler, scenarios=scheduler_scenarios(), repetitions=3
+    )
+    with option_context("display.max_rows", None, "display.width", 200):
+        print(results)
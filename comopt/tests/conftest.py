@@ -0,0 +1,9 @@
+import pytest
+
+from comopt.tests.scenarios import scheduler_scenarios
+
+
+@pytest.fixture(scope="session")
+def scenarios() -> dict:
+    """Device scheduling problems of the test scenarios (see scenarios.py)."""
+    return scheduler_scenarios()
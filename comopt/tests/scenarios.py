@@ -0,0 +1,170 @@
+"""Device scheduling problems of the test scenarios, as keyword arguments of device_scheduler.
+The devices and prices are those of the simulations in testfile_1.py and test_2.py (with the profiles of
+pickle_profiles), and of the pickled two-hour buffer with two charging windows. Each EMS is scheduled against its
+energy contract, optionally with a flex request, as in EMS.scheduler_input.
+Profiles are read from comopt/pickles, so run from the repository root."""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import pickle
+
+from pandas import DataFrame, Series
+from numpy import nan
+
+from comopt.data_structures.commitments import (
+    DeviationCostCurve,
+    PiecewiseConstantProfileCommitment as Commitment,
+)
+from comopt.model.utils import initialize_series
+from comopt.scenario.ems_constraints import (
+    limited_capacity_profile as grid_connection,
+    dispatchable_load_profile_with_bounds,
+    follow_generated_production_profile,
+)
+from comopt.scenario.profile_generator import pickle_profiles
+
+resolution = timedelta(minutes=15)
+flow_unit_multiplier = resolution.seconds / 3600
+
+# Horizons of the simulations
+day = (datetime(year=2018, month=6, day=1, hour=0), datetime(year=2018, month=6, day=2, hour=0))
+afternoon = (datetime(year=2018, month=6, day=1, hour=12), datetime(year=2018, month=6, day=1, hour=15))
+buffer_windows = (datetime(year=2018, month=6, day=1, hour=0), datetime(year=2018, month=6, day=1, hour=2))
+
+
+def energy_contract(start: datetime, end: datetime, prices: Tuple[float, float]) -> Commitment:
+    """The initial commitment of an EMS, with prices for producing and consuming (see EMS)."""
+    return Commitment(
+        label="Energy contract",
+        constants=initialize_series(0, start, end, resolution),
+        deviation_cost_curve=DeviationCostCurve(
+            function_type="Linear",
+            gradient=prices,
+            flow_unit_multiplier=flow_unit_multiplier,
+        ),
+    )
+
+
+def flex_request(quantities: Series, deviation_prices: Series) -> Commitment:
+    """A requested profile (nan where nothing is requested), with the deviation prices of the Market Agent."""
+    return Commitment(
+        label="Flex request",
+        constants=quantities,
+        deviation_cost_curve=DeviationCostCurve(
+            function_type="Linear",
+            gradient=(-deviation_prices.values, deviation_prices.values),
+            flow_unit_multiplier=flow_unit_multiplier,
+        ),
+    )
+
+
+def scheduler_input(
+    device_constraints: List[DataFrame], commitments: List[Commitment], capacity: float = 100
+) -> dict:
+    """Keyword arguments of the device scheduler (see EMS.scheduler_input)."""
+    start, end = commitments[0].start, commitments[0].end
+    return dict(
+        device_constraints=device_constraints,
+        ems_constraints=grid_connection(
+            start=start, end=end, resolution=resolution, capacity=capacity
+        ),
+        commitment_quantities=[commitment.constants for commitment in commitments],
+        commitment_downwards_deviation_price=[
+            commitment.deviation_cost_curve.gradient_down for commitment in commitments
+        ],
+        commitment_upwards_deviation_price=[
+            commitment.deviation_cost_curve.gradient_up for commitment in commitments
+        ],
+    )
+
+
+def load_and_generator(
+    start: datetime, end: datetime, load: float, generation: float
+) -> List[DataFrame]:
+    """A load with fixed (flexible load profile) bounds and a curtailable generator (dispatch factor 1)."""
+    profiles = pickle_profiles(start=start, end=end, resolution=resolution)
+    flexible_load_profile = profiles["flexible_load_profile"]
+    flexible_load_profile.loc[:, :] = load
+    solar_profile = profiles["solar_test_profile_1_day"]
+    solar_profile.loc[:] = generation
+    return [
+        dispatchable_load_profile_with_bounds(
+            start=start, end=end, resolution=resolution, profile=flexible_load_profile
+        ),
+        follow_generated_production_profile(
+            start=start,
+            end=end,
+            resolution=resolution,
+            max_capacity=10,
+            dispatch_factor=1,
+            profile=solar_profile,
+        ),
+    ]
+
+
+def buffer() -> DataFrame:
+    """The pickled buffer, with a minimum stock at the end of each of its two charging windows."""
+    with open("comopt/pickles/buffer_2hours_2windows.pickle", "rb") as f:
+        return pickle.load(f)
+
+
+def imbalance_request(start: datetime, end: datetime) -> Series:
+    """Requested power for the imbalances of testfile_1.py, between 10 and 12 am (nan elsewhere)."""
+    imbalances = round(abs(pickle_profiles(start, end, resolution)["imbalances_test_profile_1_day"]), 1)
+    requested_power = initialize_series(nan, start=start, end=end, resolution=resolution)
+    window = slice(datetime(2018, 6, 1, 10), datetime(2018, 6, 1, 11, 45))
+    requested_power[window] = -imbalances[window].values
+    return requested_power
+
+
+def scheduler_scenarios() -> Dict[str, dict]:
+    """Device scheduling problems per scenario name."""
+    scenarios = dict()
+
+    # testfile_1.py: a load of 2 and a generator of 7, against an energy contract at (feed-in, purchase) prices
+    start, end = day
+    devices = load_and_generator(start, end, load=2, generation=7)
+    contract = energy_contract(start, end, prices=(20, 32))
+    scenarios["Load and generator"] = scheduler_input(devices, [contract])
+    scenarios["Load and generator with request"] = scheduler_input(
+        devices,
+        [
+            contract,
+            flex_request(
+                imbalance_request(start, end),
+                initialize_series(60, start=start, end=end, resolution=resolution),
+            ),
+        ],
+    )
+
+    # test_2.py: a load of 6 and a generator of 10, with deviation prices doubling each step
+    start, end = afternoon
+    devices = load_and_generator(start, end, load=6, generation=10)
+    deviation_prices = initialize_series(
+        [2 ** x for x in range(4, 16)], start=start, end=end, resolution=resolution
+    )
+    requested_power = initialize_series(-2, start=start, end=end, resolution=resolution)
+    requested_power.iloc[[3, 7]] = 2
+    scenarios["Afternoon with request"] = scheduler_input(
+        devices,
+        [
+            energy_contract(start, end, prices=(6, 8)),
+            flex_request(requested_power, deviation_prices),
+        ],
+    )
+
+    # The pickled buffer, alone and together with the load and generator of testfile_1.py
+    start, end = buffer_windows
+    contract = energy_contract(start, end, prices=(20, 32))
+    requested_power = initialize_series(nan, start=start, end=end, resolution=resolution)
+    requested_power.iloc[4:6] = 5
+    request = flex_request(
+        requested_power, initialize_series(40, start=start, end=end, resolution=resolution)
+    )
+    scenarios["Buffer"] = scheduler_input([buffer()], [contract])
+    scenarios["Buffer with request"] = scheduler_input([buffer()], [contract, request])
+    scenarios["Load, generator and buffer with request"] = scheduler_input(
+        load_and_generator(start, end, load=2, generation=7) + [buffer()],
+        [contract, request],
+    )
+    return scenarios
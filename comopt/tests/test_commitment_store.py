@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import pytest
+from numpy import nan, where
+from numpy.testing import assert_array_equal
+from numpy.random import RandomState
+from pandas import Timestamp
+
+from comopt.data_structures.commitment_store import (
+    CommitmentStore,
+    SettledCommitmentLedger,
+    trim_commitment,
+)
+from comopt.data_structures.commitments import PiecewiseConstantProfileCommitment as Commitment
+from comopt.data_structures.utils import select_applicable
+
+start, resolution = datetime(2018, 6, 1), timedelta(minutes=15)
+durations = [1, 4, 16, 96]  # In number of datetimes, e.g. a flex trade horizon and the simulation period
+
+
+def random_commitments(random: RandomState, number_of_commitments: int = 60) -> list:
+    """Commitments with a random start and duration, committed over part of their window."""
+    commitments = []
+    for i in range(number_of_commitments):
+        duration = durations[random.randint(len(durations))]
+        commitment_start = start + random.randint(96) * resolution
+        values = random.uniform(-10, 10, duration)
+        commitments.append(
+            Commitment(
+                label="Commitment %s" % i,
+                constants=where(random.rand(duration) < 0.3, nan, values),
+                deviation_cost_curve=None,
+                start=commitment_start,
+                end=commitment_start + duration * resolution,
+                resolution=resolution,
+                costs=random.uniform(0, 5),
+            )
+        )
+    return commitments
+
+
+def random_windows(random: RandomState, number_of_windows: int = 50) -> list:
+    windows = []
+    for _ in range(number_of_windows):
+        window_start = start + random.randint(-8, 200) * resolution
+        windows.append((window_start, window_start + random.randint(1, 24) * resolution))
+    return windows
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_select_matches_linear_scan(sparse):
+    """The interval index selects the same commitments (and slices) as scanning the list of commitments."""
+    random = RandomState(0)
+    commitments = random_commitments(random)
+    store = CommitmentStore(commitments, sparse=sparse)
+    for window in random_windows(random):
+        selected = store.select(window)
+        expected = select_applicable(commitments, window)
+        assert [c.label for c in selected] == [c.label for c in expected]
+        sliced = store.select(window, slice=True)
+        expected = select_applicable(commitments, window, slice=True)
+        for c, e in zip(sliced, expected):
+            assert (Timestamp(c.start), Timestamp(c.end)) == (Timestamp(e.start), Timestamp(e.end))
+            assert_array_equal(c.values, e.constants.values)
+
+
+def test_settle_removes_elapsed_commitments():
+    """Settled commitments are returned in insertion order, and the remaining ones can still be selected."""
+    random = RandomState(1)
+    commitments = random_commitments(random)
+    store = CommitmentStore(commitments)
+    now = start + 48 * resolution
+    settled = store.settle(now)
+    assert [c.label for c in settled] == [c.label for c in commitments if c.end <= now]
+    remaining = [c for c in commitments if c.end > now]
+    assert [c.label for c in store] == [c.label for c in remaining]
+    for window in random_windows(random):
+        assert [c.label for c in store.select(window)] == [
+            c.label for c in select_applicable(remaining, window)
+        ]
+
+
+def test_trim_commitment():
+    c = Commitment(
+        label=None,
+        constants=[nan, nan, 1, nan, 2, nan],
+        deviation_cost_curve=None,
+        start=start,
+        end=start + 6 * resolution,
+        resolution=resolution,
+    )
+    for commitment in (c, c.to_sparse()):
+        trimmed = trim_commitment(commitment)
+        assert (trimmed.start, trimmed.end) == (start + 2 * resolution, start + 5 * resolution)
+        assert_array_equal(trimmed.values, [1, nan, 2])
+        assert trimmed.sparse == commitment.sparse
+
+
+def test_ledger_keeps_costs_and_energy():
+    """The ledger keeps the costs and the committed energy (e.g. in MWh for 15-minute values in MW)."""
+    random = RandomState(2)
+    commitments = random_commitments(random, 10)
+    ledger = SettledCommitmentLedger(flow_unit_multiplier=0.25)
+    ledger.extend([c if i % 2 else c.to_sparse() for i, c in enumerate(commitments)])
+    df = ledger.to_frame()
+    assert len(ledger) == len(df) == 10
+    assert df["Label"].tolist() == [c.label for c in commitments]
+    assert df["Energy"].values == pytest.approx([c.constants.sum() * 0.25 for c in commitments])
+    assert ledger.total_costs() == pytest.approx(sum(c.costs for c in commitments))
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+from numpy import nan, where
+from numpy.random import RandomState
+from numpy.testing import assert_array_equal
+
+from comopt.data_structures.commitments import (
+    DeviationCostCurve,
+    PiecewiseConstantProfileCommitment as Commitment,
+    find_runs,
+)
+
+start, end, resolution = datetime(2018, 6, 1), datetime(2018, 6, 1, 2), timedelta(minutes=15)
+
+
+def commitment(constants: list, sparse: bool = False, deviation_cost_curve: DeviationCostCurve = None) -> Commitment:
+    return Commitment(
+        label=None,
+        constants=constants,
+        deviation_cost_curve=deviation_cost_curve,
+        start=start,
+        end=end,
+        resolution=resolution,
+        sparse=sparse,
+    )
+
+
+def test_dense_constants_write_through():
+    c = commitment([nan, 1, 2, nan, nan, 3, nan, nan])
+    c.constants.iloc[0] = 5
+    assert c.values[0] == 5 and c.constants.iloc[0] == 5
+
+
+def test_sparse_constants_are_read_only():
+    """Sparse commitments materialise their constants on each call, so writes are refused rather than lost."""
+    c = commitment([nan, 1, 2, nan, nan, 3, nan, nan], sparse=True)
+    with pytest.raises(ValueError):
+        c.constants.iloc[1] = 5
+    with pytest.raises(ValueError):
+        c.constants[c.constants.index[0]] = 5
+    assert c.constants.iloc[1] == 1
+    assert (c.constants.fillna(0) * 2).tolist() == [0, 2, 4, 0, 0, 6, 0, 0]
+
+
+def test_find_runs():
+    offsets, runs = find_runs(commitment([nan, 1, 2, nan, nan, 3, nan, 4]).values)
+    assert offsets == [1, 5, 7]
+    assert [run.tolist() for run in runs] == [[1, 2], [3], [4]]
+    assert find_runs(commitment(None).values) == ([], [])
+
+
+def test_sparse_commitments_match_dense_ones():
+    """Values, windows (also beyond the commitment), constants and deviation costs don't depend on the storage."""
+    random = RandomState(0)
+    curve = DeviationCostCurve(function_type="Linear", gradient=(-20, 32), flow_unit_multiplier=0.25)
+    for share_committed in (0, 0.3, 0.7, 1):
+        values = where(random.rand(8) < share_committed, random.uniform(-10, 10, 8), nan)
+        dense = commitment(values, deviation_cost_curve=curve)
+        sparse = commitment(values, sparse=True, deviation_cost_curve=curve)
+        assert sparse.sparse and not dense.sparse
+        assert_array_equal(sparse.values, dense.values)
+        assert sparse.constants.equals(dense.constants)
+        for offset in range(-3, 9):
+            for number_of_values in range(1, 6):
+                assert_array_equal(sparse.window(offset, number_of_values), dense.window(offset, number_of_values))
+        quantities = random.uniform(-10, 10, 8)
+        assert_array_equal(sparse.deviation_costs(quantities), dense.deviation_costs(quantities))
+        assert_array_equal(dense.to_sparse().values, dense.values)
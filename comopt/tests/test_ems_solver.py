@@ -0,0 +1,217 @@
+import pytest
+from numpy import array, allclose, cumsum, nan, where
+from numpy.random import RandomState
+from pandas import Series, read_csv
+
+from comopt.solver.ems_solver import (
+    device_scheduler,
+    PersistentDeviceScheduler,
+    schedule_costs,
+    schedule_cost_bound,
+    schedule_from_given_power,
+    schedule_from_power,
+    scheduler_input_arrays,
+    scheduler_paths,
+    separable_schedule,
+)
+from comopt.solver.instrumentation import SolverCallLog, solver_call_log
+from comopt.solver.solver_backends import (
+    DEFAULT_SOLVER_PARAMETER,
+    get_solvers,
+    reads_warmstart,
+)
+
+# Build and solve the full model for each call
+SOLVER_PARAMETER = dict(
+    DEFAULT_SOLVER_PARAMETER,
+    **{"Fast path": False, "Compaction": False, "Cache size": 0}
+)
+
+requires_solver = pytest.mark.skipif(
+    len(get_solvers(SOLVER_PARAMETER)) == 0, reason="No solver backend available."
+)
+
+# The GDP formulation has a bilinear objective (deviation times price), which needs a solver such as CPLEX
+QP_SOLVER_PARAMETER = dict(SOLVER_PARAMETER, Backends=["cplex"])
+requires_qp_solver = pytest.mark.skipif(
+    len(get_solvers(QP_SOLVER_PARAMETER)) == 0,
+    reason="No solver backend available for the GDP formulation.",
+)
+
+
+def ems_power(power_per_device: list) -> array:
+    return array([power.values for power in power_per_device]).sum(axis=0)
+
+
+def window(scenario: dict, start: int, end: int) -> dict:
+    """The scheduling problem of a scenario for a window of datetimes (by position)."""
+    return dict(
+        scenario,
+        device_constraints=[
+            constraints.iloc[start:end] for constraints in scenario["device_constraints"]
+        ],
+        ems_constraints=scenario["ems_constraints"].iloc[start:end],
+        commitment_quantities=[
+            quantity.iloc[start:end] for quantity in scenario["commitment_quantities"]
+        ],
+        commitment_downwards_deviation_price=[
+            price[start:end] if hasattr(price, "__len__") else price
+            for price in scenario["commitment_downwards_deviation_price"]
+        ],
+        commitment_upwards_deviation_price=[
+            price[start:end] if hasattr(price, "__len__") else price
+            for price in scenario["commitment_upwards_deviation_price"]
+        ],
+    )
+
+
+def stockless(scenario: dict) -> bool:
+    data = scheduler_input_arrays(scenario)
+    return (data["device max"] == float("inf")).all() and (
+        data["device min"] == -float("inf")
+    ).all()
+
+
+@requires_solver
+def test_lp_formulation_reaches_cost_bound(scenarios):
+    """Without stock bounds, the cost bound is exact, so the LP formulation should reach it."""
+    for name, scenario in scenarios.items():
+        power, costs = device_scheduler(
+            formulation="LP", solver_parameter=SOLVER_PARAMETER, **scenario
+        )
+        assert schedule_costs(scenario, power) == pytest.approx(costs), name
+        if stockless(scenario):
+            assert sum(costs) == pytest.approx(schedule_cost_bound(scenario), abs=1e-2), name
+        else:
+            assert sum(costs) >= schedule_cost_bound(scenario) - 1e-2, name
+
+
+@requires_qp_solver
+def test_lp_and_gdp_formulations_agree(scenarios):
+    """The LP formulation finds schedules as cheap as the GDP formulation, and reports the same costs."""
+    for name, scenario in scenarios.items():
+        lp_power, lp_costs = device_scheduler(
+            formulation="LP", solver_parameter=QP_SOLVER_PARAMETER, **scenario
+        )
+        gdp_power, gdp_costs = device_scheduler(
+            formulation="GDP", solver_parameter=QP_SOLVER_PARAMETER, **scenario
+        )
+        assert sum(lp_costs) == pytest.approx(sum(gdp_costs), abs=1e-2), name
+        assert allclose(ems_power(lp_power), ems_power(gdp_power), atol=1e-3), name
+
+
+@requires_qp_solver
+def test_nonconvex_costs_fall_back_to_gdp(scenarios):
+    """Deviation costs that are not convex can't be priced by the LP formulation."""
+    scenario = dict(scenarios["Afternoon with request"])
+    scenario["commitment_downwards_deviation_price"] = [10, 10]
+    scenario["commitment_upwards_deviation_price"] = [5, 5]
+    gdp_calls = scheduler_paths["GDP"]
+    device_scheduler(formulation="LP", solver_parameter=QP_SOLVER_PARAMETER, **scenario)
+    assert scheduler_paths["GDP"] == gdp_calls + 1
+
+
+@requires_solver
+def test_persistent_scheduler_matches_device_scheduler(scenarios):
+    """Updating and re-solving the models of a rolling horizon gives the costs of solving each window anew."""
+    scheduler = PersistentDeviceScheduler(SOLVER_PARAMETER)
+    for name in ("Load and generator with request", "Afternoon with request"):
+        for step in range(8):
+            scenario = window(scenarios[name], step, step + 4)
+            _, persistent_costs = scheduler(solver_parameter=SOLVER_PARAMETER, **scenario)
+            _, costs = device_scheduler(solver_parameter=SOLVER_PARAMETER, **scenario)
+            assert sum(persistent_costs) == pytest.approx(sum(costs), abs=1e-2), name
+    assert list(scheduler.models.keys()) == [(2, 4, 2)]  # Both scenarios reuse the model of their shape
+
+
+def random_prices(scenario: dict, random: RandomState) -> dict:
+    """The scenario with random convex deviation prices, and random quantities for all but the first commitment."""
+    quantities, down_prices, up_prices = [], [], []
+    for c, quantity in enumerate(scenario["commitment_quantities"]):
+        n = len(quantity)
+        down_price = random.uniform(-50, 50, n)
+        down_prices.append(Series(down_price, index=quantity.index))
+        up_prices.append(Series(down_price + random.uniform(0, 30, n), index=quantity.index))
+        if c > 0:
+            quantity = Series(
+                where(random.rand(n) < 0.5, nan, random.uniform(-10, 15, n)), index=quantity.index
+            )
+        quantities.append(quantity)
+    return dict(
+        scenario,
+        commitment_quantities=quantities,
+        commitment_downwards_deviation_price=down_prices,
+        commitment_upwards_deviation_price=up_prices,
+    )
+
+
+@requires_solver
+def test_stock_limited_fast_path_matches_lp(scenarios):
+    """A buffer (with or without devices without stock bounds) is scheduled as cheaply without a model."""
+    random = RandomState(0)
+    fast_path = dict(SOLVER_PARAMETER, **{"Fast path": True})
+    for name in ("Buffer", "Buffer with request", "Load, generator and buffer with request"):
+        for scenario in [scenarios[name]] + [random_prices(scenarios[name], random) for _ in range(10)]:
+            data = scheduler_input_arrays(scenario)
+            power = separable_schedule(data)
+            assert power is not None, name
+            stock = cumsum(power, axis=1)
+            assert (stock <= data["device max"] + 1e-6).all() and (stock >= data["device min"] - 1e-6).all()
+            assert (power <= data["power max"] + 1e-6).all() and (power >= data["power min"] - 1e-6).all()
+            _, costs = device_scheduler(solver_parameter=SOLVER_PARAMETER, **scenario)
+            _, fast_path_costs = device_scheduler(solver_parameter=fast_path, **scenario)
+            assert sum(fast_path_costs) == pytest.approx(sum(costs), abs=1e-2), name
+
+
+def test_given_power_is_priced_without_device_arrays(scenarios):
+    """Pricing a given schedule (e.g. a served baseline) only needs the commitment arrays."""
+    for name, scenario in scenarios.items():
+        data = scheduler_input_arrays(scenario)
+        power = data["power min"]
+        power_per_device, costs = schedule_from_given_power(scenario, power)
+        expected_power_per_device, expected_costs = schedule_from_power(power, data)
+        assert costs == expected_costs, name
+        assert all(p.equals(e) for p, e in zip(power_per_device, expected_power_per_device)), name
+
+
+def test_warm_started_backends():
+    """Warm starts are read from the variable values by cbc and cplex only; highs restarts from its own basis."""
+    assert reads_warmstart("cbc", None) and reads_warmstart("cplex", None)
+    assert not reads_warmstart("highs", None) and not reads_warmstart("glpk", None)
+
+
+def test_solver_calls_are_only_recorded_when_instrumented(scenarios):
+    """Calls on the NumPy path are recorded with the status "fast path", rather than as solved to optimality."""
+    scenario = window(scenarios["Load and generator"], 0, 4)
+    solver_call_log.clear()
+    device_scheduler(solver_parameter=dict(SOLVER_PARAMETER, **{"Fast path": True}), **scenario)
+    assert len(solver_call_log) == 0
+    device_scheduler(
+        solver_parameter=dict(SOLVER_PARAMETER, **{"Fast path": True, "Instrumentation": True}),
+        call_info={"Caller": "Prognosis", "EMS": "EMS 1"},
+        **scenario
+    )
+    assert solver_call_log.to_frame()[["Caller", "Path", "Status"]].values.tolist() == [
+        ["Prognosis", "NumPy", "fast path"]
+    ]
+    solver_call_log.clear()
+
+
+def test_solver_call_summary_and_export(scenarios, tmp_path):
+    """Calls are summarised per caller and path (also without call info), and exported as CSV."""
+    scenario = window(scenarios["Load and generator"], 0, 4)
+    solver_parameter = dict(SOLVER_PARAMETER, **{"Fast path": True, "Instrumentation": True})
+    solver_call_log.clear()
+    device_scheduler(solver_parameter=solver_parameter, call_info={"Caller": "Prognosis", "EMS": "EMS 1"}, **scenario)
+    device_scheduler(solver_parameter=solver_parameter, call_info={"Caller": "Prognosis", "EMS": "EMS 2"}, **scenario)
+    device_scheduler(solver_parameter=solver_parameter, **scenario)
+    log = SolverCallLog()
+    log.extend(solver_call_log.rows)
+    solver_call_log.clear()
+    summary = log.summary()
+    assert summary["Calls"].to_dict() == {("", "NumPy"): 1, ("Prognosis", "NumPy"): 2}
+    file = str(tmp_path / "solver_calls.csv")
+    log.export(file)
+    df = read_csv(file)
+    assert df.columns.tolist() == log.to_frame().columns.tolist()
+    assert df["EMS"].tolist()[:2] == ["EMS 1", "EMS 2"] and len(df) == 3
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from numpy import isnan
+
+from comopt.data_structures.negotiation_log import NegotiationLog
+from comopt.model.negotiation_utils import start_negotiation
+
+start, end, resolution = datetime(2018, 6, 1), datetime(2018, 6, 1, 1), timedelta(minutes=15)
+
+
+def simple_ma_policy(rounds_total: int, rounds_left: int, ma_parameter: dict) -> dict:
+    """Concede one per round from the reservation price minus the markup."""
+    markup = ma_parameter["Markup"] * rounds_left / rounds_total
+    return {
+        "Reservation price": ma_parameter["Reservation price"],
+        "Markup": markup,
+        "Bid": ma_parameter["Reservation price"] - markup,
+    }
+
+
+def simple_ta_policy(description, ta_parameter, plan_board, rounds_total, rounds_left) -> dict:
+    """Concede one per round from the reservation price plus the markup."""
+    markup = ta_parameter["Markup"] * rounds_left / rounds_total
+    return {
+        "Reservation price": ta_parameter["Reservation price"],
+        "Markup": markup,
+        "Bid": ta_parameter["Reservation price"] + markup,
+        "Action": None,
+    }
+
+
+def test_record_writes_through():
+    log = NegotiationLog(start=start, end=end, resolution=resolution, rounds_total=3)
+    record = log.record(datetime(2018, 6, 1, 0, 30), round=2)
+    record["MA bid"] = 10
+    assert log["MA bid"][2, 1] == 10
+    frame = log.to_frame()
+    assert frame.loc[(datetime(2018, 6, 1, 0, 30), 2), "MA bid"] == 10
+    assert frame["MA bid"].count() == 1
+    assert len(frame) == len(log.index) * 3
+
+
+
+def test_out_of_range_records_raise():
+    """Datetimes before the start or after the end (and rounds outside of 1..rounds_total) don't wrap around."""
+    log = NegotiationLog(start=start, end=end, resolution=resolution, rounds_total=3)
+    log.record(end, round=3)["MA bid"] = 10
+    for dt, round in ((start - resolution, 1), (end + resolution, 1), (start, 0), (start, 4)):
+        with pytest.raises(IndexError):
+            log.record(dt, round=round)
+    assert log.to_frame()["MA bid"].count() == 1
+
+def test_negotiation_rounds_are_logged():
+    """Both agents concede each round, so they clear in the second round, and the third round stays empty."""
+    log = NegotiationLog(start=start, end=end, resolution=resolution, rounds_total=3)
+    now = datetime(2018, 6, 1, 0, 15)
+    result = start_negotiation(
+        description="Prognosis",
+        environment_now=now,
+        ta_parameter={
+            "Policy": simple_ta_policy, "Negotiation rounds": 3, "Reservation price": 4, "Markup": 3,
+        },
+        ma_parameter={"Policy": simple_ma_policy, "Reservation price": 8, "Markup": 3},
+        negotiation_log=log,
+        plan_board=None,
+    )
+    frame = log.to_frame().loc[now]
+    assert result == {"Status": "Cleared", "Clearing price": 6}
+    assert frame["MA bid"].tolist()[:2] == [5, 6] and frame["TA bid"].tolist()[:2] == [7, 6]
+    assert frame.loc[1, "TA Counter offer"] == 7 and frame.loc[1, "TA profit"] == 0
+    assert frame.loc[2, "Cleared"] == 1 and isnan(frame.loc[1, "Cleared"])
+    assert frame.loc[2, "TA profit"] == 2 and frame.loc[2, "MA profit"] == 2
+    assert isnan(frame.loc[3]).all()
+    assert isnan(log.to_frame().loc[start, "MA bid"]).all()
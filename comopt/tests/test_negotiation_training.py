@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from numpy import isnan, unique
+from numpy.random import default_rng
+
+from comopt.data_structures.negotiation_log import NegotiationLog
+from comopt.data_structures.q_table import QTable
+from comopt.model.negotiation_training import (
+    NegotiationTrainer,
+    draw_reservation_prices,
+    recorded_reservation_prices,
+)
+from comopt.model.negotiation_utils import linear, root_divided_by_2, gauss_1
+from comopt.policies.adaptive_strategies import (
+    choose_action_randomly_using_uniform,
+    multiply_markup_evenly,
+)
+from comopt.policies.ma_policies import buy_with_stochastic_prices
+from comopt.policies.ta_policies import Q_learning
+
+# The prognosis negotiation parameters of run_manually.py
+ma_parameter = {
+    "Policy": buy_with_stochastic_prices,
+    "Reservation price": 4,
+    "Markup": 1,
+    "Concession": root_divided_by_2,
+    "Noise": gauss_1,
+}
+ta_parameter = {
+    "Policy": Q_learning,
+    "Negotiation rounds": 10,
+    "Reservation price": 2,
+    "Markup": 1,
+    "Concession": linear,
+    "Noise": gauss_1,
+    "Gamma": 0.1,
+    "Alpha": 0.1,
+    "Epsilon": 0.2,
+    "Action function": multiply_markup_evenly,
+    "Exploration function": choose_action_randomly_using_uniform,
+    "Temperature": 1,
+    "UCB constant": 1,
+    "Snapshots": 8,
+    "Step now": 1,
+}
+
+
+def test_recorded_reservation_prices():
+    start = datetime(2018, 6, 1)
+    log = NegotiationLog(start=start, end=start + timedelta(hours=1), resolution=timedelta(minutes=15), rounds_total=3)
+    log.record(start, round=1)["MA reservation price"] = 4
+    log.record(start + timedelta(minutes=30), round=1)["MA reservation price"] = 5
+    log.record(start + timedelta(minutes=30), round=2)["MA reservation price"] = 6
+    assert recorded_reservation_prices(log).tolist() == [4, 5]
+    assert len(recorded_reservation_prices(log, agent="TA")) == 0
+
+
+def test_draw_reservation_prices():
+    random = default_rng(0)
+    assert draw_reservation_prices(3, 4, random).tolist() == [3, 3, 3, 3]
+    assert draw_reservation_prices(lambda random, size: random.normal(5, 1, size), 100, random).mean() == \
+        pytest.approx(5, abs=0.5)
+    resampled = draw_reservation_prices([1, 2, 3], 100, random)
+    assert len(resampled) == 100 and unique(resampled).tolist() == [1, 2, 3]
+
+
+def test_training_updates_the_q_table():
+    """Episodes run past the first round (so later rounds are learned too), and each round played updates the
+    Q-table once. Snapshots are taken over the episodes."""
+    trainer = NegotiationTrainer(
+        description="Prognosis",
+        ta_parameter=ta_parameter,
+        ma_parameter=ma_parameter,
+        ta_reservation_prices=lambda random, size: random.normal(2, 0.5, size),
+        ma_reservation_prices=[2.5, 3, 3.5],
+    )
+    results = trainer.train(episodes=200)
+    assert len(results) == 200
+    assert results["Cleared"].any() and not results["Cleared"].all()
+    assert (isnan(results["Clearing price"]) == ~results["Cleared"]).all()
+    assert (results["TA profit"] >= 0).all()
+    counts = trainer.q_table.action_counts
+    assert counts[0].sum() == 200
+    assert counts.sum() > 200 and (counts[1:].sum(axis=1) > 0).all()
+    assert (trainer.q_table.q_values[1:] != 0).any()
+    assert len(trainer.q_table_snapshots) == 8
+    assert trainer.q_table_snapshots.select(counts=True)[-1][1].sum() == counts.sum()
+
+    # The parameters are copied, so the markups and reservation prices of the simulation stay as they are
+    assert ta_parameter["Reservation price"] == 2 and ma_parameter["Reservation price"] == 4
+    assert ta_parameter["Markup"] == 1 and ma_parameter["Markup"] == 1
+
+
+def test_deploy_writes_the_trained_q_table():
+    trainer = NegotiationTrainer(
+        description="Prognosis",
+        ta_parameter=ta_parameter,
+        ma_parameter=ma_parameter,
+        ta_reservation_prices=2,
+        ma_reservation_prices=4,
+    )
+    trainer.train(episodes=20)
+    actions = multiply_markup_evenly(action=None, markup=None, show_actions=True)
+    q_table = QTable(actions, rounds_total=10)
+    trainer.deploy(SimpleNamespace(get_q_table=lambda description: q_table))
+    assert (q_table.q_values == trainer.q_table.q_values).all()
+    assert (q_table.action_counts == trainer.q_table.action_counts).all()
+    with pytest.raises(Exception):
+        trainer.deploy(SimpleNamespace(get_q_table=lambda description: QTable(actions, rounds_total=5)))
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+from numpy import linspace
+from numpy.random import RandomState
+from pandas import DataFrame
+
+from comopt.data_structures.q_table import QTable, QTableSnapshots, snapshot_steps
+
+actions = {"Lower": -1, "Keep": 0, "Raise": 1}
+rounds_total = 4
+
+
+def update_q_table_df(q_table: DataFrame, action_table: DataFrame, round: int, action: str, reward: float,
+                      alpha: float, gamma: float):
+    """The label-based update of the Q-learning tables (as DataFrames), with no next state after the last round."""
+    next_max = q_table.loc[round + 1, :].max() if round < rounds_total else 0
+    q_table.loc[round, action] = q_table.loc[round, action] + alpha * (
+        reward + gamma * next_max - q_table.loc[round, action]
+    )
+    action_table.loc[round, action] += 1
+
+
+def test_update_matches_label_based_update():
+    random = RandomState(0)
+    q_table = QTable(actions, rounds_total)
+    q_table_df = DataFrame(data=0.0, index=range(1, rounds_total + 1), columns=actions.keys())
+    action_table_df = q_table_df.copy()
+    for _ in range(200):
+        round = random.randint(1, rounds_total + 1)
+        action = random.randint(len(actions))
+        reward = random.choice([0, random.uniform(0, 10)])
+        q_table.update(round, action, reward, alpha=0.1, gamma=0.9)
+        update_q_table_df(q_table_df, action_table_df, round, q_table.actions[action], reward, alpha=0.1, gamma=0.9)
+    assert (q_table.to_frame().values == q_table_df.values).all()
+    assert (q_table.to_frame(counts=True).values == action_table_df.values).all()
+    assert q_table.to_frame().columns.tolist() == list(actions.keys())
+    assert q_table.row(2).tolist() == q_table_df.loc[2].tolist()
+
+
+
+def test_snapshot_steps():
+    assert snapshot_steps(total_steps=100, number=8).tolist() == linspace(1, 100, num=8, dtype="int").tolist()
+    assert snapshot_steps(total_steps=3, number=8).tolist() == [1, 2, 3]
+
+
+def test_snapshots_are_copies_taken_at_their_steps():
+    """Snapshots match copies of the tables taken at the snapshot steps, also after the Q-table is updated further."""
+    random = RandomState(1)
+    q_table = QTable(actions, rounds_total)
+    snapshots = QTableSnapshots(q_table, steps=snapshot_steps(total_steps=50, number=8))
+    expected = dict()
+    for step in range(1, 51):
+        q_table.update(random.randint(1, rounds_total + 1), random.randint(len(actions)), random.uniform(0, 10),
+                       alpha=0.1, gamma=0.9)
+        timeperiod = datetime(2018, 6, 1) + step * timedelta(minutes=15)
+        if snapshots.take(q_table, step=step, timeperiod=timeperiod):
+            expected[step] = (q_table.to_frame(), q_table.to_frame(counts=True), timeperiod)
+    assert list(expected.keys()) == snapshots.steps.tolist() and len(snapshots) == 8
+    for (step, q_values), (_, counts) in zip(snapshots.select(), snapshots.select(counts=True)):
+        assert (q_values == expected[step][0].values).all() and (counts == expected[step][1].values).all()
+    assert snapshots.timeperiods == [expected[step][2] for step in expected]
+    assert [step for step, _ in snapshots.select(number=3)] == [1, 22, 50]
+    df = snapshots.to_frame()
+    assert df.loc[(22, 3)].tolist() == expected[22][0].loc[3].tolist()
+    assert len(df) == 8 * rounds_total
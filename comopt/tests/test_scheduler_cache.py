@@ -0,0 +1,64 @@
+from numpy import allclose
+
+from comopt.solver.ems_solver import device_scheduler
+from comopt.solver.scheduler_cache import SchedulerCache
+from comopt.tests.test_ems_solver import SOLVER_PARAMETER, requires_solver, window
+
+
+class CountingScheduler:
+    """Device scheduler that counts its calls and whether it was handed the scheduler arrays."""
+
+    def __init__(self):
+        self.calls = 0
+        self.calls_with_data = 0
+
+    def __call__(self, data: dict = None, **scheduler_input):
+        self.calls += 1
+        self.calls_with_data += data is not None
+        return device_scheduler(data=data, **scheduler_input)
+
+
+@requires_solver
+def test_cache_hit_for_identical_window(scenarios):
+    """Windows with identical constraints and prices share their solution, indexed to the window of the call."""
+    cache, scheduler = SchedulerCache(size=4), CountingScheduler()
+    scenario = scenarios["Load and generator"]  # Constant load, generation and prices
+    first = window(dict(scenario, solver_parameter=SOLVER_PARAMETER), 0, 4)
+    second = window(dict(scenario, solver_parameter=SOLVER_PARAMETER), 4, 8)
+    first_power, first_costs = cache.schedule(scheduler, **first)
+    second_power, second_costs = cache.schedule(scheduler, **second)
+    assert scheduler.calls == scheduler.calls_with_data == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second_costs == first_costs
+    assert allclose(second_power[0].values, first_power[0].values)
+    assert second_power[0].index.equals(second["ems_constraints"].index)
+
+
+@requires_solver
+def test_cache_miss_for_other_prices_or_solver_flags(scenarios):
+    """Calls with other prices or other solver flags (see DIGEST_PARAMETERS) don't share their solution."""
+    cache, scheduler = SchedulerCache(size=4), CountingScheduler()
+    scenario = window(dict(scenarios["Load and generator"], solver_parameter=SOLVER_PARAMETER), 0, 4)
+    cache.schedule(scheduler, **scenario)
+    cache.schedule(
+        scheduler,
+        **dict(scenario, solver_parameter=dict(SOLVER_PARAMETER, **{"Fast path": True}))
+    )
+    cache.schedule(
+        scheduler,
+        **dict(scenario, commitment_upwards_deviation_price=[
+            price * 2 for price in scenario["commitment_upwards_deviation_price"]
+        ])
+    )
+    assert scheduler.calls == 3 and cache.misses == 3 and cache.hits == 0
+
+
+def test_cache_drops_least_recently_used_solution():
+    cache = SchedulerCache(size=2)
+    for key in ("a", "b"):
+        cache.put(key, ([], [0]))
+    cache.solutions.move_to_end("a")
+    cache.put("c", ([], [0]))
+    assert list(cache.solutions.keys()) == ["a", "c"]
+    cache.clear()
+    assert len(cache.solutions) == 0 and cache.hit_rate == 0
@@ -0,0 +1,190 @@
+"""Compares the vectorized EMS data storage helpers (comopt/model/utils.py) with the row-by-row loops they replaced,
+which are kept here as a reference on a DataFrame log."""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from numpy import array, nan, nan_to_num, where
+from numpy.random import RandomState
+from pandas import DataFrame, IndexSlice, MultiIndex, Series, isnull
+
+from comopt.data_structures.columnar_log import ColumnarLog
+from comopt.model.utils import (
+    initialize_index,
+    initialize_series,
+    store_prices_per_device,
+    store_power_per_device,
+    store_flexibility_per_device,
+    store_contract_costs_per_device,
+    store_requested_power_per_datetime,
+    store_requested_flex_per_datetime,
+    store_power_per_datetime,
+    store_flexibility_per_datetime,
+    store_contract_costs_per_datetime,
+    store_deviation_costs_per_datetime,
+    store_flex_costs_per_datetime,
+    store_commitment_costs_per_datetime,
+)
+
+start, end, resolution = datetime(2018, 6, 1), datetime(2018, 6, 1, 3), timedelta(minutes=15)
+devices = ["Load", "Generator", "Buffer"]
+device_columns = [prefix + column for prefix in ("Prog ", "Plan ") for column in ("power", "flexibility", "contract costs")]
+ems_columns = ["Deviation price up", "Deviation price down", "Feedin price", "Purchase price", "Req power",
+               "Req flexibility", "Plan commitment costs"] + \
+              [prefix + column for prefix in ("Prog ", "Plan ")
+               for column in ("power", "flexibility", "contract costs", "dev costs", "flex costs")]
+
+
+def loop_store_data(self, prefix: str, targeted_power_per_device: list, commitments: list, device_message):
+    """The data storage of EMS.store_data as a loop over datetimes (and devices), on DataFrame logs."""
+    now = self.environment.now
+    device_data, ems_data = self.device_data, self.ems_data
+
+    ems_data.loc[now, "Deviation price up"] = commitments[-1].deviation_cost_curve.gradient_up
+    ems_data.loc[now, "Deviation price down"] = commitments[-1].deviation_cost_curve.gradient_down
+    ems_data.loc[now, "Feedin price"] = commitments[0].deviation_cost_curve.gradient_down
+    ems_data.loc[now, "Purchase price"] = commitments[0].deviation_cost_curve.gradient_up
+
+    for enum, device in enumerate(devices):
+        for index in targeted_power_per_device[0].index:
+            power = targeted_power_per_device[enum][index]
+            device_data.loc[(index, device), prefix + "power"] = power
+
+            prog_power = device_data.loc[(index, device), "Prog power"]
+            plan_power = device_data.loc[(index, device), "Plan power"]
+            if prog_power != power:
+                if "Prog" in prefix and prog_power > power:
+                    device_data.loc[(index, device), prefix + "flexibility"] = prog_power - power
+                elif "Prog" in prefix and prog_power < power:
+                    device_data.loc[(index, device), prefix + "flexibility"] = power - prog_power
+                elif "Plan" in prefix and prog_power > plan_power:
+                    device_data.loc[(index, device), prefix + "flexibility"] = prog_power - plan_power
+                elif "Plan" in prefix and prog_power < plan_power:
+                    device_data.loc[(index, device), prefix + "flexibility"] = plan_power - prog_power
+
+            price = ems_data.loc[now, "Purchase price"] if power >= 0 else ems_data.loc[now, "Feedin price"]
+            device_data.loc[(index, device), prefix + "contract costs"] = power * price
+
+    for index in targeted_power_per_device[0].index:
+        requested_power = commitments[-1].constants.loc[index]
+        if not isnull(requested_power):
+            ems_data.loc[index, "Req power"] = requested_power
+
+        requested_flexibility = device_message.targeted_flexibility.loc[index]
+        if not isnull(requested_flexibility):
+            if isnull(ems_data.loc[index, "Req flexibility"]) or ems_data.loc[index, "Req flexibility"] == 0:
+                ems_data.loc[index, "Req flexibility"] = requested_flexibility
+
+        power = device_data.loc[IndexSlice[index, :], prefix + "power"].sum(axis="index")
+        ems_data.loc[index, prefix + "power"] = power
+
+        if "Plan" in prefix:
+            ems_data.loc[index, prefix + "flexibility"] = device_data.loc[
+                IndexSlice[index, :], prefix + "flexibility"].sum(axis="index", min_count=1)
+        flexibility = ems_data.loc[index, prefix + "flexibility"]
+
+        price = ems_data.loc[now, "Purchase price"] if power >= 0 else ems_data.loc[now, "Feedin price"]
+        ems_data.loc[index, prefix + "contract costs"] = power * price
+
+        if power > requested_power:
+            ems_data.loc[index, prefix + "dev costs"] = (power - requested_power) * ems_data.loc[now, "Deviation price up"]
+        elif power < requested_power:
+            ems_data.loc[index, prefix + "dev costs"] = (requested_power - power) * -1 \
+                                                        * ems_data.loc[now, "Deviation price down"]
+        deviation_costs = ems_data.loc[index, prefix + "dev costs"]
+
+        ems_data.loc[index, prefix + "flex costs"] = abs(flexibility) * self.flex_price
+        ems_data.loc[index, "Plan commitment costs"] = nan_to_num(deviation_costs) \
+                                                       + ems_data.loc[index, prefix + "flex costs"]
+
+
+def vectorized_store_data(self, prefix: str, targeted_power_per_device: list, commitments: list, device_message):
+    """The data storage of EMS.store_data, on ColumnarLogs."""
+    start = targeted_power_per_device[0].index[0]
+    end = targeted_power_per_device[0].index[-1] + resolution
+    targeted_power = array([power.values for power in targeted_power_per_device], dtype="float64").T
+
+    store_prices_per_device(self, commitments=commitments)
+    store_power_per_device(self, prefix=prefix, start=start, end=end, targeted_power=targeted_power)
+    store_flexibility_per_device(self, prefix=prefix, start=start, end=end, targeted_power=targeted_power)
+    store_contract_costs_per_device(self, prefix=prefix, start=start, end=end, targeted_power=targeted_power)
+    requested_power = store_requested_power_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                         commitments=commitments)
+    store_requested_flex_per_datetime(self, prefix=prefix, start=start, end=end, device_message=device_message)
+    power = store_power_per_datetime(self, prefix=prefix, start=start, end=end)
+    flexibility = store_flexibility_per_datetime(self, prefix=prefix, start=start, end=end)
+    store_contract_costs_per_datetime(self, prefix=prefix, start=start, end=end, power_over_all_devices=power)
+    deviation_costs = store_deviation_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                                         power_over_all_devices=power,
+                                                         requested_power=requested_power)
+    flex_costs = store_flex_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                               flexibility_over_all_devices=flexibility)
+    store_commitment_costs_per_datetime(self, prefix=prefix, start=start, end=end,
+                                        flex_costs_over_all_devices=flex_costs,
+                                        deviation_costs_over_all_devices=deviation_costs)
+
+
+def small_integers(random: RandomState, shape, nans: float = 0.2) -> array:
+    """Values in -2..2 (so that equal powers are common), with a share of nan values."""
+    values = random.randint(-2, 3, shape).astype("float64")
+    return where(random.rand(*values.shape) < nans, nan, values)
+
+
+def agents(random: RandomState):
+    """An agent with ColumnarLogs and an agent with DataFrame logs, both with the same random logged values."""
+    environment = SimpleNamespace(now=start, resolution=resolution)
+    vectorized = SimpleNamespace(
+        environment=environment,
+        flex_price=3,
+        device_data=ColumnarLog(device_columns, start, end, resolution, second_index=devices,
+                                index_names=["Datetime", "Device"]),
+        ems_data=ColumnarLog(ems_columns, start, end, resolution, index_names=["Datetime"]),
+    )
+    for column in device_columns:
+        vectorized.device_data[column] = small_integers(random, vectorized.device_data.shape)
+    for column in ems_columns:
+        vectorized.ems_data[column] = small_integers(random, vectorized.ems_data.shape)
+    looped = SimpleNamespace(
+        environment=environment,
+        flex_price=3,
+        device_data=vectorized.device_data.to_frame(),
+        ems_data=vectorized.ems_data.to_frame(),
+    )
+    return vectorized, looped
+
+
+def step_input(random: RandomState, now: datetime, horizon: int):
+    """Targeted power per device, commitments and device message of a step, with random values."""
+    index = initialize_index(now, now + horizon * resolution, resolution)
+    targeted_power_per_device = [Series(small_integers(random, horizon, nans=0), index=index) for _ in devices]
+    contract = SimpleNamespace(deviation_cost_curve=SimpleNamespace(gradient_down=20, gradient_up=32))
+    request = SimpleNamespace(
+        constants=initialize_series(small_integers(random, len(initialize_index(start, end, resolution)), 0.5),
+                                    start, end, resolution),
+        deviation_cost_curve=SimpleNamespace(gradient_down=-random.randint(1, 60), gradient_up=random.randint(1, 60)),
+    )
+    device_message = SimpleNamespace(targeted_flexibility=Series(small_integers(random, horizon, 0.5), index=index))
+    return targeted_power_per_device, [contract, request], device_message
+
+
+def assert_equal_frames(df: DataFrame, expected: DataFrame):
+    df = df.astype("float64")
+    expected = expected[df.columns].astype("float64")
+    assert df.index.equals(expected.index)
+    assert ((df.values == expected.values) | (isnull(df.values) & isnull(expected.values))).all()
+
+
+def test_store_helpers_match_loops():
+    """Each step stores a prognosis and then a plan, as an EMS does, with the same results as the loops."""
+    random = RandomState(0)
+    vectorized, looped = agents(random)
+    horizon = 4
+    for step in range(8):
+        now = start + step * resolution
+        vectorized.environment.now = now
+        for prefix in ("Prog ", "Plan "):
+            targeted_power_per_device, commitments, device_message = step_input(random, now, horizon)
+            vectorized_store_data(vectorized, prefix, targeted_power_per_device, commitments, device_message)
+            loop_store_data(looped, prefix, targeted_power_per_device, commitments, device_message)
+            assert_equal_frames(vectorized.device_data.to_frame(), looped.device_data)
+            assert_equal_frames(vectorized.ems_data.to_frame(), looped.ems_data)
@@ -17,6 +17,7 @@ setup(
         "pulp==1.6.8",
         "pyomo",
         "glpk",
+        "highspy",
         "enlopy",
         "matplotlib==2.2.2",
     ],